@@ -0,0 +1,246 @@
+"""
+端到端基准测试：所有外部服务（B站搜索、混元、edge-tts、Pexels、B站上传）都由本地替身提供，
+素材和配音用 ffmpeg lavfi 合成，在临时目录中跑完整条流水线（python -m pipeline 的同一套代码）再上传，
+统计各阶段的吞吐、延迟分位数、首个视频用时、总用时和峰值内存
+
+结果追加到 benchmarks/results/e2e.jsonl（带提交号），用 --history 对比不同提交的结果
+
+用法:
+python benchmarks/e2e.py --topics 1,10,100 --latency-ms 50 --error-rate 0.02 --throttle-rate 0.05
+python benchmarks/e2e.py --history
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from context import RunContext, load_config, set_context
+import manifest
+from ffmpeg_tools import run_ffmpeg
+from render_stats import RenderStats
+from standins import StandinServer, patch_clients, make_upload_func
+
+RESULTS_PATH = os.path.join(BASE_DIR, 'benchmarks', 'results', 'e2e.jsonl')
+
+STAGES = ['fetch', 'analyze', 'llm', 'tts', 'source', 'render']
+
+# 基准测试固定使用的配置：缩短人为设置的请求间隔，用小尺寸快速编码，避免渲染掩盖其他阶段
+BENCH_CONFIG = {
+    'day_range': 1,
+    'base_sleep_time': 0.05,
+    'pexels_sleep': 0.01,
+    'translate_backends': ['dict'],
+    'render_width': 640,
+    'render_height': 360,
+    'render_fps': 30,
+    'render_backend': 'ffmpeg',
+    'render_profile': 'bench',
+    'render_profiles': {'bench': {'codec': 'libx264', 'preset': 'ultrafast', 'crf': 28, 'threads': 1}},
+    'normalize_clips': False,
+    'cover_on_render': True,
+}
+
+
+def make_fixtures(work_dir, clips, clip_seconds, audio_seconds):
+    """合成素材（640x360）和配音，返回 (素材路径列表, 配音路径)"""
+    clip_paths = []
+    patterns = ['testsrc2', 'smptebars', 'mandelbrot', 'rgbtestsrc']
+    for i in range(clips):
+        path = os.path.join(work_dir, f'clip{i}.mp4')
+        run_ffmpeg([
+            '-f', 'lavfi', '-i', f'{patterns[i % len(patterns)]}=size=640x360:rate=30', '-t', str(clip_seconds),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', path
+        ])
+        clip_paths.append(path)
+    audio_path = os.path.join(work_dir, 'voice.mp3')
+    run_ffmpeg(['-f', 'lavfi', '-i', 'sine=frequency=440', '-t', str(audio_seconds), audio_path])
+    return clip_paths, audio_path
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+    return {'p50': round(pick(0.5), 3), 'p95': round(pick(0.95), 3), 'p99': round(pick(0.99), 3),
+            'max': round(values[-1], 3), 'mean': round(statistics.mean(values), 3)}
+
+
+def instrument(pipeline_cls, latencies):
+    """返回 Pipeline 的子类，各阶段方法记录每次调用的耗时（含等待并发名额的时间）"""
+    timed_cls = type('TimedPipeline', (pipeline_cls,), {})
+    for name in STAGES:
+        method = getattr(pipeline_cls, f'stage_{name}')
+
+        async def timed(self, *args, _method=method, _name=name):
+            start = time.perf_counter()
+            try:
+                return await _method(self, *args)
+            finally:
+                latencies.setdefault(_name, []).append(time.perf_counter() - start)
+        setattr(timed_cls, f'stage_{name}', timed)
+    return timed_cls
+
+
+async def run_uploads(server, context, latencies):
+    import upload
+    videos = sorted(
+        os.path.join(context.videos_out_dir, name) for name in os.listdir(context.videos_out_dir)
+    ) if os.path.exists(context.videos_out_dir) else []
+    pairs = upload.pair_videos_with_datas(videos, manifest.open_manifest(context).metadata())
+    upload_func = make_upload_func(server)
+
+    async def timed_upload(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await upload_func(*args, **kwargs)
+        finally:
+            latencies.setdefault('upload', []).append(time.perf_counter() - start)
+
+    ledger = upload.UploadLedger(os.path.join(context.videos_out_dir, 'upload_ledger.json'))
+    uploader = upload.BatchUploader(None, ledger, context.config.get('upload_max_concurrent', 2), timed_upload)
+    return await uploader.run(pairs)
+
+
+def run_once(topics, args, fixtures):
+    import pipeline
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    clips, audio_path = fixtures
+    server = StandinServer(clips, audio_path, latency=args.latency_ms / 1000, error_rate=args.error_rate,
+                           throttle_rate=args.throttle_rate, pages=args.pages, seed=args.seed)
+    server.start()
+    work_dir = tempfile.mkdtemp(prefix='e2e_run_')
+    try:
+        config = load_config()
+        config.update(BENCH_CONFIG)
+        config.update(server.config_overrides())
+        config.update({
+            'dataset_dir': os.path.join(work_dir, 'datasets'),
+            'source_dir': os.path.join(work_dir, 'sources'),
+            'keywords_num': topics,
+            'max_create_workers': args.render_workers,
+        })
+        context = set_context(RunContext(config))
+        patch_clients(server, topics)
+
+        latencies = {}
+        pipeline_cls = instrument(pipeline.Pipeline, latencies)
+        with RenderStats(f'e2e-{topics}') as stats:
+            start = time.perf_counter()
+            runner = pipeline_cls()
+            outputs = asyncio.run(runner.run())
+            pipeline_seconds = time.perf_counter() - start
+            uploaded = asyncio.run(run_uploads(server, context, latencies))
+            wall_seconds = time.perf_counter() - start
+
+        stages = {}
+        for name in STAGES + ['upload']:
+            values = latencies.get(name, [])
+            stages[name] = {'calls': len(values), 'per_second': round(len(values) / wall_seconds, 3),
+                            **percentiles(values)}
+        return {
+            'topics': topics,
+            'videos': len(outputs),
+            'uploaded': uploaded,
+            'first_video_seconds': round(runner.first_video_time, 2) if runner.first_video_time else None,
+            'pipeline_seconds': round(pipeline_seconds, 2),
+            'wall_seconds': round(wall_seconds, 2),
+            'peak_rss_mb': round(stats.peak_rss / 1024 / 1024, 1),
+            'stages': stages,
+            'standins': server.stats,
+        }
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', '-C', BASE_DIR, 'rev-parse', '--short', 'HEAD'],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def print_result(result):
+    first = result['first_video_seconds']
+    print(f"\n{result['topics']} 个话题: 生成 {result['videos']} 个视频, 上传 {result['uploaded']} 个, "
+          f"首个视频 {first if first is not None else '-'} 秒, 流水线 {result['pipeline_seconds']} 秒, "
+          f"总计 {result['wall_seconds']} 秒, 峰值内存 {result['peak_rss_mb']} MB")
+    print(f"{'阶段':<8}{'次数':>6}{'次/秒':>8}{'p50':>8}{'p95':>8}{'p99':>8}")
+    for name, s in result['stages'].items():
+        if not s['calls']:
+            continue
+        print(f"{name:<8}{s['calls']:>6}{s['per_second']:>8.2f}{s['p50']:>8.2f}{s['p95']:>8.2f}{s['p99']:>8.2f}")
+    print(f"替身请求统计: {json.dumps(result['standins'], ensure_ascii=False)}")
+
+
+def print_history(path):
+    if not os.path.exists(path):
+        print(f"没有历史结果: {path}")
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    print(f"{'时间':<20}{'提交':<10}{'话题':>6}{'视频':>6}{'首个视频':>10}{'流水线':>10}{'峰值MB':>10}")
+    for r in records:
+        first = r['first_video_seconds']
+        print(f"{r['timestamp']:<20}{r['commit']:<10}{r['topics']:>6}{r['videos']:>6}"
+              f"{first if first is not None else '-':>10}{r['pipeline_seconds']:>10}{r['peak_rss_mb']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用本地替身服务的端到端基准测试')
+    parser.add_argument('--topics', default='1,10', help='逗号分隔的话题数，例如 1,10,100')
+    parser.add_argument('--latency-ms', type=float, default=50, help='替身服务的平均延迟（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='替身返回 500 的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='替身返回 412/429 的比例')
+    parser.add_argument('--pages', type=int, default=2, help='B站搜索每个关键词的页数')
+    parser.add_argument('--clips', type=int, default=4, help='合成素材数量')
+    parser.add_argument('--audio-seconds', type=float, default=6, help='合成配音时长（秒）')
+    parser.add_argument('--render-workers', type=int, default=2, help='并行渲染进程数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results', default=RESULTS_PATH, help='结果文件（JSON lines）')
+    parser.add_argument('--history', action='store_true', help='只显示历史结果')
+    parser.add_argument('--verbose', action='store_true', help='显示各阶段的日志')
+    args = parser.parse_args()
+
+    if args.history:
+        print_history(args.results)
+        return
+
+    fixture_dir = tempfile.mkdtemp(prefix='e2e_fixtures_')
+    try:
+        fixtures = make_fixtures(fixture_dir, args.clips, 12, args.audio_seconds)
+        commit = git_commit()
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        for topics in [int(t) for t in args.topics.split(',')]:
+            result = run_once(topics, args, fixtures)
+            result.update({
+                'commit': commit,
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+                'params': {'latency_ms': args.latency_ms, 'error_rate': args.error_rate,
+                           'throttle_rate': args.throttle_rate, 'render_workers': args.render_workers},
+            })
+            print_result(result)
+            with open(args.results, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    finally:
+        shutil.rmtree(fixture_dir, ignore_errors=True)
+    print(f"\n结果已追加到 {args.results}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+编码参数基准测试：用合成样片测试不同 preset、线程数和 CRF 的编码速度与码率，
+推荐满足码率/画质要求且能在时间预算内完成的最快配置档
+
+渲染时有 max_create_workers 个进程同时编码，测试时也同时运行相同数量的编码，
+测得的是每个进程在争用 CPU 时的实际速度
+
+用法:
+python benchmarks/encoder_profiles.py --videos 10 --video-seconds 180 --budget-minutes 60 --max-bitrate 4000
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+from context import load_config
+from ffmpeg_tools import run_ffmpeg, probe_video
+
+
+def make_sample(work_dir, width, height, fps, seconds):
+    """生成近似无损的合成样片，编码测试时包含真实的解码开销"""
+    sample_path = os.path.join(work_dir, 'sample.mp4')
+    run_ffmpeg([
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}', '-t', str(seconds),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0', '-pix_fmt', 'yuv420p', sample_path
+    ])
+    return sample_path
+
+
+def encode(sample_path, out_path, preset, threads, crf):
+    """按给定参数编码样片，返回 (耗时秒, 码率kbps)"""
+    start = time.perf_counter()
+    run_ffmpeg([
+        '-i', sample_path, '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+        '-threads', str(threads), '-pix_fmt', 'yuv420p', '-an', out_path
+    ])
+    elapsed = time.perf_counter() - start
+    duration = probe_video(out_path)['duration'] or 1
+    bitrate = os.path.getsize(out_path) * 8 / duration / 1000
+    return elapsed, bitrate
+
+
+def encode_parallel(sample_path, work_dir, workers, preset, threads, crf):
+    """同时运行 workers 个相同的编码，返回 (最慢的耗时秒, 码率kbps)"""
+    out_paths = [os.path.join(work_dir, f'out-{i}.mp4') for i in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda path: encode(sample_path, path, preset, threads, crf), out_paths))
+    for path in out_paths:
+        os.remove(path)
+    return max(r[0] for r in results), results[0][1]
+
+
+def main():
+    config = load_config()
+    cpu_count = os.cpu_count() or 1
+    workers = config.get('max_create_workers', 1)
+    # 默认只测试不超过每个进程平均 CPU 数的线程数
+    per_worker = max(1, cpu_count // workers)
+
+    parser = argparse.ArgumentParser(description='测试编码参数并推荐渲染配置档')
+    parser.add_argument('--presets', default='ultrafast,superfast,veryfast,faster,fast,medium')
+    parser.add_argument('--threads', default=','.join(str(t) for t in sorted({1, 2, 4, per_worker}) if t <= per_worker))
+    parser.add_argument('--workers', type=int, default=workers, help='同时编码的进程数，默认为配置 max_create_workers')
+    parser.add_argument('--crfs', default='20,23,26')
+    parser.add_argument('--sample-seconds', type=float, default=5, help='样片时长（秒）')
+    parser.add_argument('--videos', type=int, default=config.get('keywords_num', 10), help='每晚渲染的视频数')
+    parser.add_argument('--video-seconds', type=float, default=180, help='每个视频的时长（秒）')
+    parser.add_argument('--budget-minutes', type=float, default=60, help='渲染的时间预算（分钟）')
+    parser.add_argument('--max-bitrate', type=float, default=6000, help='码率上限（kbps）')
+    parser.add_argument('--max-crf', type=int, default=23, help='可接受的最大 CRF（画质下限）')
+    args = parser.parse_args()
+
+    width = config.get('render_width', 1920)
+    height = config.get('render_height', 1080)
+    fps = config.get('render_fps', 30)
+    workers = max(1, args.workers)
+
+    # 满足时间预算需要的每个进程的编码速度（帧/秒，按并行进程数均摊）
+    total_frames = args.videos * args.video_seconds * fps
+    required_fps = total_frames / (args.budget_minutes * 60) / workers
+
+    work_dir = tempfile.mkdtemp(prefix='encoder_bench_')
+    results = []
+    try:
+        sample_path = make_sample(work_dir, width, height, fps, args.sample_seconds)
+        frames = args.sample_seconds * fps
+        print(f"样片: {width}x{height}@{fps}fps {args.sample_seconds} 秒, {workers} 个编码同时运行, "
+              f"每个需要编码速度 ≥ {required_fps:.1f} fps")
+        print(f"{'preset':<10}{'threads':>8}{'crf':>5}{'fps':>9}{'kbps':>9}")
+        for preset, threads, crf in itertools.product(
+            args.presets.split(','),
+            [int(t) for t in args.threads.split(',')],
+            [int(c) for c in args.crfs.split(',')],
+        ):
+            elapsed, bitrate = encode_parallel(sample_path, work_dir, workers, preset, threads, crf)
+            encode_fps = frames / elapsed
+            results.append({'preset': preset, 'threads': threads, 'crf': crf,
+                            'fps': encode_fps, 'bitrate': bitrate})
+            print(f"{preset:<10}{threads:>8}{crf:>5}{encode_fps:>9.1f}{bitrate:>9.0f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # 满足画质和码率要求、并且在时间预算内的配置中选最快的
+    candidates = [
+        r for r in results
+        if r['crf'] <= args.max_crf
+        and r['bitrate'] <= args.max_bitrate
+        and r['fps'] >= required_fps
+    ]
+    if not candidates:
+        print("\n没有配置能同时满足画质/码率要求和时间预算，请放宽条件或增加并行进程数")
+        return
+
+    best = max(candidates, key=lambda r: r['fps'])
+    print(f"\n推荐配置（{best['fps']:.1f} fps, {best['bitrate']:.0f} kbps），写入 config.yaml 的 render_profiles:")
+    print(yaml.safe_dump({'recommended': {
+        'codec': 'libx264', 'preset': best['preset'], 'crf': best['crf'], 'threads': best['threads']
+    }}, default_flow_style=None, allow_unicode=True))
+
+
+if __name__ == '__main__':
+    main()
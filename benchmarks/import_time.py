@@ -0,0 +1,111 @@
+"""
+冷启动基准测试：在新的 Python 进程中分别导入每个阶段模块，统计导入耗时（取中位数），
+可以同时测量某个历史版本（git 提交）做前后对比
+
+用法:
+python benchmarks/import_time.py                 # 只测当前代码
+python benchmarks/import_time.py --rev HEAD~1    # 同时测 HEAD~1 并对比
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ['get_datasets', 'get_tags', 'llm', 'tts', 'source', 'creat_videos', 'upload', 'pipeline']
+
+# 在子进程中运行：导入模块并输出耗时（秒）
+IMPORT_SNIPPET = '''
+import sys, time
+sys.path.insert(0, {tree!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+'''
+
+
+def export_revision(rev, work_dir):
+    """把某个提交的代码导出到临时目录"""
+    tree = os.path.join(work_dir, rev.replace('/', '_').replace('~', '_'))
+    os.makedirs(tree)
+    archive = subprocess.run(['git', '-C', BASE_DIR, 'archive', rev], stdout=subprocess.PIPE, check=True)
+    subprocess.run(['tar', '-x', '-C', tree], input=archive.stdout, check=True)
+    shutil.copy(os.path.join(BASE_DIR, 'config.yaml'), tree)
+    # 旧版本在导入时读取当天的 tags.json / texts.json，准备空文件让它们能导入
+    import yaml
+    with open(os.path.join(tree, 'config.yaml'), 'r', encoding='utf-8') as f:
+        source_dir = yaml.safe_load(f)['source_dir']
+    day_dir = os.path.join(tree, source_dir, time.strftime('%Y-%m-%d', time.localtime()))
+    os.makedirs(day_dir, exist_ok=True)
+    for name in ('tags.json', 'texts.json'):
+        with open(os.path.join(day_dir, name), 'w', encoding='utf-8') as f:
+            f.write('[]')
+    return tree
+
+
+def measure(tree, module, repeat):
+    """返回 (中位数耗时秒, 错误信息)"""
+    if not os.path.exists(os.path.join(tree, f'{module}.py')):
+        return None, '不存在'
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, '-c', IMPORT_SNIPPET.format(tree=tree, module=module)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=tree
+        )
+        if proc.returncode != 0:
+            return None, proc.stderr.decode('utf-8', 'ignore').strip().splitlines()[-1]
+        times.append(float(proc.stdout.decode().strip().splitlines()[-1]))
+    return statistics.median(times), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量各阶段模块的冷启动导入耗时')
+    parser.add_argument('--rev', help='对比的历史版本（git 提交）')
+    parser.add_argument('--repeat', type=int, default=5, help='每个模块导入几次取中位数')
+    parser.add_argument('--modules', default=','.join(STAGES))
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    modules = args.modules.split(',')
+    work_dir = tempfile.mkdtemp(prefix='import_bench_')
+    results = {}
+    try:
+        trees = {'当前': BASE_DIR}
+        if args.rev:
+            trees = {args.rev: export_revision(args.rev, work_dir), '当前': BASE_DIR}
+        for label, tree in trees.items():
+            results[label] = {}
+            for module in modules:
+                seconds, error = measure(tree, module, args.repeat)
+                results[label][module] = {'seconds': seconds, 'error': error}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    labels = list(results)
+    print(f"{'模块':<14}" + ''.join(f'{label:>14}' for label in labels))
+    for module in modules:
+        row = f'{module:<14}'
+        for label in labels:
+            r = results[label][module]
+            row += f"{r['seconds'] * 1000:>12.0f}ms" if r['error'] is None else f"{'失败':>12}"
+        print(row)
+    for label in labels:
+        for module in modules:
+            error = results[label][module]['error']
+            if error:
+                print(f"[{label}] {module}: {error}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
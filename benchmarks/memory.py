@@ -0,0 +1,242 @@
+"""
+内存回归测试：用逐级增大的合成数据运行热点分析（get_tags.analyze_dataset）和渲染（concatenate_videos_with_audio），
+测量峰值 Python 堆内存（tracemalloc）和峰值进程内存（RSS，含 ffmpeg 子进程），
+超过记录的预算一定比例时以非零状态退出
+
+每个用例在单独的子进程中运行，互不影响；预算记录在 benchmarks/memory_budget.json，
+代码有意增加内存时用 --update 重新记录
+
+用法:
+python benchmarks/memory.py                         # 运行全部用例并与预算对比
+python benchmarks/memory.py --cases tags-20k,render-12x720p --margin 0.3
+python benchmarks/memory.py --update                # 把本次结果记录为新的预算
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+BUDGET_PATH = os.path.join(BASE_DIR, 'benchmarks', 'memory_budget.json')
+
+# 用例名 -> (代码路径, 数据规模)
+CASES = {
+    'tags-1k': ('tags', {'rows': 1000, 'tags_per_row': 10}),
+    'tags-20k': ('tags', {'rows': 20000, 'tags_per_row': 20}),
+    'tags-100k': ('tags', {'rows': 100000, 'tags_per_row': 30}),
+    'render-4x360p': ('render', {'clips': 4, 'size': '640x360'}),
+    'render-12x720p': ('render', {'clips': 12, 'size': '1280x720'}),
+    'render-24x1080p': ('render', {'clips': 24, 'size': '1920x1080'}),
+}
+
+# 渲染用例的固定配置：编码用最快的预设，内存主要取决于素材数量和分辨率
+RENDER_CONFIG = {
+    'render_profile': 'memory',
+    'render_profiles': {'memory': {'codec': 'libx264', 'preset': 'ultrafast', 'crf': 28, 'threads': 2}},
+    'render_segments': 1,
+    'cover_on_render': False,
+}
+
+CLIP_SECONDS = 2
+
+
+def make_dataset(path, rows, tags_per_row, seed=0):
+    """合成与 B站搜索结果相同列的数据集，tag 为逗号分隔的字符串（与接口返回的格式一致）"""
+    import pandas as pd
+    rng = random.Random(seed)
+    vocabulary = [f'标签{i}' for i in range(max(100, rows // 5))]
+    typenames = [(f'分区{i}', 100 + i) for i in range(30)]
+    records = []
+    for i in range(rows):
+        typename, typeid = rng.choice(typenames)
+        records.append({
+            'title': f'视频标题{i}',
+            'typename': typename,
+            'typeid': typeid,
+            'tag': ','.join(rng.sample(vocabulary, tags_per_row)),
+            'play': rng.randint(0, 1000000),
+            'favorites': rng.randint(0, 50000),
+        })
+    pd.DataFrame(records).to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def make_clips(work_dir, clips, size):
+    """合成素材和覆盖全部素材时长的配音，返回 (配音路径, 素材目录)"""
+    from ffmpeg_tools import run_ffmpeg
+    source_dir = os.path.join(work_dir, 'clips')
+    os.makedirs(source_dir, exist_ok=True)
+    for i in range(clips):
+        run_ffmpeg([
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30', '-t', str(CLIP_SECONDS),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            os.path.join(source_dir, f'{i}-clip.mp4')
+        ])
+    voice_path = os.path.join(work_dir, 'voice.mp3')
+    run_ffmpeg(['-f', 'lavfi', '-i', 'sine=frequency=440', '-t', str(clips * CLIP_SECONDS), voice_path])
+    return voice_path, source_dir
+
+
+def prepare(name, work_dir):
+    """在父进程中生成用例的输入（不计入测量），返回传给子进程的参数"""
+    kind, params = CASES[name]
+    if kind == 'tags':
+        path = os.path.join(work_dir, f'{name}.csv')
+        make_dataset(path, params['rows'], params['tags_per_row'])
+        return {'dataset': path}
+    voice_path, source_dir = make_clips(work_dir, params['clips'], params['size'])
+    return {'voice': voice_path, 'source_dir': source_dir, 'out': os.path.join(work_dir, 'out.mp4')}
+
+
+def run_case(name, inputs, backend=None):
+    """在子进程中运行：导入完成后开始测量，只统计被测代码本身"""
+    import tracemalloc
+    from context import get_context
+    from render_stats import RenderStats
+    kind, _ = CASES[name]
+    # 不写指标文件，避免在项目的 sources 目录下留下记录
+    get_context().config['metrics_jsonl'] = False
+    if kind == 'tags':
+        import get_tags
+        import pandas  # noqa: F401
+        import sklearn.preprocessing  # noqa: F401
+
+        def target():
+            result = get_tags.analyze_dataset(inputs['dataset'])
+            if 'error' in result:
+                raise RuntimeError(result['error'])
+    else:
+        import creat_videos
+        import moviepy.editor  # noqa: F401
+        get_context().config.update(RENDER_CONFIG)
+        if backend:
+            get_context().config['render_backend'] = backend
+
+        def target():
+            if creat_videos.concatenate_videos_with_audio(inputs['voice'], inputs['source_dir'], inputs['out']) is None:
+                raise RuntimeError('渲染失败')
+
+    with RenderStats(name, sample_interval=0.05) as stats:
+        baseline_rss = stats.process.memory_info().rss
+        tracemalloc.start()
+        try:
+            target()
+            error = None
+        except Exception as e:
+            error = str(e)
+        _, peak_heap = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    record = stats.record
+    return {
+        'case': name,
+        'heap_mb': round(peak_heap / 1024 / 1024, 1),
+        'rss_mb': record['peak_rss_mb'],
+        'children_rss_mb': record['peak_children_rss_mb'],
+        'baseline_rss_mb': round(baseline_rss / 1024 / 1024, 1),
+        'seconds': round(record['wall_seconds'], 2),
+        'error': error,
+    }
+
+
+def measure(name, work_dir, backend=None):
+    inputs = prepare(name, work_dir)
+    args = [sys.executable, os.path.abspath(__file__), '--child', name, '--inputs', json.dumps(inputs)]
+    if backend:
+        args += ['--backend', backend]
+    proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=BASE_DIR)
+    lines = proc.stdout.decode('utf-8', errors='replace').strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        # 被系统结束（例如 OOM）时没有结果
+        return {'case': name, 'error': f'子进程退出码 {proc.returncode}: '
+                                       f"{proc.stderr.decode('utf-8', errors='replace')[-300:]}"}
+    return json.loads(lines[-1])
+
+
+def load_budget(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def check(result, budget, margin):
+    """返回超出预算的指标说明列表"""
+    failures = []
+    if result.get('error'):
+        return [result['error']]
+    for key in ('heap_mb', 'rss_mb'):
+        limit = budget.get(key)
+        if limit is not None and result[key] > limit * (1 + margin):
+            failures.append(f"{key} {result[key]} 比预算 {limit} 高出 {margin:.0%} 以上")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据分析和渲染的内存回归测试')
+    parser.add_argument('--cases', default=','.join(CASES), help='逗号分隔的用例名，默认全部')
+    parser.add_argument('--margin', type=float, default=0.2, help='允许超出预算的比例')
+    parser.add_argument('--budget', default=BUDGET_PATH, help='预算文件')
+    parser.add_argument('--backend', help='渲染方式（moviepy、ffmpeg、concat），默认使用配置 render_backend')
+    parser.add_argument('--update', action='store_true', help='把本次结果记录为新的预算')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--inputs', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # 被测代码的输出重定向到 stderr，stdout 只输出一行结果
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        result = run_case(args.child, json.loads(args.inputs), args.backend)
+        stdout.write(json.dumps(result, ensure_ascii=False) + '\n')
+        return
+
+    names = args.cases.split(',')
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        parser.error(f"未知的用例: {', '.join(unknown)}（可用: {', '.join(CASES)}）")
+
+    budgets = load_budget(args.budget)
+    results = []
+    regressions = 0
+    print(f"{'用例':<18}{'堆MB':>9}{'预算':>9}{'RSS MB':>9}{'预算':>9}{'子进程MB':>10}{'秒':>8}  结果")
+    for name in names:
+        work_dir = tempfile.mkdtemp(prefix='memory_bench_')
+        try:
+            result = measure(name, work_dir, args.backend)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results.append(result)
+        budget = budgets.get(name, {})
+        failures = check(result, budget, args.margin)
+        if failures:
+            regressions += 1
+            status = '失败: ' + '; '.join(failures)
+        else:
+            status = '通过' if budget else '无预算'
+        print(f"{name:<18}{result.get('heap_mb', '-'):>9}{budget.get('heap_mb', '-'):>9}"
+              f"{result.get('rss_mb', '-'):>9}{budget.get('rss_mb', '-'):>9}"
+              f"{result.get('children_rss_mb', '-'):>10}{result.get('seconds', '-'):>8}  {status}")
+
+    if args.update:
+        for result in results:
+            if not result.get('error'):
+                budgets[result['case']] = {'heap_mb': result['heap_mb'], 'rss_mb': result['rss_mb']}
+        with open(args.budget, 'w', encoding='utf-8') as f:
+            json.dump(budgets, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"预算已写入 {args.budget}")
+        return
+
+    if regressions:
+        print(f"\n{regressions} 个用例超出内存预算（允许超出 {args.margin:.0%}）")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
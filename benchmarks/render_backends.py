@@ -0,0 +1,78 @@
+"""
+渲染方式基准测试：用 ffmpeg lavfi 生成合成素材和音频，分别用 moviepy 和 ffmpeg 渲染并对比耗时
+
+用法: python benchmarks/render_backends.py [--clips 6] [--duration 30] [--backends moviepy,ffmpeg]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import creat_videos
+from context import RunContext, load_config, set_context
+from ffmpeg_tools import run_ffmpeg, probe_video
+
+# 合成素材的尺寸，覆盖横屏、竖屏和非16:9的情况
+CLIP_SIZES = ['1920x1080', '1280x720', '1080x1920', '1440x1080', '2560x1080']
+
+
+def make_fixtures(work_dir, clips, clip_seconds, audio_seconds):
+    """生成合成素材和音频，返回 (音频路径, 素材目录)"""
+    source_dir = os.path.join(work_dir, 'clips')
+    os.makedirs(source_dir, exist_ok=True)
+    for i in range(clips):
+        size = CLIP_SIZES[i % len(CLIP_SIZES)]
+        run_ffmpeg([
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30', '-t', str(clip_seconds),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            os.path.join(source_dir, f'{i}-clip.mp4')
+        ])
+    voice_path = os.path.join(work_dir, 'voice.mp3')
+    run_ffmpeg(['-f', 'lavfi', '-i', 'sine=frequency=440', '-t', str(audio_seconds), voice_path])
+    return voice_path, source_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比 moviepy 与 ffmpeg 渲染方式')
+    parser.add_argument('--clips', type=int, default=6, help='合成素材数量')
+    parser.add_argument('--clip-seconds', type=float, default=8, help='每个素材时长（秒）')
+    parser.add_argument('--duration', type=float, default=30, help='音频时长（秒）')
+    parser.add_argument('--backends', default='moviepy,ffmpeg', help='要测试的渲染方式，逗号分隔')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='render_bench_')
+    try:
+        voice_path, source_dir = make_fixtures(work_dir, args.clips, args.clip_seconds, args.duration)
+        print(f"合成素材: {args.clips} 个, 音频 {args.duration} 秒")
+        print(f"{'backend':<10}{'seconds':>10}{'fps':>10}{'size':>12}")
+        for backend in args.backends.split(','):
+            # 每种渲染方式使用独立的上下文：目录指向临时目录，不写指标文件，避免在项目目录下留下记录
+            config = load_config()
+            config.update({
+                'render_backend': backend,
+                'dataset_dir': os.path.join(work_dir, 'datasets'),
+                'source_dir': os.path.join(work_dir, 'sources'),
+                'metrics_jsonl': False,
+            })
+            set_context(RunContext(config))
+            out_path = os.path.join(work_dir, f'out-{backend}.mp4')
+            start = time.perf_counter()
+            result = creat_videos.concatenate_videos_with_audio(voice_path, source_dir, out_path)
+            elapsed = time.perf_counter() - start
+            if result is None:
+                print(f"{backend:<10}{'failed':>10}")
+                continue
+            info = probe_video(out_path)
+            frames = info['duration'] * info['fps']
+            size_mb = os.path.getsize(out_path) / 1024 / 1024
+            print(f"{backend:<10}{elapsed:>10.2f}{frames / elapsed:>10.1f}{size_mb:>10.1f}MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
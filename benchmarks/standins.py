@@ -0,0 +1,252 @@
+"""
+外部服务的本地替身：B站搜索、混元（OpenAI 兼容接口）、edge-tts、Pexels 和B站上传
+
+所有替身在一个后台线程的 aiohttp 服务中运行，可以配置延迟、错误率和限流（412/429）比例，
+并统计每个服务的请求数和注入的错误数。B站和 edge-tts 是库内部发请求，
+用 patch_clients() 把对应的库函数替换为请求本地替身的版本
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+
+from aiohttp import web
+
+# 各服务被限流时返回的状态码
+THROTTLE_STATUS = {
+    'bili_search': 412,
+    'hunyuan': 429,
+    'pexels': 429,
+    'tts': 429,
+    'upload': 412,
+}
+
+
+class StandinServer:
+    """
+    参数:
+    clips: 合成素材路径列表，Pexels 搜索结果和下载都使用这些文件
+    audio_path: 合成配音，edge-tts 替身返回它的内容
+    latency: 平均延迟（秒），实际延迟在 0.5~1.5 倍之间浮动
+    error_rate: 返回 500 的比例
+    throttle_rate: 返回 412/429 的比例
+    pages: B站搜索每个关键词返回几页数据
+    """
+
+    def __init__(self, clips, audio_path, latency=0.05, error_rate=0.0, throttle_rate=0.0, pages=2, seed=0):
+        self.clips = clips
+        with open(audio_path, 'rb') as f:
+            self.audio = f.read()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.pages = pages
+        self.random = random.Random(seed)
+        self.stats = {}
+        self.url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def _count(self, service, key):
+        stats = self.stats.setdefault(service, {'requests': 0, 'errors': 0, 'throttled': 0})
+        stats[key] += 1
+
+    async def _inject(self, service):
+        """模拟延迟并按比例注入错误，返回要直接返回的错误响应或None"""
+        self._count(service, 'requests')
+        await asyncio.sleep(self.latency * (0.5 + self.random.random()))
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            self._count(service, 'throttled')
+            return web.Response(status=THROTTLE_STATUS[service], text='throttled')
+        if roll < self.throttle_rate + self.error_rate:
+            self._count(service, 'errors')
+            return web.Response(status=500, text='injected error')
+        return None
+
+    async def bili_hot(self, request):
+        if (error := await self._inject('bili_search')) is not None:
+            return error
+        count = int(request.query.get('count', 10))
+        return web.json_response({'list': [{'keyword': f'话题{i}'} for i in range(count)]})
+
+    async def bili_search(self, request):
+        if (error := await self._inject('bili_search')) is not None:
+            return error
+        keyword = request.query['keyword']
+        page = int(request.query.get('page', 1))
+        if page > self.pages:
+            return web.json_response({'result': []})
+        rows = []
+        for i in range(20):
+            rows.append({
+                'title': f'{keyword} 视频{page}-{i}',
+                'typename': ['知识', '生活', '科技'][i % 3],
+                'typeid': [36, 160, 188][i % 3],
+                'tag': ','.join(f'{keyword}标签{(i + k) % 12}' for k in range(4)),
+                'play': self.random.randint(1000, 1000000),
+                'favorites': self.random.randint(10, 10000),
+            })
+        return web.json_response({'result': rows})
+
+    async def hunyuan(self, request):
+        if (error := await self._inject('hunyuan')) is not None:
+            return error
+        body = await request.json()
+        system = body['messages'][0]['content']
+        user = body['messages'][-1]['content']
+        if '标题' in system and '文案' in system and len(system) < 60:
+            content = f'标题{abs(hash(user)) % 1000}'
+        else:
+            content = f'这是第{abs(hash(user)) % 1000}段用于基准测试的合成文案，内容没有实际意义。' * 20
+        return web.json_response({
+            'id': 'standin', 'object': 'chat.completion', 'created': int(time.time()), 'model': body.get('model'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': len(system) + len(user), 'completion_tokens': len(content),
+                      'total_tokens': len(system) + len(user) + len(content)},
+        })
+
+    async def tts(self, request):
+        if (error := await self._inject('tts')) is not None:
+            return error
+        return web.Response(body=self.audio, content_type='audio/mpeg')
+
+    async def pexels_search(self, request):
+        if (error := await self._inject('pexels')) is not None:
+            return error
+        videos = []
+        for i, clip in enumerate(self.clips):
+            size = os.path.getsize(clip)
+            videos.append({
+                'id': i, 'duration': 12,
+                'video_files': [{
+                    'id': i, 'quality': 'hd', 'file_type': 'video/mp4', 'width': 640, 'height': 360,
+                    'fps': 30, 'size': size, 'link': f'{self.url}/pexels/files/{i}.mp4',
+                }],
+            })
+        return web.json_response({'total_results': len(videos), 'videos': videos})
+
+    async def pexels_file(self, request):
+        if (error := await self._inject('pexels')) is not None:
+            return error
+        index = int(request.match_info['index'])
+        return web.FileResponse(self.clips[index % len(self.clips)])
+
+    async def upload(self, request):
+        if (error := await self._inject('upload')) is not None:
+            return error
+        size = 0
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+        return web.json_response({'size': size})
+
+    def _app(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_get('/bili/hot', self.bili_hot)
+        app.router.add_get('/bili/search', self.bili_search)
+        app.router.add_post('/hunyuan/chat/completions', self.hunyuan)
+        app.router.add_get('/tts', self.tts)
+        app.router.add_get('/pexels/search', self.pexels_search)
+        app.router.add_get('/pexels/files/{index}.mp4', self.pexels_file)
+        app.router.add_post('/upload/{name}', self.upload)
+        return app
+
+    def start(self):
+        """在后台线程中启动服务，返回根地址"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self._app(), access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            self._loop.run_until_complete(site.start())
+            port = site._server.sockets[0].getsockname()[1]
+            self.url = f'http://127.0.0.1:{port}'
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def config_overrides(self):
+        """让各阶段请求替身的配置"""
+        return {
+            'hunyuan_base_url': f'{self.url}/hunyuan',
+            'hunyuan_api_key': 'standin',
+            'pexels_base_url': f'{self.url}/pexels/search',
+            'pexels_api_key': 'standin',
+        }
+
+
+async def _get(url, params=None):
+    """向替身发 GET 请求，非 200 时抛出与 bilibili_api 相同格式的异常"""
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, params=params) as response:
+            if response.status != 200:
+                raise Exception(f'网络错误，状态码：{response.status}')
+            if response.content_type == 'application/json':
+                return await response.json()
+            return await response.read()
+
+
+def patch_clients(server: StandinServer, hot_count: int):
+    """把 bilibili_api 的搜索和 edge-tts 替换为请求本地替身的版本"""
+    from bilibili_api import search
+    import edge_tts
+
+    async def get_hot_search_keywords():
+        return await _get(f'{server.url}/bili/hot', {'count': hot_count})
+
+    async def search_by_type(keyword, search_type=None, page=1, time_start=None, time_end=None, **kwargs):
+        return await _get(f'{server.url}/bili/search', {'keyword': keyword, 'page': page})
+
+    class Communicate:
+        def __init__(self, text, voice, **kwargs):
+            self.text = text
+
+        async def save(self, path):
+            audio = await _get(f'{server.url}/tts', {'chars': len(self.text)})
+            with open(path, 'wb') as f:
+                f.write(audio)
+
+    search.get_hot_search_keywords = get_hot_search_keywords
+    search.search_by_type = search_by_type
+    edge_tts.Communicate = Communicate
+
+
+def make_upload_func(server: StandinServer, chunk_size: int = 4 * 1024 * 1024):
+    """上传替身，签名与 upload.upload2bili 相同：分块 POST 到本地服务"""
+    import aiohttp
+
+    async def upload_func(video_path, data, credential=None, on_event=None):
+        total = max(1, -(-os.path.getsize(video_path) // chunk_size))
+        async with aiohttp.ClientSession() as session:
+            with open(video_path, 'rb') as f:
+                for number in range(total):
+                    chunk = f.read(chunk_size)
+                    async with session.post(f'{server.url}/upload/{os.path.basename(video_path)}',
+                                            data=chunk) as response:
+                        if response.status != 200:
+                            raise Exception(f'网络错误，状态码：{response.status}')
+                    if on_event is not None:
+                        on_event('AFTER_CHUNK', {'chunk_number': number, 'total_chunk_count': total})
+        if on_event is not None:
+            on_event('PRE_SUBMIT', {})
+        return f'BVstandin{abs(hash(video_path)) % 10 ** 8}'
+
+    return upload_func
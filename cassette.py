@@ -0,0 +1,326 @@
+"""
+网络请求的录制与回放（磁带）
+
+录制模式下，B站热搜和搜索、混元文案、edge-tts 配音、Pexels 搜索和下载的响应都会保存到当天的磁带中；
+回放模式下由磁带返回这些响应，不访问网络也不消耗 API 额度，整天的运行可以离线重放，
+用来分析和调优 get_tags、creat_videos 和素材挑选的性能
+
+磁带目录结构:
+index.jsonl  每次请求一行：服务、请求内容、耗时、响应内容的哈希
+blobs/       响应内容按 sha256 存放（gzip 压缩），相同内容只保存一份
+
+用法:
+python -m pipeline --cassette record                      # 正常运行并录制
+python -m pipeline --cassette replay --day 2025-01-01     # 按录制时的耗时回放
+python -m pipeline --cassette replay --cassette-speed 0   # 不等待，尽快回放
+python cassette.py --day 2025-01-01                       # 查看磁带内容
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import datetime
+import threading
+
+from context import RunContext, config, get_context, set_context
+
+logger = logging.getLogger(__name__)
+
+MODES = ('off', 'record', 'replay')
+
+# 音频和视频几乎压缩不了，用最快的压缩级别
+COMPRESS_LEVEL = {'tts': 1, 'pexels_file': 1}
+
+# 回放下载时按这个间隔（秒）更新进度，对冲下载的测速逻辑与录制时一致
+PROGRESS_INTERVAL = 0.5
+
+
+class Cassette:
+    """
+    参数:
+    path: 磁带目录
+    mode: record 录制；replay 回放
+    speed: 回放速度，1 为按录制时的耗时等待，2 为两倍速，0 为不等待
+    """
+
+    def __init__(self, path: str, mode: str, speed: float = 1.0):
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.index_path = os.path.join(path, 'index.jsonl')
+        self.blobs_dir = os.path.join(path, 'blobs')
+        self.lock = threading.Lock()
+        self.entries = {}  # 请求哈希 -> 按录制顺序排列的记录
+        self.cursors = {}  # 请求哈希 -> 下一次回放第几条记录
+        self.stats = {}
+        if mode == 'replay':
+            self.load()
+        else:
+            os.makedirs(self.blobs_dir, exist_ok=True)
+
+    @staticmethod
+    def request_key(service: str, request: dict) -> str:
+        raw = json.dumps([service, request], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, digest[:2], f'{digest}.gz')
+
+    def put_blob(self, data: bytes, level: int = 6) -> str:
+        """按内容哈希保存响应，返回哈希"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with gzip.open(tmp_path, 'wb', compresslevel=level) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get_blob(self, digest: str) -> bytes:
+        with gzip.open(self.blob_path(digest), 'rb') as f:
+            return f.read()
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            raise FileNotFoundError(f"磁带不存在: {self.index_path}")
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry['key'], []).append(entry)
+        logger.info(f"已加载磁带 {self.path}，共 {sum(len(v) for v in self.entries.values())} 条记录")
+
+    def count(self, service: str, key: str):
+        stats = self.stats.setdefault(service, {'hits': 0, 'misses': 0, 'recorded': 0})
+        stats[key] += 1
+
+    def record(self, service: str, request: dict, elapsed: float, body: bytes = None, error: str = None):
+        """保存一次请求的结果；body 为None且没有 error 表示接口返回了空结果"""
+        entry = {
+            'key': self.request_key(service, request),
+            'service': service,
+            'request': request,
+            'recorded_at': time.time(),
+            'elapsed': round(elapsed, 4),
+            'blob': None,
+            'size': 0,
+            'error': error,
+        }
+        if body is not None:
+            entry['blob'] = self.put_blob(body, COMPRESS_LEVEL.get(service, 6))
+            entry['size'] = len(body)
+        with self.lock:
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.count(service, 'recorded')
+
+    def lookup(self, service: str, request: dict) -> dict:
+        """
+        取出下一条记录：同一请求录制了多次时按录制顺序依次返回，用完后一直返回最后一条
+        """
+        key = self.request_key(service, request)
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                self.count(service, 'misses')
+                raise LookupError(f"磁带中没有该请求的记录: {service} {request}")
+            cursor = self.cursors.get(key, 0)
+            self.cursors[key] = cursor + 1
+            self.count(service, 'hits')
+            return entries[min(cursor, len(entries) - 1)]
+
+    async def wait(self, entry: dict, progress: dict = None):
+        """按回放速度模拟录制时的耗时；progress 不为None时逐步更新已下载字节数"""
+        if self.speed <= 0:
+            if progress is not None:
+                progress['bytes'] += entry['size']
+            return
+        delay = entry['elapsed'] / self.speed
+        if progress is None:
+            await asyncio.sleep(delay)
+            return
+        steps = max(1, int(delay / PROGRESS_INTERVAL))
+        for step in range(steps):
+            await asyncio.sleep(delay / steps)
+            progress['bytes'] = entry['size'] * (step + 1) // steps
+
+
+def default_path(context: RunContext = None) -> str:
+    context = context or get_context()
+    return config.get('cassette_dir') or os.path.join(context.day_dir, 'cassette')
+
+
+def wrap(cassette: Cassette, service: str, func, describe, encode, decode, progress_arg: int = None):
+    """
+    包装一个异步的网络请求函数
+
+    describe(*args, **kwargs) -> 请求内容（决定回放时匹配哪条记录）
+    encode(result, *args, **kwargs) -> 保存的字节（None 表示空结果）
+    decode(body, *args, **kwargs) -> 回放时返回的结果
+    progress_arg: 下载进度字典在位置参数中的序号
+    """
+    async def wrapper(*args, **kwargs):
+        request = describe(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        if cassette.mode == 'replay':
+            entry = cassette.lookup(service, request)
+            progress = args[progress_arg] if progress_arg is not None else None
+            await cassette.wait(entry, progress)
+            if entry['error'] is not None:
+                raise Exception(entry['error'])
+            body = None
+            if entry['blob'] is not None:
+                body = await loop.run_in_executor(None, cassette.get_blob, entry['blob'])
+            return decode(body, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            cassette.record(service, request, time.perf_counter() - start, error=str(e))
+            raise
+        elapsed = time.perf_counter() - start
+
+        def save():
+            cassette.record(service, request, elapsed, body=encode(result, *args, **kwargs))
+        # 压缩和写入在线程池中进行，不阻塞事件循环
+        await loop.run_in_executor(None, save)
+        return result
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def encode_json(result, *args, **kwargs):
+    return None if result is None else json.dumps(result, ensure_ascii=False).encode('utf-8')
+
+
+def decode_json(body, *args, **kwargs):
+    return None if body is None else json.loads(body.decode('utf-8'))
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_file(path, body):
+    with open(path, 'wb') as f:
+        f.write(body)
+    return path
+
+
+def days_ago(day: str) -> int:
+    """B站搜索的时间范围由运行时的日期算出，按距今天数匹配，隔天回放也能命中"""
+    try:
+        return (datetime.date.today() - datetime.date.fromisoformat(day)).days
+    except (TypeError, ValueError):
+        return day
+
+
+def install(cassette: Cassette) -> Cassette:
+    """把各阶段的网络请求函数替换为录制/回放的版本"""
+    from bilibili_api import search
+    import llm
+    import tts
+    import source
+
+    search.get_hot_search_keywords = wrap(
+        cassette, 'bili_hot', search.get_hot_search_keywords,
+        lambda: {}, encode_json, decode_json)
+
+    search.search_by_type = wrap(
+        cassette, 'bili_search', search.search_by_type,
+        lambda keyword, search_type=None, page=1, time_start=None, time_end=None, **kwargs: {
+            'keyword': keyword, 'page': page, 'days_ago': days_ago(time_start)},
+        encode_json, decode_json)
+
+    llm.get_llm_data = wrap(
+        cassette, 'llm', llm.get_llm_data,
+        lambda client, prompt, requirement: {'prompt': prompt, 'requirement': requirement},
+        lambda result, *args: None if result is None else result.encode('utf-8'),
+        lambda body, *args: None if body is None else body.decode('utf-8'))
+
+    tts.get_tts_voice = wrap(
+        cassette, 'tts', tts.get_tts_voice,
+        lambda text, voice_output: {'text': text},
+        lambda result, text, voice_output: None if result is None else read_file(voice_output),
+        lambda body, text, voice_output: None if body is None else write_file(voice_output, body))
+
+    source.pexels_search = wrap(
+        cassette, 'pexels_search', source.pexels_search,
+        lambda tag: {'query': tag}, encode_json, decode_json)
+
+    source.fetch_video_file = wrap(
+        cassette, 'pexels_file', source.fetch_video_file,
+        lambda candidate, save_path, progress: {'url': candidate['file']['link']},
+        lambda result, candidate, save_path, progress: None if result is None else read_file(save_path),
+        lambda body, candidate, save_path, progress: None if body is None else write_file(save_path, body),
+        progress_arg=2)
+
+    logger.info(f"网络请求{'录制到' if cassette.mode == 'record' else '回放自'}磁带 {cassette.path}")
+    return cassette
+
+
+def install_from_config(mode: str = None, speed: float = None) -> Cassette:
+    """按配置（或命令行参数）启用磁带，未启用时返回None"""
+    mode = mode or config.get('cassette_mode', 'off')
+    if mode not in MODES:
+        raise ValueError(f"未知的磁带模式: {mode}（可选: {', '.join(MODES)}）")
+    if mode == 'off':
+        return None
+    speed = speed if speed is not None else config.get('cassette_speed', 1.0)
+    return install(Cassette(default_path(), mode, speed))
+
+
+def summarize(path: str) -> dict:
+    """统计磁带中各服务的请求数、录制耗时和响应大小"""
+    cassette = Cassette(path, 'replay')
+    services = {}
+    blobs = set()
+    for entries in cassette.entries.values():
+        for entry in entries:
+            s = services.setdefault(entry['service'], {'requests': 0, 'unique': 0, 'errors': 0,
+                                                       'seconds': 0.0, 'bytes': 0})
+            s['requests'] += 1
+            s['errors'] += entry['error'] is not None
+            s['seconds'] += entry['elapsed']
+            s['bytes'] += entry['size']
+            if entry['blob'] is not None:
+                blobs.add(entry['blob'])
+        s['unique'] += 1
+    stored = sum(os.path.getsize(cassette.blob_path(digest)) for digest in blobs
+                 if os.path.exists(cassette.blob_path(digest)))
+    return {'services': services, 'blobs': len(blobs), 'stored_bytes': stored}
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='查看网络请求磁带的内容')
+    parser.add_argument('--day', help='哪一天的磁带（YYYY-MM-DD），默认今天')
+    parser.add_argument('--path', help='磁带目录，默认 source_dir/日期/cassette')
+    args = parser.parse_args(argv)
+
+    if args.day:
+        set_context(RunContext(day=args.day))
+    path = args.path or default_path()
+    summary = summarize(path)
+    print(f"磁带: {path}")
+    print(f"{'服务':<14}{'请求':>6}{'不同请求':>10}{'失败':>6}{'录制耗时':>10}{'响应MB':>10}")
+    total_bytes = 0
+    for service, s in sorted(summary['services'].items()):
+        total_bytes += s['bytes']
+        print(f"{service:<14}{s['requests']:>6}{s['unique']:>10}{s['errors']:>6}"
+              f"{s['seconds']:>9.1f}s{s['bytes'] / 1024 / 1024:>10.2f}")
+    print(f"共 {summary['blobs']} 个不同的响应，原始 {total_bytes / 1024 / 1024:.2f} MB，"
+          f"压缩后 {summary['stored_bytes'] / 1024 / 1024:.2f} MB")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,132 @@
+"""
+运行上下文：配置和当天的目录/文件路径
+
+各阶段模块在导入时不再读取配置、切换工作目录或读取当天的数据，
+而是在用到时通过 get_context() 取得当前上下文；需要处理其他日期或使用其他配置时，
+用 set_context(RunContext(...)) 替换
+"""
+import os
+import time
+import json
+import logging
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 这些配置项是相对项目目录的路径，加载时转为绝对路径，与当前工作目录无关
+PATH_KEYS = ('dataset_dir', 'source_dir', 'translate_dict_path', 'translate_cache_path', 'job_queue_path',
+             'cassette_dir', 'keyword_history_path')
+
+
+def load_config(path: str = None) -> dict:
+    """读取 config.yaml（兼容 GBK 编码），并把目录配置转为绝对路径"""
+    path = path or os.path.join(BASE_DIR, 'config.yaml')
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+    except UnicodeDecodeError:
+        with open(path, 'r', encoding='gbk') as f:
+            config = yaml.safe_load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for key in PATH_KEYS:
+        if config.get(key):
+            config[key] = os.path.join(base_dir, config[key])
+    return config
+
+
+class RunContext:
+    """
+    一次运行的上下文：配置 + 日期，各阶段的输入输出路径都由它计算
+
+    参数:
+    config: 配置字典，为None时读取项目目录下的 config.yaml
+    day: 处理哪一天的数据（YYYY-MM-DD），为None时为今天
+    """
+
+    def __init__(self, config: dict = None, day: str = None):
+        self.config = config if config is not None else load_config()
+        self.day = day or time.strftime('%Y-%m-%d', time.localtime())
+
+    @property
+    def dataset_dir(self) -> str:
+        """当天的热点数据集目录"""
+        return f'{self.config["dataset_dir"]}/{self.day}'
+
+    @property
+    def day_dir(self) -> str:
+        """当天的素材目录"""
+        return f'{self.config["source_dir"]}/{self.day}'
+
+    @property
+    def manifest_path(self) -> str:
+        """当天的话题清单（见 manifest.py）"""
+        return f'{self.day_dir}/topics.jsonl'
+
+    @property
+    def tags_path(self) -> str:
+        """旧版本按列表位置对齐的话题元数据，只用于转换为话题清单"""
+        return f'{self.day_dir}/tags.json'
+
+    @property
+    def texts_path(self) -> str:
+        return f'{self.day_dir}/texts.json'
+
+    @property
+    def voices_dir(self) -> str:
+        return f'{self.day_dir}/voices'
+
+    @property
+    def videos_dir(self) -> str:
+        return f'{self.day_dir}/videos'
+
+    @property
+    def videos_out_dir(self) -> str:
+        return f'{self.day_dir}/videos_out'
+
+    @property
+    def reports_dir(self) -> str:
+        return f'{self.day_dir}/reports'
+
+    def read_json(self, path: str, default=None):
+        """读取 JSON 文件，文件不存在时返回 default"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+
+class ConfigView:
+    """模块级的 config：每次访问时读取当前上下文的配置，第一次访问时才加载 config.yaml"""
+
+    def __getitem__(self, key):
+        return get_context().config[key]
+
+    def __contains__(self, key):
+        return key in get_context().config
+
+    def get(self, key, default=None):
+        return get_context().config.get(key, default)
+
+
+_context = None
+
+config = ConfigView()
+
+
+def get_context() -> RunContext:
+    """当前运行上下文，第一次调用时按 config.yaml 和今天的日期创建"""
+    global _context
+    if _context is None:
+        _context = RunContext()
+    return _context
+
+
+def set_context(context: RunContext) -> RunContext:
+    """替换当前运行上下文（例如重跑某一天的数据），返回新的上下文"""
+    global _context
+    _context = context
+    return context
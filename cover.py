@@ -0,0 +1,100 @@
+import os
+import logging
+import subprocess
+
+import numpy as np
+
+from ffmpeg_tools import get_ffmpeg_exe, probe_video, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# 打分用的缩略图尺寸
+SCORE_WIDTH = 320
+SCORE_HEIGHT = 180
+
+
+def cover_path_for(video_path: str) -> str:
+    """封面缓存路径：与视频同目录，例如 0.mp4 -> 0.cover.jpg"""
+    return f'{os.path.splitext(video_path)[0]}.cover.jpg'
+
+
+def seek_args(video_path: str, position: float, keyframes_only: bool = True) -> list:
+    """定位到 position 的输入参数，keyframes_only 时只解码关键帧"""
+    args = ['-skip_frame', 'nokey'] if keyframes_only else []
+    return args + ['-ss', f'{position:.3f}', '-i', video_path]
+
+
+def grab_keyframe_gray(video_path: str, position: float, keyframes_only: bool = True) -> np.ndarray:
+    """
+    只解码 position 附近的一个关键帧，返回缩小后的灰度图
+    position 之后没有关键帧（短视频或关键帧间隔很大）时返回None
+    """
+    cmd = [
+        get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error',
+        *seek_args(video_path, position, keyframes_only),
+        '-frames:v', '1', '-vf', f'scale={SCORE_WIDTH}:{SCORE_HEIGHT}',
+        '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1'
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0 or len(proc.stdout) < SCORE_WIDTH * SCORE_HEIGHT:
+        return None
+    return np.frombuffer(proc.stdout[:SCORE_WIDTH * SCORE_HEIGHT], dtype=np.uint8).reshape(SCORE_HEIGHT, SCORE_WIDTH)
+
+
+def score_frame(gray: np.ndarray) -> float:
+    """
+    封面打分：清晰度（拉普拉斯方差）乘以亮度系数（过暗或过曝的帧得分降低）
+    """
+    img = gray.astype(np.float32)
+    laplacian = (img[1:-1, :-2] + img[1:-1, 2:] + img[:-2, 1:-1] + img[2:, 1:-1] - 4 * img[1:-1, 1:-1])
+    sharpness = laplacian.var()
+    brightness = img.mean() / 255
+    brightness_factor = max(0.0, 1 - abs(brightness - 0.5) * 2) ** 0.5
+    return float(sharpness * brightness_factor)
+
+
+def extract_cover(video_path: str, candidates: int = 6, out_path: str = None) -> str:
+    """
+    在视频 10%~90% 的位置取若干关键帧打分，选出最好的一帧写成 JPEG 封面
+
+    返回:
+    str: 封面路径
+    """
+    out_path = out_path or cover_path_for(video_path)
+    duration = probe_video(video_path)['duration'] or 0
+    positions = [duration * (0.1 + 0.8 * i / max(candidates - 1, 1)) for i in range(candidates)]
+
+    best_position, best_score = positions[0] if positions else 0, -1
+    # 先只解码关键帧，一个都取不到时退回正常解码
+    for keyframes_only in (True, False):
+        for position in positions:
+            gray = grab_keyframe_gray(video_path, position, keyframes_only)
+            if gray is None:
+                continue
+            score = score_frame(gray)
+            if score > best_score:
+                best_position, best_score = position, score
+                best_keyframes_only = keyframes_only
+        if best_score >= 0:
+            break
+    else:
+        best_keyframes_only = False
+
+    tmp_path = f'{out_path[:-4]}.tmp.jpg'
+    run_ffmpeg([
+        *seek_args(video_path, best_position, best_keyframes_only),
+        '-frames:v', '1', '-q:v', '2', tmp_path
+    ])
+    if not os.path.exists(tmp_path):
+        raise RuntimeError(f"未能从 {video_path} 的 {best_position:.1f} 秒处取到画面")
+    os.replace(tmp_path, out_path)
+    logger.info(f"封面已生成: {out_path}（{best_position:.1f} 秒, 得分 {best_score:.0f}）")
+    return out_path
+
+
+def get_cover(video_path: str) -> str:
+    """获取视频封面，缓存的封面比视频新时直接使用，否则重新生成"""
+    cover_path = cover_path_for(video_path)
+    if os.path.exists(cover_path) and os.path.getmtime(cover_path) >= os.path.getmtime(video_path):
+        return cover_path
+    return extract_cover(video_path, out_path=cover_path)
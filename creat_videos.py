@@ -1,33 +1,47 @@
 import os
+import sys
 import glob
-import yaml
+import json
+import hashlib
 import time
 import gc
 import psutil
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from ffmpeg_tools import (normalize_clip, normalize_params, probe_video, concat_copy, load_clip_index, file_digest,
+                          build_filtergraph_command, render_geometry, run_ffmpeg)
+from render_stats import RenderStats, phase
+from context import config, get_context, set_context
+from manifest import open_manifest
+from locks import file_lock
+import metrics
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+def get_render_profile(name=None):
+    """
+    读取渲染配置档（config.yaml 的 render_profiles），缺省的参数使用默认值
+    """
+    name = name or config.get('render_profile', 'default')
+    profiles = config.get('render_profiles') or {}
+    if name not in profiles and name != 'default':
+        print(f"渲染配置档 {name} 不存在，使用默认配置")
+    profile = {
+        'codec': 'libx264',
+        'preset': 'medium',
+        'crf': 23,
+        'threads': 2,
+    }
+    profile.update(profiles.get(name) or {})
+    return profile
 
-# 加载配置 - 修复编码问题
-config = {}
-try:
-    with open('config.yaml', 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
-except UnicodeDecodeError:
-    try:
-        with open('config.yaml', 'r', encoding='gbk') as f:
-            config = yaml.safe_load(f)
-    except Exception as e:
-        print(f"读取配置文件失败: {e}")
-        exit(1)
-except Exception as e:
-    print(f"读取配置文件失败: {e}")
-    exit(1)
+# 编码参数（moviepy 和 ffmpeg 两种渲染方式共用），第一次使用时按配置档读取
+encoder_settings = None
 
-today = time.strftime("%Y-%m-%d", time.localtime())
-voices_folder = f'{config["source_dir"]}/{today}/voices'
-videos_folder = f'{config["source_dir"]}/{today}/videos'
-videos_out_folder = f'{config["source_dir"]}/{today}/videos_out'
+def get_encoder_settings():
+    global encoder_settings
+    if encoder_settings is None:
+        encoder_settings = get_render_profile()
+    return encoder_settings
 
 # 内存管理函数
 def memory_usage():
@@ -91,103 +105,278 @@ def resize_and_crop_video(clip, target_aspect_ratio=16/9):
             crop_y = (original_height - target_height) // 2
             return clip.crop(y1=crop_y, y2=crop_y + target_height)
 
+def plan_timeline(durations, audio_duration):
+    """
+    根据素材时长规划拼接顺序
+    按顺序使用素材直到总时长覆盖音频；不够时从第一个素材开始循环，最后一段只截取需要的部分
+    
+    返回: [(素材序号, 使用时长), ...]
+    """
+    plan = []
+    total_duration = 0
+    for index, duration in enumerate(durations):
+        if total_duration >= audio_duration:
+            break
+        plan.append((index, duration))
+        total_duration += duration
+    
+    # 所有素材总时长仍然不够时循环使用
+    if total_duration < audio_duration and sum(durations) > 0:
+        remaining_duration = audio_duration - total_duration
+        clip_index = 0
+        while remaining_duration > 0:
+            index = clip_index % len(durations)
+            duration = durations[index]
+            if duration > remaining_duration:
+                plan.append((index, remaining_duration))
+                remaining_duration = 0
+            elif duration > 0:
+                plan.append((index, duration))
+                remaining_duration -= duration
+            clip_index += 1
+    
+    return plan
+
+def render_concat(voice_path, source_dir, video_out_path):
+    """
+    使用规范化素材渲染：素材已在入库时转码为统一格式，这里只做流复制拼接并混入音频
+    """
+    params = normalize_params(config)
+    cache_dir = os.path.join(config['source_dir'], 'normalized')
+    
+    video_files = sorted(glob.glob(os.path.join(source_dir, "*.mp4")))
+    if not video_files:
+        print("素材文件夹中没有找到MP4文件")
+        return None
+    
+    # 入库时已规范化的素材直接命中缓存
+    normalized = []
+    with phase('normalize'):
+        for video_file in video_files:
+            try:
+                normalized.append(normalize_clip(video_file, cache_dir, params))
+            except Exception as e:
+                print(f"规范化视频 {video_file} 时出错: {e}")
+    if not normalized:
+        print("没有可用的规范化素材")
+        return None
+    
+    with phase('probe'):
+        audio_duration = probe_video(voice_path)['duration']
+        durations = [probe_video(path)['duration'] for path in normalized]
+        plan = plan_timeline(durations, audio_duration)
+    print(f"音频长度: {audio_duration} 秒, 将使用 {len(plan)} 个规范化片段进行流复制拼接")
+    
+    os.makedirs(os.path.dirname(os.path.abspath(video_out_path)), exist_ok=True)
+    with phase('encode'):
+        concat_copy([normalized[index] for index, _ in plan], voice_path, video_out_path, audio_duration)
+    print(f"视频已保存到: {video_out_path}")
+    return video_out_path
+
+def render_filtergraph(voice_path, source_dir, video_out_path):
+    """
+    用一条 ffmpeg filter_complex 命令完成裁剪、拼接、混音和编码，帧数据不经过 Python
+    """
+    with phase('probe'):
+        clips = probe_clips(source_dir)
+        if not clips:
+            return None
+        
+        audio_duration = probe_video(voice_path)['duration']
+        plan = plan_timeline([clip['duration'] for clip in clips], audio_duration)
+    print(f"音频长度: {audio_duration} 秒, 将使用 {len(plan)} 个视频片段进行拼接")
+    
+    os.makedirs(os.path.dirname(os.path.abspath(video_out_path)), exist_ok=True)
+    print("正在输出视频...")
+    with phase('encode'):
+        run_ffmpeg(build_filtergraph_command(
+            clips, plan, voice_path, video_out_path, audio_duration, get_encoder_settings()
+        ))
+    print(f"视频已保存到: {video_out_path}")
+    return video_out_path
+
+def probe_clips(source_dir):
+    """
+    读取素材文件夹中所有MP4的元数据，返回可用素材列表（按文件名排序）
+    元数据缓存在文件夹的索引文件中，文件未变化时不会重新读取
+    """
+    video_files = sorted(glob.glob(os.path.join(source_dir, "*.mp4")))
+    if not video_files:
+        print("素材文件夹中没有找到MP4文件")
+        return []
+    
+    clips = []
+    for info in load_clip_index(source_dir, video_files):
+        if info.get('error'):
+            print(f"读取视频 {info['path']} 信息时出错: {info['error']}")
+        elif not info['width'] or not info['duration']:
+            print(f"视频 {info['path']} 没有可用的视频流")
+        else:
+            clips.append(info)
+    if not clips:
+        print("没有成功加载任何视频")
+    return clips
+
+def split_plan(plan, segments):
+    """在素材边界处把拼接计划切成时长尽量均匀的若干段"""
+    total_duration = sum(used for _, used in plan)
+    target = total_duration / segments
+    parts, current, current_duration = [], [], 0
+    for entry in plan:
+        current.append(entry)
+        current_duration += entry[1]
+        if current_duration >= target and len(parts) < segments - 1:
+            parts.append(current)
+            current, current_duration = [], 0
+    if current:
+        parts.append(current)
+    return parts
+
+def render_segmented(voice_path, source_dir, video_out_path, segments):
+    """
+    分段并行渲染单个视频：在素材边界处切分时间线，每段由独立的 ffmpeg 进程用相同的编码参数编码，
+    最后流复制拼接各段并一次性混入音频
+    """
+    with phase('probe'):
+        clips = probe_clips(source_dir)
+        if not clips:
+            return None
+        
+        audio_duration = probe_video(voice_path)['duration']
+        plan = plan_timeline([clip['duration'] for clip in clips], audio_duration)
+        parts = split_plan(plan, segments)
+        geometry = render_geometry(clips, plan)
+    
+    # 编码线程在各段之间平分
+    segment_encoder = dict(get_encoder_settings())
+    segment_encoder['threads'] = max(1, (os.cpu_count() or 1) // len(parts))
+    print(f"音频长度: {audio_duration} 秒, 将 {len(plan)} 个视频片段分成 {len(parts)} 段并行编码")
+    
+    os.makedirs(os.path.dirname(os.path.abspath(video_out_path)), exist_ok=True)
+    segment_paths = [f'{video_out_path}.seg{n}.mp4' for n in range(len(parts))]
+    try:
+        with phase('encode'), ThreadPoolExecutor(max_workers=len(parts)) as pool:
+            futures = [
+                pool.submit(run_ffmpeg, build_filtergraph_command(
+                    clips, part, None, segment_path, None, segment_encoder, geometry
+                ))
+                for part, segment_path in zip(parts, segment_paths)
+            ]
+            for future in futures:
+                future.result()
+        
+        with phase('concat'):
+            concat_copy(segment_paths, voice_path, video_out_path, audio_duration)
+    finally:
+        for segment_path in segment_paths:
+            if os.path.exists(segment_path):
+                os.remove(segment_path)
+    
+    print(f"视频已保存到: {video_out_path}")
+    return video_out_path
+
+# 可选的渲染方式（moviepy 为默认的逐帧合成）
+render_backends = {
+    'concat': render_concat,
+    'ffmpeg': render_filtergraph,
+}
+
+@metrics.traced('render')
 def concatenate_videos_with_audio(voice_path, source_dir, video_out_path):
     """
     同步拼接视频并以音频长度为基准
     """
+    segments = config.get('render_segments', 1)
+    if segments > 1:
+        try:
+            return render_segmented(voice_path, source_dir, video_out_path, segments)
+        except Exception as e:
+            print(f"处理视频时出错: {e}")
+            return None
+    
+    backend = render_backends.get(config.get('render_backend', 'moviepy'))
+    if backend is not None:
+        try:
+            return backend(voice_path, source_dir, video_out_path)
+        except Exception as e:
+            print(f"处理视频时出错: {e}")
+            return None
+    
+    from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
+    encoder_settings = get_encoder_settings()
+    
     # 检查内存使用
     if check_memory_usage():
         print("内存使用率过高，等待释放...")
         time.sleep(5)
         gc.collect()
     
+    video_clips = {}  # 素材序号 -> 已打开的视频
     try:
-        # 获取音频文件
-        audio_clip = AudioFileClip(voice_path)
-        audio_duration = audio_clip.duration
-        print(f"音频长度: {audio_duration} 秒, 当前内存使用: {memory_usage():.2f} MB")
-        
-        # 获取素材文件夹中的所有MP4文件并按文件名排序
-        video_files = sorted(glob.glob(os.path.join(source_dir, "*.mp4")))
-        if not video_files:
-            print("素材文件夹中没有找到MP4文件")
-            return None
-        
-        print(f"找到 {len(video_files)} 个视频文件")
+        with phase('probe'):
+            # 获取音频文件
+            audio_clip = AudioFileClip(voice_path)
+            audio_duration = audio_clip.duration
+            print(f"音频长度: {audio_duration} 秒, 当前内存使用: {memory_usage():.2f} MB")
+            
+            # 先用元数据索引规划，不打开任何视频
+            clips = probe_clips(source_dir)
+            if not clips:
+                return None
+            print(f"找到 {len(clips)} 个视频文件")
+            
+            # 规划拼接顺序：按顺序使用素材直到覆盖音频，不够时循环使用
+            plan = plan_timeline([clip['duration'] for clip in clips], audio_duration)
+        total_video_duration = sum(clip['duration'] for clip in clips)
+        if total_video_duration < audio_duration:
+            print(f"所有视频总时长 ({total_video_duration} 秒) 小于音频时长，将循环使用视频")
         
-        # 加载所有视频文件并关闭声音，同时调整尺寸
-        video_clips = []
-        for video_file in video_files:
-            try:
-                # 检查内存使用
-                if check_memory_usage(85):
-                    print("内存使用率过高，等待释放...")
-                    time.sleep(3)
-                    gc.collect()
-                
-                clip = VideoFileClip(video_file)
-                clip = clip.without_audio()
-                # 调整视频尺寸以保持16:9宽高比
-                clip = resize_and_crop_video(clip)
-                video_clips.append(clip)
-                print(f"加载并调整视频: {os.path.basename(video_file)}, 时长: {clip.duration} 秒, 尺寸: {clip.size}, 内存使用: {memory_usage():.2f} MB")
-                
-                # 及时释放资源
-                if len(video_clips) % 3 == 0:
-                    gc.collect()
+        # 只打开被选中的视频文件，关闭声音并调整尺寸
+        with phase('open'):
+            for clip_index in sorted(set(index for index, _ in plan)):
+                video_file = clips[clip_index]['path']
+                try:
+                    # 检查内存使用
+                    if check_memory_usage(85):
+                        print("内存使用率过高，等待释放...")
+                        time.sleep(3)
+                        gc.collect()
                     
-            except Exception as e:
-                print(f"加载视频 {video_file} 时出错: {e}")
+                    clip = VideoFileClip(video_file, audio=False)
+                    # 调整视频尺寸以保持16:9宽高比
+                    clip = resize_and_crop_video(clip)
+                    video_clips[clip_index] = clip
+                    print(f"加载并调整视频: {os.path.basename(video_file)}, 时长: {clip.duration} 秒, 尺寸: {clip.size}, 内存使用: {memory_usage():.2f} MB")
+                    
+                except Exception as e:
+                    print(f"加载视频 {video_file} 时出错: {e}")
         
         if not video_clips:
             print("没有成功加载任何视频")
             return None
         
-        # 计算需要的视频总时长
-        total_video_duration = 0
         needed_clips = []
-        
-        # 按顺序添加视频，直到总时长超过音频时长
-        for clip in video_clips:
-            if total_video_duration >= audio_duration:
-                break
-                
-            needed_clips.append(clip)
-            total_video_duration += clip.duration
-        
-        # 如果所有视频的总时长仍然不够，循环使用视频
-        if total_video_duration < audio_duration:
-            print(f"所有视频总时长 ({total_video_duration} 秒) 小于音频时长，将循环使用视频")
-            
-            # 计算还需要多少时长
-            remaining_duration = audio_duration - total_video_duration
-            
-            # 从第一个视频开始循环添加，直到满足时长要求
-            clip_index = 0
-            while remaining_duration > 0 and video_clips:
-                clip = video_clips[clip_index % len(video_clips)]
-                
-                # 如果当前视频时长大于剩余需要时长，则截取部分视频
-                if clip.duration > remaining_duration:
-                    partial_clip = clip.subclip(0, remaining_duration)
-                    needed_clips.append(partial_clip)
-                    remaining_duration = 0
-                else:
-                    needed_clips.append(clip)
-                    remaining_duration -= clip.duration
-                
-                clip_index += 1
+        for clip_index, used_duration in plan:
+            clip = video_clips.get(clip_index)
+            if clip is None:
+                continue
+            # 只用到一部分的素材截取前段
+            if used_duration < clip.duration:
+                needed_clips.append(clip.subclip(0, used_duration))
+            else:
+                needed_clips.append(clip)
         
         print(f"将使用 {len(needed_clips)} 个视频片段进行拼接")
         
-        # 拼接视频
-        if len(needed_clips) == 1:
-            final_clip = needed_clips[0]
-        else:
-            final_clip = concatenate_videoclips(needed_clips, "compose")
-        
-        # 设置音频
-        final_clip = final_clip.set_audio(audio_clip)
+        with phase('compose'):
+            # 拼接视频
+            if len(needed_clips) == 1:
+                final_clip = needed_clips[0]
+            else:
+                final_clip = concatenate_videoclips(needed_clips, "compose")
+            
+            # 设置音频
+            final_clip = final_clip.set_audio(audio_clip)
         
         # 确保输出目录存在
         os.makedirs(os.path.dirname(os.path.abspath(video_out_path)), exist_ok=True)
@@ -195,17 +384,18 @@ def concatenate_videos_with_audio(voice_path, source_dir, video_out_path):
         # 输出视频
         print("正在输出视频...")
         
-        # 输出视频
-        final_clip.write_videofile(
-            video_out_path,
-            codec='libx264',
-            audio_codec='aac',
-            threads=2,
-            preset='medium',
-            ffmpeg_params=['-crf', '23'],
-            verbose=False,
-            logger=None
-        )
+        # 输出视频（moviepy 的解码和合成发生在逐帧输出时，计入 encode 阶段）
+        with phase('encode'):
+            final_clip.write_videofile(
+                video_out_path,
+                codec=encoder_settings['codec'],
+                audio_codec='aac',
+                threads=encoder_settings['threads'],
+                preset=encoder_settings['preset'],
+                ffmpeg_params=['-crf', str(encoder_settings['crf'])],
+                verbose=False,
+                logger=None
+            )
         
         print(f"视频已保存到: {video_out_path}")
         return video_out_path
@@ -220,7 +410,7 @@ def concatenate_videos_with_audio(voice_path, source_dir, video_out_path):
         except:
             pass
         
-        for clip in video_clips:
+        for clip in video_clips.values():
             try:
                 clip.close()
             except:
@@ -234,53 +424,60 @@ def concatenate_videos_with_audio(voice_path, source_dir, video_out_path):
         # 强制垃圾回收
         gc.collect()
 
-def get_sorted_folders(folder_path):
-    """
-    获取文件夹中按数字顺序排序的子文件夹列表
-    """
-    # 获取所有子文件夹
-    subfolders = [f for f in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, f))]
-    
-    # 按数字顺序排序
-    try:
-        subfolders.sort(key=lambda x: int(x))
-    except ValueError:
-        # 如果文件夹名不是纯数字，则按字母顺序排序
-        subfolders.sort()
-    
-    return subfolders
-
-def get_sorted_files(folder_path, extension=".mp3"):
-    """
-    获取文件夹中按数字顺序排序的文件列表
-    """
-    # 获取所有指定扩展名的文件
-    files = [f for f in os.listdir(folder_path) if f.endswith(extension)]
-    
-    # 按数字顺序排序（基于文件名中的数字部分）
-    try:
-        files.sort(key=lambda x: int(os.path.splitext(x)[0]))
-    except ValueError:
-        # 如果文件名不是纯数字，则按字母顺序排序
-        files.sort()
-    
-    return files
-
-def process_single_video(i, audio_file, video_folder):
+def process_single_video(i, audio_file, video_folder, threads=None, report_path=None):
     """
     处理单个视频的同步函数
+    
+    参数:
+    report_path: 渲染统计报告（JSON lines），为None时不写报告
     """
     print(f"\n开始处理第 {i} 组: 音频 '{audio_file}' 和视频文件夹 '{video_folder}'")
     
-    voice_path = os.path.join(voices_folder, audio_file)
-    source_dir = os.path.join(videos_folder, video_folder)
+    # 并行渲染时由调度器分配编码线程数
+    if threads:
+        get_encoder_settings()['threads'] = threads
+    
+    context = get_context()
+    voice_path = os.path.join(context.voices_dir, audio_file)
+    source_dir = os.path.join(context.videos_dir, video_folder)
     
     # 创建输出文件名
     output_filename = f"{i}.mp4"
-    video_out_path = os.path.join(videos_out_folder, output_filename)
+    video_out_path = os.path.join(context.videos_out_dir, output_filename)
     
-    # 处理视频
-    result = concatenate_videos_with_audio(voice_path, source_dir, video_out_path)
+    # 先写入临时文件，完成后原子重命名，崩溃时不会留下看似完整的输出
+    part_path = os.path.join(context.videos_out_dir, f"{i}{PART_SUFFIX}")
+    with metrics.trace(i), RenderStats(i, report_path) as stats:
+        stats.set(backend=config.get('render_backend', 'moviepy'),
+                  segments=config.get('render_segments', 1),
+                  threads=get_encoder_settings()['threads'],
+                  clips=len(glob.glob(os.path.join(source_dir, "*.mp4"))))
+        result = concatenate_videos_with_audio(voice_path, source_dir, part_path)
+        if result is not None:
+            os.replace(part_path, video_out_path)
+            result = video_out_path
+            info = probe_video(video_out_path)
+            stats.set(status='ok', output_seconds=info['duration'],
+                      frames=int(info['duration'] * (info['fps'] or 0)))
+            # 渲染完成后顺便生成封面，上传时不需要再解码视频
+            if config.get('cover_on_render', True):
+                with phase('cover'):
+                    try:
+                        from cover import extract_cover
+                        extract_cover(video_out_path)
+                    except Exception as e:
+                        print(f"生成封面失败: {e}")
+        else:
+            stats.set(status='failed')
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    
+    if result is not None:
+        metrics.inc('render_frames_total', stats.record.get('frames', 0))
+        if stats.record.get('encode_fps'):
+            metrics.observe('render_fps', stats.record['encode_fps'], backend=stats.record['backend'])
+    # 渲染可能在子进程中进行，每个视频完成后写入计数
+    metrics.flush()
     
     # 处理完成后强制垃圾回收
     gc.collect()
@@ -288,10 +485,200 @@ def process_single_video(i, audio_file, video_folder):
     print(f"完成第 {i} 组处理")
     return result
 
-def main():
+PART_SUFFIX = '.part.mp4'
+MANIFEST_NAME = 'manifest.json'
+
+def render_input_key(audio_file, video_folder):
+    """
+    计算渲染输入的哈希：音频内容、按顺序的素材内容、拼接计划和编码参数
+    输入不变时输出也不变，可以跳过重新渲染
+    """
+    context = get_context()
+    voice_path = os.path.join(context.voices_dir, audio_file)
+    source_dir = os.path.join(context.videos_dir, video_folder)
+    clips = probe_clips(source_dir)
+    audio_duration = probe_video(voice_path)['duration']
+    backend = config.get('render_backend', 'moviepy')
+    payload = {
+        'audio': file_digest(voice_path),
+        'clips': [clip['sha256'] for clip in clips],
+        'plan': plan_timeline([clip['duration'] for clip in clips], audio_duration),
+        'backend': backend,
+        'segments': config.get('render_segments', 1),
+        # 线程数只影响速度，不计入
+        'encoder': {k: v for k, v in get_encoder_settings().items() if k != 'threads'},
+        'normalize': normalize_params(config) if backend == 'concat' else None,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def load_render_manifest():
+    """读取输出目录的渲染清单 {输出文件名: {key, size, rendered_at}}"""
+    manifest_path = os.path.join(get_context().videos_out_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取渲染清单失败，将全部重新渲染: {e}")
+        return {}
+
+def save_render_manifest(manifest):
+    """原子写入渲染清单"""
+    manifest_path = os.path.join(get_context().videos_out_dir, MANIFEST_NAME)
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def try_render_input_key(i, audio_file, video_folder):
+    """渲染前计算输入哈希，出错时返回None（不写入渲染清单，下次重新渲染）"""
+    try:
+        return render_input_key(audio_file, video_folder)
+    except Exception as e:
+        print(f"计算第 {i} 组输入哈希时出错: {e}")
+        return None
+
+def record_render(i, key):
+    """
+    把刚渲染完成的话题写入渲染清单
+    key 为渲染前计算的输入哈希（渲染期间输入被替换时，下次仍会重新渲染）；
+    在锁内重新读取清单后只更新自己的条目，多个进程同时写入时不会丢失其他话题的记录
+    """
+    if key is None:
+        return
+    try:
+        videos_out_dir = get_context().videos_out_dir
+        video_out_path = os.path.join(videos_out_dir, f"{i}.mp4")
+        with file_lock(os.path.join(videos_out_dir, f"{MANIFEST_NAME}.lock")):
+            manifest = load_render_manifest()
+            manifest[f"{i}.mp4"] = {
+                'key': key,
+                'size': os.path.getsize(video_out_path),
+                'rendered_at': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+            }
+            save_render_manifest(manifest)
+    except Exception as e:
+        print(f"记录第 {i} 组的渲染清单时出错: {e}")
+
+def is_render_current(manifest, i, key):
+    """输出存在、大小与清单一致且输入哈希未变时认为无需重新渲染"""
+    entry = manifest.get(f"{i}.mp4")
+    video_out_path = os.path.join(get_context().videos_out_dir, f"{i}.mp4")
+    return (entry is not None and entry.get('key') == key and os.path.exists(video_out_path)
+            and os.path.getsize(video_out_path) == entry.get('size'))
+
+def estimate_job_memory(source_dir):
+    """
+    粗略估算渲染一个话题的峰值内存（字节）
+    每个素材按解码缓冲帧和一个 ffmpeg 读取进程估算，输出按 x264 前瞻缓冲估算
+    """
+    estimate = 300 * 1024 * 1024  # Python 进程和 moviepy 本身
+    max_pixels = 0
+    video_files = sorted(glob.glob(os.path.join(source_dir, "*.mp4")))
+    for info in load_clip_index(source_dir, video_files):
+        if info.get('error'):
+            pixels = 1920 * 1080
+        else:
+            pixels = (info['width'] or 0) * (info['height'] or 0)
+        max_pixels = max(max_pixels, pixels)
+        estimate += pixels * 3 * 8 + 50 * 1024 * 1024
+    estimate += max_pixels * 3 * 40
+    return estimate
+
+def render_parallel(jobs, max_workers, on_done=None, report_path=None):
+    """
+    多进程并行渲染多个话题
+    按估算内存做准入控制：正在运行的任务估算内存之和不超过可用内存预算，
+    编码线程在同时运行的任务之间平分
+    子进程意外退出（例如被 OOM 结束）时进程池不可再用：正在运行的任务记为失败，
+    新建进程池继续渲染剩下的话题
+    
+    参数:
+    jobs: [(i, audio_file, video_folder), ...]
+    max_workers: 最大并行进程数
+    on_done: 每个任务成功后在主进程中调用 on_done(job)
+    report_path: 渲染统计报告路径
+    
+    返回: 成功的数量
+    """
+    budget = psutil.virtual_memory().available * config.get('render_memory_fraction', 0.7)
+    threads = max(1, (os.cpu_count() or 1) // max_workers)
+    pending = deque(
+        (job, estimate_job_memory(os.path.join(get_context().videos_dir, job[2]))) for job in jobs
+    )
+    print(f"并行渲染: 最多 {max_workers} 个进程, 每个任务 {threads} 个编码线程, "
+          f"内存预算 {budget / 1024 / 1024:.0f} MB")
+    
+    def new_pool():
+        # 子进程使用与主进程相同的运行上下文（Windows 下子进程会重新导入模块）
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=set_context, initargs=(get_context(),))
+    
+    success_count = 0
+    running = {}  # future -> (任务, 估算内存)
+    pool = new_pool()
+    try:
+        while pending or running:
+            # 准入：没有任务运行时至少放行一个，避免单个大任务永远等待
+            while pending and len(running) < max_workers:
+                job, estimate = pending[0]
+                in_use = sum(e for _, e in running.values())
+                if running and in_use + estimate > budget:
+                    break
+                try:
+                    future = pool.submit(process_single_video, *job, threads=threads, report_path=report_path)
+                except BrokenProcessPool:
+                    # 进程池在上一轮之后才损坏，等待运行中的任务报错后再新建
+                    break
+                pending.popleft()
+                running[future] = (job, estimate)
+                print(f"提交第 {job[0]} 组, 估算内存 {estimate / 1024 / 1024:.0f} MB, "
+                      f"运行中 {len(running)} 个")
+            
+            if not running:
+                # 进程池已损坏且没有运行中的任务
+                pool.shutdown(wait=False)
+                pool = new_pool()
+                continue
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            while done:
+                for future in done:
+                    job, _ = running.pop(future)
+                    try:
+                        if future.result() is not None:
+                            success_count += 1
+                            if on_done is not None:
+                                on_done(job)
+                    except BrokenProcessPool:
+                        broken = True
+                        print(f"处理第 {job[0]} 组时渲染进程意外退出（可能内存不足），记为失败")
+                    except Exception as e:
+                        print(f"处理第 {job[0]} 组时出错: {e}")
+                # 进程池损坏后其余运行中的任务很快都会以 BrokenProcessPool 结束，一并收集
+                done = wait(running)[0] if broken else ()
+            if broken:
+                pool.shutdown(wait=False)
+                if pending:
+                    print(f"新建渲染进程池，继续剩余的 {len(pending)} 组")
+                    pool = new_pool()
+    finally:
+        pool.shutdown(wait=True)
+    return success_count
+
+def main(topics=None):
     """
     同步主函数
+    
+    参数:
+    topics: 只渲染这些编号的话题（用于重跑失败的话题），为None时渲染全部
     """
+    context = get_context()
+    voices_folder = context.voices_dir
+    videos_folder = context.videos_dir
+    videos_out_folder = context.videos_out_dir
+    
     # 确保voices、videos和videos_out文件夹存在
     if not os.path.exists(voices_folder):
         print(f"音频文件夹不存在: {voices_folder}")
@@ -304,34 +691,62 @@ def main():
     # 创建输出目录
     os.makedirs(videos_out_folder, exist_ok=True)
     
-    # 获取按数字顺序排序的音频文件和视频文件夹
-    audio_files = get_sorted_files(voices_folder, ".mp3")
-    video_folders = get_sorted_folders(videos_folder)
+    # 话题清单中配音和素材都已完成的话题，音频和素材文件夹都按话题编号命名
+    topic_manifest = open_manifest()
+    ready = [i for i, t in topic_manifest.topics().items() if 'source' in t['stages'] and 'dropped' not in t['stages']]
+    print(f"话题清单中有 {len(ready)} 个话题的配音和素材已完成")
     
-    print(f"找到 {len(audio_files)} 个音频文件")
-    print(f"找到 {len(video_folders)} 个视频文件夹")
+    jobs = [(i, f"{i}.mp3", str(i)) for i in ready]
+    if topics is not None:
+        jobs = [job for job in jobs if job[0] in topics]
+        print(f"只处理第 {', '.join(str(i) for i in topics)} 组")
     
-    # 确保音频文件和视频文件夹数量匹配
-    if len(audio_files) != len(video_folders):
-        print(f"警告: 音频文件数量 ({len(audio_files)}) 与视频文件夹数量 ({len(video_folders)}) 不匹配")
-        # 使用较小的数量
-        min_count = min(len(audio_files), len(video_folders))
-        audio_files = audio_files[:min_count]
-        video_folders = video_folders[:min_count]
-        print(f"将处理前 {min_count} 个匹配的文件和文件夹")
+    # 清理上次崩溃留下的半成品
+    for part_file in glob.glob(os.path.join(videos_out_folder, f"*{PART_SUFFIX}")):
+        print(f"删除未完成的输出: {part_file}")
+        os.remove(part_file)
     
-    # 逐个处理每个视频
-    success_count = 0
-    for i, (audio_file, video_folder) in enumerate(zip(audio_files, video_folders)):
-        try:
-            result = process_single_video(i, audio_file, video_folder)
-            if result is not None:
-                success_count += 1
-        except Exception as e:
-            print(f"处理第 {i} 组时出错: {e}")
+    # 输入没有变化的话题直接跳过
+    manifest = load_render_manifest()
+    keys = {}
+    skipped_count = 0
+    pending_jobs = []
+    for job in jobs:
+        keys[job[0]] = try_render_input_key(*job)
+        if keys[job[0]] is not None and is_render_current(manifest, job[0], keys[job[0]]):
+            print(f"第 {job[0]} 组输入未变化，跳过渲染")
+            skipped_count += 1
+        else:
+            pending_jobs.append(job)
+    
+    def record(job):
+        record_render(job[0], keys[job[0]])
+        topic_manifest.append(job[0], 'render', video=os.path.join(videos_out_folder, f"{job[0]}.mp4"))
+    
+    # 每次运行一个统计报告，便于跨天对比
+    report_path = os.path.join(context.reports_dir, f"render-{time.strftime('%H%M%S', time.localtime())}.jsonl")
+    
+    # 配置了多个进程时并行渲染
+    max_workers = config.get('max_create_workers', 1)
+    if max_workers > 1:
+        success_count = render_parallel(pending_jobs, max_workers, on_done=record, report_path=report_path)
+    else:
+        # 逐个处理每个视频
+        success_count = 0
+        for job in pending_jobs:
+            try:
+                result = process_single_video(*job, report_path=report_path)
+                if result is not None:
+                    success_count += 1
+                    record(job)
+            except Exception as e:
+                print(f"处理第 {job[0]} 组时出错: {e}")
     
-    print(f"\n所有视频处理完成! 成功: {success_count}, 失败: {len(audio_files) - success_count}")
+    print(f"\n所有视频处理完成! 成功: {success_count}, 跳过: {skipped_count}, "
+          f"失败: {len(pending_jobs) - success_count}")
+    if pending_jobs:
+        print(f"渲染统计已写入: {report_path}")
 
-# 运行主函数
+# 运行主函数（可传入话题序号只重跑这些话题，例如 python creat_videos.py 3 5）
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main([int(arg) for arg in sys.argv[1:]] or None)
\ No newline at end of file
@@ -0,0 +1,302 @@
+"""
+常驻模式：一个进程长期运行，按计划时间或热搜关键词变化时运行流水线
+
+启动时一次性导入各阶段用到的库、创建 HTTP 会话、混元客户端、翻译服务、B站凭据和渲染进程池，
+之后每一轮都沿用，不再为每个阶段、每次运行重新冷启动
+
+同一天的多轮运行接着话题清单中已有的编号，已经处理过的关键词不再重复处理
+
+状态接口（只监听本机）:
+GET /health  存活检查
+GET /status  当前状态、上一轮结果、下次计划时间
+
+用法:
+python daemon.py              # 按 daemon_schedule 运行
+python daemon.py --now        # 启动后立即运行一轮
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from context import RunContext, config, get_context, set_context, load_config
+import manifest
+import history
+
+logger = logging.getLogger(__name__)
+
+
+def init_worker(context: RunContext):
+    """
+    进程池中每个进程启动时执行：设置运行上下文，预先导入渲染用的 moviepy（及其 ffmpeg 读取器）
+    和分析用的 pandas/sklearn，第一个话题渲染或分析时不再等待导入
+    """
+    set_context(context)
+    import moviepy.editor  # noqa: F401
+    import pandas  # noqa: F401
+    import sklearn.preprocessing  # noqa: F401
+
+
+def next_scheduled(schedule, now: datetime.datetime = None) -> datetime.datetime:
+    """计划时间（HH:MM 列表）中下一个未到的时间，没有计划时返回None"""
+    if not schedule:
+        return None
+    now = now or datetime.datetime.now()
+    candidates = []
+    for item in schedule:
+        hour, minute = (int(x) for x in str(item).split(':'))
+        at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if at <= now:
+            at += datetime.timedelta(days=1)
+        candidates.append(at)
+    return min(candidates)
+
+
+class Daemon:
+    def __init__(self, config_path: str = None):
+        # 配置只读取一次，每一轮按当天日期创建新的上下文
+        self.config = load_config(config_path) if config_path else get_context().config
+        self.started_at = time.time()
+        self.state = 'starting'
+        self.warmup_seconds = None
+        self.cycles = 0
+        self.last_cycle = None
+        self.last_error = None
+        self.last_keywords = []
+        self.last_poll = None
+        self.next_run = None
+        self.last_run_at = 0.0
+        self.attempted = {}  # 日期 -> 已经尝试过的关键词（包括被过滤或失败的）
+        self.client = None
+        self.io_pool = None
+        self.cpu_pool = None
+        self.credential = None
+        self.stop_event = None
+
+    async def warm_up(self):
+        """导入重量级库并创建共用的连接和进程池"""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        set_context(RunContext(self.config))
+
+        import pandas  # noqa: F401
+        import sklearn.preprocessing  # noqa: F401
+        import bilibili_api.search  # noqa: F401
+        import edge_tts  # noqa: F401
+        import aiofiles  # noqa: F401
+        import source
+        from openai import AsyncOpenAI
+
+        self.io_pool = ThreadPoolExecutor(max_workers=config.get('pipeline_io_workers', 8),
+                                          thread_name_prefix='daemon-io')
+        loop.set_default_executor(self.io_pool)
+        render_workers = config.get('max_create_workers', 1)
+        # 预热在每个进程的 initializer 中完成；同时提交与进程数相同的任务，让进程池把进程全部启动
+        self.cpu_pool = ProcessPoolExecutor(max_workers=render_workers, initializer=init_worker,
+                                            initargs=(get_context(),))
+        await asyncio.gather(*[loop.run_in_executor(self.cpu_pool, os.getpid) for _ in range(render_workers)])
+
+        self.client = AsyncOpenAI(api_key=config['hunyuan_api_key'], base_url=config['hunyuan_base_url'])
+        await source.init_session()
+        source.get_translator()
+        if config.get('daemon_upload', False):
+            import upload
+            self.credential = await upload.make_credential(config['bili_cookie'])
+
+        self.warmup_seconds = time.perf_counter() - start
+        logger.info(f"预热完成，用时 {self.warmup_seconds:.1f} 秒，渲染进程 {render_workers} 个")
+
+    async def close(self):
+        import source
+        await source.close_session()
+        if source.translator is not None:
+            source.translator.close()
+            source.translator = None
+        if self.client is not None:
+            await self.client.close()
+        if self.cpu_pool is not None:
+            self.cpu_pool.shutdown()
+
+    async def poll_keywords(self) -> list:
+        import get_datasets
+        keywords = await get_datasets.get_hot_keywords()
+        if config['keywords_num'] != 10:
+            keywords = keywords[:config['keywords_num']]
+        self.last_poll = time.time()
+        return keywords
+
+    def processed_keywords(self) -> set:
+        """
+        当天已经处理过的关键词：话题清单中的关键词（包括被过滤的），
+        以及本进程尝试过但没有进入清单的关键词（例如没有搜索结果，避免每轮都重新请求）
+        """
+        context = get_context()
+        done = {t.get('keyword') for t in manifest.open_manifest(context).topics().values()}
+        return done | self.attempted.get(context.day, set())
+
+    async def run_cycle(self, reason: str, keywords: list):
+        """用共用资源运行一轮流水线，之后按配置上传"""
+        import pipeline
+        context = set_context(RunContext(self.config))
+        done = self.processed_keywords()
+        pending = [k for k in keywords if k not in done]
+        if not pending:
+            logger.info(f"今天的关键词都已处理过，跳过本轮（{reason}）")
+            return
+        logger.info(f"开始第 {self.cycles + 1} 轮（{reason}），新关键词 {len(pending)} 个: {pending}")
+
+        self.state = 'running'
+        self.last_run_at = time.time()
+        self.attempted.setdefault(context.day, set()).update(pending)
+        start = time.perf_counter()
+        cycle = {'reason': reason, 'day': context.day, 'keywords': pending,
+                 'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}
+        try:
+            runner = pipeline.Pipeline(client=self.client, io_pool=self.io_pool, cpu_pool=self.cpu_pool)
+            outputs = await runner.run(pending)
+            cycle.update(videos=len(outputs), stage_counts=runner.stage_counts,
+                         first_video_seconds=runner.first_video_time)
+            if config.get('daemon_upload', False) and outputs:
+                cycle['uploaded'] = await self.upload(outputs)
+            self.last_error = None
+        except Exception as e:
+            logger.exception(f"第 {self.cycles + 1} 轮运行出错: {e}")
+            self.last_error = str(e)
+            cycle['error'] = str(e)
+        finally:
+            cycle['seconds'] = round(time.perf_counter() - start, 1)
+            self.cycles += 1
+            self.last_cycle = cycle
+            self.state = 'idle'
+
+    async def upload(self, outputs) -> int:
+        import upload
+        context = get_context()
+        pairs = upload.pair_videos_with_datas(outputs, manifest.open_manifest(context).metadata())
+        ledger = upload.UploadLedger(os.path.join(context.videos_out_dir, 'upload_ledger.json'))
+        uploader = upload.BatchUploader(self.credential, ledger, config.get('upload_max_concurrent', 2))
+        return await uploader.run(pairs)
+
+    def keywords_changed(self, keywords) -> bool:
+        """热搜中出现了足够多今天还没处理过（且近期没有生成过视频）的关键词"""
+        threshold = config.get('daemon_change_threshold', 3)
+        if not threshold or not keywords:
+            return False
+        set_context(RunContext(self.config))
+        new = [k for k in keywords if k not in self.processed_keywords()]
+        # 按 keyword_repeat 会被跳过的关键词不算新关键词
+        new, _ = history.plan_keywords(new, verbose=False)
+        return len(new) >= min(threshold, len(keywords))
+
+    async def serve(self, run_now: bool = False):
+        """主循环：等到计划时间或定时检查热搜，满足条件时运行一轮"""
+        self.stop_event = asyncio.Event()
+        await self.warm_up()
+        await self.start_status_server()
+        self.state = 'idle'
+        poll_interval = config.get('daemon_poll_interval', 600)
+        min_gap = config.get('daemon_min_gap', 1800)
+        try:
+            if run_now:
+                self.last_keywords = await self.poll_keywords()
+                await self.run_cycle('启动时立即运行', self.last_keywords)
+            while not self.stop_event.is_set():
+                self.next_run = next_scheduled(config.get('daemon_schedule', []))
+                wait = poll_interval
+                if self.next_run is not None:
+                    wait = min(wait, max(0.0, (self.next_run - datetime.datetime.now()).total_seconds()))
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), timeout=wait)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+
+                try:
+                    keywords = await self.poll_keywords()
+                except Exception as e:
+                    logger.error(f"获取热搜失败: {e}")
+                    continue
+                due = self.next_run is not None and datetime.datetime.now() >= self.next_run
+                if due:
+                    await self.run_cycle('计划时间', keywords)
+                elif time.time() - self.last_run_at >= min_gap and self.keywords_changed(keywords):
+                    await self.run_cycle('热搜变化', keywords)
+                self.last_keywords = keywords
+        finally:
+            await self.stop_status_server()
+            await self.close()
+
+    def status(self) -> dict:
+        return {
+            'state': self.state,
+            'pid': os.getpid(),
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'warmup_seconds': round(self.warmup_seconds, 2) if self.warmup_seconds is not None else None,
+            'day': get_context().day,
+            'cycles': self.cycles,
+            'last_cycle': self.last_cycle,
+            'last_error': self.last_error,
+            'last_poll': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.last_poll)) if self.last_poll else None,
+            'hot_keywords': self.last_keywords,
+            'next_run': self.next_run.strftime('%Y-%m-%d %H:%M:%S') if self.next_run else None,
+        }
+
+    async def start_status_server(self):
+        port = config.get('daemon_port', 0)
+        self.status_runner = None
+        if not port:
+            return
+        from aiohttp import web
+
+        async def health(request):
+            return web.json_response({'status': 'ok', 'state': self.state})
+
+        async def status(request):
+            return web.json_response(self.status(), dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+        app = web.Application()
+        app.router.add_get('/health', health)
+        app.router.add_get('/status', status)
+        self.status_runner = web.AppRunner(app, access_log=None)
+        await self.status_runner.setup()
+        await web.TCPSite(self.status_runner, '127.0.0.1', port).start()
+        logger.info(f"状态接口: http://127.0.0.1:{port}/status")
+
+    async def stop_status_server(self):
+        if self.status_runner is not None:
+            await self.status_runner.cleanup()
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+
+async def run_daemon(args):
+    daemon = Daemon(args.config)
+    loop = asyncio.get_running_loop()
+    try:
+        import signal
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, daemon.stop)
+    except (ImportError, NotImplementedError):
+        # Windows 不支持 add_signal_handler，Ctrl+C 直接结束
+        pass
+    await daemon.serve(args.now)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='常驻运行，按计划或热搜变化运行流水线')
+    parser.add_argument('--config', help='配置文件路径，默认项目目录下的 config.yaml')
+    parser.add_argument('--now', action='store_true', help='启动后立即运行一轮')
+    args = parser.parse_args(argv)
+    asyncio.run(run_daemon(args))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
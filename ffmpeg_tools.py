@@ -0,0 +1,300 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import subprocess
+from typing import List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+TARGET_ASPECT_RATIO = 16 / 9
+
+
+def get_ffmpeg_exe() -> str:
+    """优先使用系统 ffmpeg，否则使用 imageio-ffmpeg 自带的版本（moviepy 的依赖）"""
+    exe = shutil.which('ffmpeg')
+    if exe:
+        return exe
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def run_ffmpeg(args: List[str]) -> subprocess.CompletedProcess:
+    """运行 ffmpeg，失败时抛出带有 ffmpeg 错误输出的异常"""
+    cmd = [get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y'] + args
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg 执行失败: {proc.stderr.decode('utf-8', 'ignore').strip()[-500:]}")
+    return proc
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的 sha256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _parse_rate(rate: str) -> float:
+    try:
+        num, _, den = rate.partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def probe_video(path: str) -> Dict[str, Any]:
+    """
+    读取媒体文件信息（不解码），返回 duration、width、height、fps、codec
+    有 ffprobe 时使用 ffprobe，否则解析 `ffmpeg -i` 的输出
+    """
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe:
+        proc = subprocess.run(
+            [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'stream=codec_name,width,height,avg_frame_rate:format=duration',
+             '-of', 'json', path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+        )
+        info = json.loads(proc.stdout.decode('utf-8', 'ignore') or '{}')
+        stream = (info.get('streams') or [{}])[0]
+        return {
+            'duration': float(info.get('format', {}).get('duration') or 0),
+            'width': stream.get('width'),
+            'height': stream.get('height'),
+            'fps': _parse_rate(stream.get('avg_frame_rate', '0/1')),
+            'codec': stream.get('codec_name'),
+        }
+
+    proc = subprocess.run([get_ffmpeg_exe(), '-hide_banner', '-i', path],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    text = proc.stderr.decode('utf-8', 'ignore')
+    result = {'duration': 0.0, 'width': None, 'height': None, 'fps': 0.0, 'codec': None}
+    match = re.search(r'Duration:\s*(\d+):(\d+):([\d.]+)', text)
+    if match:
+        h, m, s = match.groups()
+        result['duration'] = int(h) * 3600 + int(m) * 60 + float(s)
+    match = re.search(r'Stream #.*?Video:\s*(\w+).*?,\s*(\d{2,5})x(\d{2,5})', text)
+    if match:
+        result['codec'] = match.group(1)
+        result['width'] = int(match.group(2))
+        result['height'] = int(match.group(3))
+        fps = re.search(r'([\d.]+)\s*(?:fps|tbr)', text[match.end():])
+        if fps:
+            result['fps'] = float(fps.group(1))
+    if result['duration'] == 0.0 and result['width'] is None:
+        raise RuntimeError(f"无法读取媒体信息: {path}")
+    return result
+
+
+CLIP_INDEX_NAME = '.clips.json'
+
+
+def load_clip_index(folder: str, video_files: List[str]) -> List[Dict[str, Any]]:
+    """
+    读取素材文件夹的元数据索引（duration、width、height、fps、codec、sha256），
+    按文件的修改时间和大小判断缓存是否有效，只重新读取变化过的文件
+
+    返回:
+    List[Dict[str, Any]]: 与 video_files 顺序一致的元数据，每项带有 path；读取失败的项带有 error
+    """
+    index_path = os.path.join(folder, CLIP_INDEX_NAME)
+    index = {}
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except Exception as e:
+            logger.warning(f"素材索引损坏，将重新生成: {e}")
+
+    changed = False
+    results = []
+    for path in video_files:
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        entry = index.get(name)
+        if not entry or entry.get('mtime') != stat.st_mtime or entry.get('size') != stat.st_size:
+            try:
+                entry = probe_video(path)
+                entry['sha256'] = file_digest(path)
+            except Exception as e:
+                entry = {'error': str(e)}
+            entry.update({'mtime': stat.st_mtime, 'size': stat.st_size})
+            index[name] = entry
+            changed = True
+        results.append(dict(entry, path=path))
+
+    # 清理已删除文件的记录
+    names = {os.path.basename(path) for path in video_files}
+    for name in [n for n in index if n not in names]:
+        del index[name]
+        changed = True
+
+    if changed:
+        tmp_path = f'{index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, index_path)
+    return results
+
+
+def crop_filter(target_aspect_ratio: float = TARGET_ASPECT_RATIO) -> str:
+    """居中裁剪到目标宽高比的 ffmpeg 滤镜（与 creat_videos.resize_and_crop_video 一致）"""
+    return (f"crop='min(iw,trunc(ih*{target_aspect_ratio}/2)*2)':"
+            f"'min(ih,trunc(iw/{target_aspect_ratio}/2)*2)'")
+
+
+def normalize_params(config: Dict[str, Any]) -> Dict[str, Any]:
+    """从配置中读取规范化格式参数"""
+    return {
+        'width': config.get('render_width', 1920),
+        'height': config.get('render_height', 1080),
+        'fps': config.get('render_fps', 30),
+        'gop': config.get('normalize_gop', 60),
+        'crf': config.get('normalize_crf', 18),
+        'preset': config.get('normalize_preset', 'veryfast'),
+        'pix_fmt': 'yuv420p',
+    }
+
+
+def normalized_path(src_path: str, cache_dir: str, params: Dict[str, Any]) -> str:
+    """规范化结果的缓存路径：由源文件内容哈希和格式参数共同决定"""
+    params_key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, f'{file_digest(src_path)[:32]}-{params_key}.mp4')
+
+
+def normalize_clip(src_path: str, cache_dir: str, params: Dict[str, Any]) -> str:
+    """
+    把素材一次性转码成规范格式（固定分辨率、帧率、像素格式、GOP，无音频），按内容哈希缓存
+
+    返回:
+    str: 规范化后的文件路径
+    """
+    out_path = normalized_path(src_path, cache_dir, params)
+    if os.path.exists(out_path):
+        # 记录最近使用时间，storage.py 按它淘汰缓存
+        try:
+            os.utime(out_path)
+        except OSError:
+            pass
+        return out_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{out_path[:-4]}.tmp.mp4'
+    vf = (f"{crop_filter()},scale={params['width']}:{params['height']},setsar=1,"
+          f"fps={params['fps']},format={params['pix_fmt']}")
+    run_ffmpeg([
+        '-i', src_path, '-an', '-vf', vf,
+        '-c:v', 'libx264', '-preset', params['preset'], '-crf', str(params['crf']),
+        '-g', str(params['gop']), '-keyint_min', str(params['gop']), '-sc_threshold', '0',
+        '-movflags', '+faststart', tmp_path
+    ])
+    os.replace(tmp_path, out_path)
+    logger.info(f"素材已规范化: {src_path} -> {out_path}")
+    return out_path
+
+
+def write_concat_list(clip_paths: List[str], list_path: str):
+    """写出 concat demuxer 的文件列表"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in clip_paths:
+            path = os.path.abspath(path).replace('\\', '/').replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+
+
+def concat_copy(clip_paths: List[str], audio_path: str, out_path: str, duration: float = None) -> str:
+    """
+    用流复制拼接规范化素材并混入音频（视频不重新编码）
+
+    参数:
+    clip_paths: 按播放顺序排列的规范化素材
+    audio_path: 音频文件，为None时不加音频
+    out_path: 输出文件
+    duration: 输出时长（秒），一般为音频时长
+    """
+    list_path = f'{out_path}.concat.txt'
+    write_concat_list(clip_paths, list_path)
+    args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_path:
+        args += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0', '-c:a', 'aac']
+    args += ['-c:v', 'copy']
+    if duration:
+        args += ['-t', f'{duration:.3f}']
+    args += ['-movflags', '+faststart', out_path]
+    try:
+        run_ffmpeg(args)
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+    return out_path
+
+
+def crop_size(width: int, height: int, target_aspect_ratio: float = TARGET_ASPECT_RATIO):
+    """居中裁剪到目标宽高比后的尺寸（与 creat_videos.resize_and_crop_video 一致）"""
+    if width / height > target_aspect_ratio:
+        return int(height * target_aspect_ratio), height
+    return width, int(width / target_aspect_ratio)
+
+
+def render_geometry(clips: List[Dict[str, Any]], plan):
+    """计算拼接画布尺寸和帧率：画布为裁剪后最大片段的尺寸（偶数），帧率取最大值"""
+    sizes = [crop_size(clips[index]['width'], clips[index]['height']) for index, _ in plan]
+    # libx264 的 yuv420p 要求宽高为偶数
+    canvas_w = (max(w for w, _ in sizes) + 1) // 2 * 2
+    canvas_h = (max(h for _, h in sizes) + 1) // 2 * 2
+    fps = max(clips[index]['fps'] or 30 for index, _ in plan)
+    return (canvas_w, canvas_h), fps
+
+
+def build_filtergraph_command(clips: List[Dict[str, Any]], plan, audio_path: str, out_path: str,
+                              duration: float, encoder: Dict[str, Any], geometry=None) -> List[str]:
+    """
+    把拼接计划转换成一条 ffmpeg filter_complex 命令（不含 ffmpeg 可执行文件本身）
+
+    几何处理与 moviepy 路径一致：每个片段居中裁剪到16:9，
+    再像 concatenate_videoclips(method="compose") 一样居中放到最大片段尺寸的画布上
+
+    参数:
+    clips: 素材信息列表，每项包含 path、width、height、fps
+    plan: plan_timeline 的结果 [(素材序号, 使用时长), ...]
+    audio_path: 音频文件，为None时不加音频
+    duration: 输出时长（秒）
+    encoder: 编码参数，包含 codec、preset、crf、threads
+    geometry: ((画布宽, 画布高), 帧率)，分段渲染时各段需使用相同的值，默认由 plan 计算
+    """
+    (canvas_w, canvas_h), fps = geometry or render_geometry(clips, plan)
+    sizes = [crop_size(clips[index]['width'], clips[index]['height']) for index, _ in plan]
+
+    args, filters, labels = [], [], []
+    for n, ((index, used_duration), (crop_w, crop_h)) in enumerate(zip(plan, sizes)):
+        clip = clips[index]
+        args += ['-t', f'{used_duration:.3f}', '-i', clip['path']]
+        crop_x = (clip['width'] - crop_w) // 2
+        crop_y = (clip['height'] - crop_h) // 2
+        filters.append(
+            f"[{n}:v]crop={crop_w}:{crop_h}:{crop_x}:{crop_y},"
+            f"pad={canvas_w}:{canvas_h}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p[v{n}]"
+        )
+        labels.append(f'[v{n}]')
+    filters.append(f"{''.join(labels)}concat=n={len(plan)}:v=1:a=0[vout]")
+
+    if audio_path:
+        args += ['-i', audio_path]
+    args += ['-filter_complex', ';'.join(filters), '-map', '[vout]']
+    if audio_path:
+        args += ['-map', f'{len(plan)}:a:0', '-c:a', 'aac']
+    args += [
+        '-c:v', encoder.get('codec', 'libx264'),
+        '-preset', str(encoder.get('preset', 'medium')),
+        '-crf', str(encoder.get('crf', 23)),
+        '-threads', str(encoder.get('threads', 2)),
+        '-pix_fmt', 'yuv420p',
+    ]
+    if duration:
+        args += ['-t', f'{duration:.3f}']
+    args += ['-movflags', '+faststart', out_path]
+    return args
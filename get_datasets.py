@@ -1,60 +1,46 @@
-from bilibili_api import search,sync
 import time
 import asyncio
 import os
-import yaml
-import pandas as pd
 import random
 from typing import List, Dict, Any
 import logging
 
+from context import config, get_context
+import metrics
+import history
+
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-# 读取配置文件
-config = {}
-try:
-    with open('config.yaml', 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
-except Exception as e:
-    logger.error(f"读取配置文件失败: {e}")
-    exit(1)
-
-# 全局变量
-dataset_dir = config['dataset_dir']
-keywords_num = config['keywords_num']
-day_range = config['day_range']
-base_sleep_time = config['base_sleep_time']  # 基础获取间隔时间
-max_retries = config['max_retries']  # 最大重试次数
-concurrent_keywords = config['concurrent_keywords']  # 并发处理的关键词数量
-
 
 class Fetch_data:
     @staticmethod
     def get_day(i):  # 获取i天前的日期
         return time.strftime("%Y-%m-%d", time.localtime(time.time() - i * 24 * 60 * 60))
 
-    async def get_day_data(self, keyword: str, now_page: int, date: list) -> pd.DataFrame:
+    async def get_day_data(self, keyword: str, now_page: int, date: list) -> 'pd.DataFrame':
         """获取单日数据"""
+        import pandas as pd
+        from bilibili_api import search
+        
         day_data = pd.DataFrame()
         retries = 0
         
-        while retries < max_retries:
+        while retries < config['max_retries']:
             # 添加随机延迟，避免固定间隔请求
-            sleep_time = base_sleep_time * (1 + random.random())  # 1-2倍基础延迟
+            sleep_time = config['base_sleep_time'] * (1 + random.random())  # 1-2倍基础延迟
             await asyncio.sleep(sleep_time)
             
             try:
-                result = await search.search_by_type(
-                    keyword=keyword,
-                    search_type=search.SearchObjectType.VIDEO,
-                    page=now_page,
-                    time_start=date[0],
-                    time_end=date[1]
-                )
+                with metrics.request('bili_search'):
+                    result = await search.search_by_type(
+                        keyword=keyword,
+                        search_type=search.SearchObjectType.VIDEO,
+                        page=now_page,
+                        time_start=date[0],
+                        time_end=date[1]
+                    )
                 
                 page_data = pd.DataFrame(result['result'])
                 if page_data.empty:
@@ -68,6 +54,7 @@ class Fetch_data:
             except Exception as e:
                 if '网络错误，状态码：412' in str(e):
                     retries += 1
+                    metrics.inc('retries_total', service='bili_search')
                     wait_time = sleep_time * (2 ** retries)  # 指数退避策略
                     logger.warning(f"关键词 '{keyword}' 日期 {date[0]} 请求被风控，第 {retries} 次重试，等待 {wait_time} 秒")
                     await asyncio.sleep(wait_time)
@@ -82,8 +69,11 @@ class Fetch_data:
             
         return day_data
 
-    async def get_all_data_for_keyword(self, keyword: str, day_range: int) -> pd.DataFrame:
+    @metrics.traced('fetch')
+    async def get_all_data_for_keyword(self, keyword: str, day_range: int) -> 'pd.DataFrame':
         """为单个关键词获取所有数据"""
+        import pandas as pd
+        
         logger.info(f"开始获取关键词 '{keyword}' 的数据")
         
         all_data = pd.DataFrame()
@@ -95,11 +85,11 @@ class Fetch_data:
                 all_data = pd.concat([all_data, day_data], ignore_index=True)
                 
                 # 每天数据获取完成后添加额外延迟
-                await asyncio.sleep(base_sleep_time * 0.5 * (1 + random.random()))
+                await asyncio.sleep(config['base_sleep_time'] * 0.5 * (1 + random.random()))
         
         # 保存数据
         if not all_data.empty:
-            save_dir = f'{dataset_dir}/{self.get_day(0)}'
+            save_dir = get_context().dataset_dir
             os.makedirs(save_dir, exist_ok=True)
             all_data.to_csv(f'{save_dir}/{keyword}.csv', index=False, encoding='utf-8-sig')
             logger.info(f"关键词 '{keyword}' 的数据已保存，共 {len(all_data)} 条")
@@ -108,13 +98,18 @@ class Fetch_data:
             
         return all_data
 
-    async def get_all_data_for_keywords(self, keywords: List[str], day_range: int) -> List[pd.DataFrame]:
-        """使用信号量控制并发获取多个关键词的数据"""
-        semaphore = asyncio.Semaphore(concurrent_keywords)
+    async def get_all_data_for_keywords(self, keywords: List[str], day_range: int,
+                                        day_ranges: Dict[str, int] = None) -> List['pd.DataFrame']:
+        """
+        使用信号量控制并发获取多个关键词的数据
+        day_ranges: 单独指定某些关键词抓取的天数（例如近期已生成过视频的关键词只抓取最新一天）
+        """
+        semaphore = asyncio.Semaphore(config['concurrent_keywords'])
+        day_ranges = day_ranges or {}
         
         async def limited_task(keyword):
             async with semaphore:
-                return await self.get_all_data_for_keyword(keyword, day_range)
+                return await self.get_all_data_for_keyword(keyword, day_ranges.get(keyword, day_range))
                 
         tasks = [limited_task(keyword) for keyword in keywords]
         results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -129,8 +124,11 @@ class Fetch_data:
 
 async def get_hot_keywords():
     """获取当前热搜关键词"""
+    import pandas as pd
+    from bilibili_api import search
     try:
-        hot_keywords = sync(search.get_hot_search_keywords())
+        with metrics.request('bili_hot'):
+            hot_keywords = await search.get_hot_search_keywords()
         df = pd.DataFrame(hot_keywords['list'])
         logger.info(f"成功获取 {len(df)} 个热搜关键词")
         return df['keyword'].tolist()
@@ -144,6 +142,7 @@ async def main():
     
     # 获取热搜关键词
     keywords = await get_hot_keywords()
+    keywords_num = config['keywords_num']
     if keywords_num == 10:
         pass
     else:
@@ -153,15 +152,23 @@ async def main():
         logger.error("未获取到任何关键词，程序退出")
         return
     
+    # 近期已生成过视频的关键词按 keyword_repeat 跳过或只抓取最新一天
+    day_ranges, _ = history.plan_keywords(keywords)
+    keywords = list(day_ranges)
+    if not keywords:
+        logger.info("热搜关键词近期都已生成过视频，程序退出")
+        return
+    
+    day_range = config['day_range']
     logger.info(f"开始获取 {len(keywords)} 个关键词的数据，时间范围 {day_range} 天")
     
     start_time = time.time()
     
     # 创建存储目录
-    os.makedirs(f'{dataset_dir}/{fd.get_day(0)}', exist_ok=True)
+    os.makedirs(get_context().dataset_dir, exist_ok=True)
     
     # 并发获取所有关键词的数据
-    await fd.get_all_data_for_keywords(keywords, day_range)
+    await fd.get_all_data_for_keywords(keywords, day_range, day_ranges)
     
     end_time = time.time()
     duration = (end_time - start_time) / 60
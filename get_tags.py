@@ -1,36 +1,28 @@
 import time
 import asyncio
 import os
-import yaml
-import pandas as pd
 import logging
 import ast
 import json
-from sklearn.preprocessing import MinMaxScaler
 from collections import Counter
 import re
 
+from context import RunContext, config, get_context
+import manifest
+
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-# 读取配置文件
-config = {}
-try:
-    with open('config.yaml', 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
-except Exception as e:
-    logger.error(f"读取配置文件失败: {e}")
-    exit(1)
-
-# 全局变量
-dataset_dir = config['dataset_dir']
-source_dir = config['source_dir']
-
 async def process_dataset(dataset_path):
-    """处理单个数据集的异步函数"""
+    """处理单个数据集的异步函数（pandas/sklearn 计算在线程池中运行，不阻塞事件循环）"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, analyze_dataset, dataset_path)
+
+def analyze_dataset(dataset_path):
+    """处理单个数据集（同步，CPU 密集），可以在进程池中运行"""
+    import pandas as pd
+    from sklearn.preprocessing import MinMaxScaler
     try:
         # 读取数据
         df = pd.read_csv(dataset_path)
@@ -135,6 +127,9 @@ async def process_dataset(dataset_path):
         }
 
 async def main():
+    dataset_dir = config['dataset_dir']
+    source_dir = config['source_dir']
+    
     # 获取所有日期文件夹
     dates = os.listdir(dataset_dir)
     if not dates:
@@ -159,6 +154,11 @@ async def main():
         logger.error(f"在 {date_path} 中没有找到CSV文件")
         return
     
+    # 已经在话题清单中的关键词不再重复分析
+    topics = manifest.open_manifest(RunContext(get_context().config, latest_date))
+    done = {t.get('keyword') for t in topics.topics().values()}
+    datasets = [f for f in datasets if os.path.splitext(f)[0] not in done]
+    
     # 创建所有数据集文件的完整路径
     dataset_paths = [os.path.join(date_path, dataset) for dataset in datasets]
     
@@ -166,12 +166,15 @@ async def main():
     tasks = [process_dataset(path) for path in dataset_paths]
     results = await asyncio.gather(*tasks)
     
-    # 保存结果到JSON文件
-    output_file = f'{source_dir}/{latest_date}/tags.json'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    # 每个关键词在话题清单中分配一个编号，分析失败的直接标记为已过滤
+    for path, result in zip(dataset_paths, results):
+        keyword = os.path.splitext(os.path.basename(path))[0]
+        if 'error' in result:
+            topics.new_topic('dropped', keyword=keyword, reason=result['error'])
+        else:
+            topics.new_topic('analyze', keyword=keyword, dataset=path, **result)
     
-    logger.info(f"处理完成，结果已保存到 {output_file}")
+    logger.info(f"处理完成，{len(results)} 个话题已写入 {topics.path}")
 
 if __name__ == '__main__':
     print('开始分析今日热点')
@@ -0,0 +1,166 @@
+"""
+热搜关键词历史：每个关键词最近一次生成视频的日期和产物（话题编号、标题、视频、数据集），
+跨天保存在 source_dir/keyword_history.json
+
+索引由各天的话题清单（topics.jsonl，见 manifest.py）生成：清单只追加，
+每次同步只重新读取大小变化过的清单，不管视频由流水线、单独的渲染脚本还是任务队列生成都会被记录
+
+近期已经生成过视频的热搜关键词按 keyword_repeat 处理:
+off      与新关键词相同（默认）
+skip     不再处理
+refresh  只抓取最新一天的数据（day_range 为 1），其余阶段照常
+
+用法:
+python history.py            # 同步并显示关键词历史
+python history.py rebuild    # 重新扫描所有日期的话题清单
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+
+from context import RunContext, config, get_context
+import manifest
+
+logger = logging.getLogger(__name__)
+
+DAY_FORMAT = '%Y-%m-%d'
+
+
+class KeywordHistory:
+    """
+    关键词历史索引 {'keywords': {关键词: 最近一次的产物}, 'indexed': {日期: 已读取的清单大小}}
+
+    产物: {day, topic, title, video, dataset, days: [生成过视频的日期, ...]}
+    """
+
+    def __init__(self, path: str, source_dir: str):
+        self.path = path
+        self.source_dir = source_dir
+        self.keywords = {}
+        self.indexed = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.keywords = data.get('keywords', {})
+                self.indexed = data.get('indexed', {})
+            except Exception as e:
+                logger.warning(f"读取关键词历史失败，将重新扫描: {e}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'keywords': self.keywords, 'indexed': self.indexed}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def record(self, keyword: str, day: str, **artifacts):
+        entry = self.keywords.setdefault(keyword, {'days': []})
+        if day not in entry['days']:
+            entry['days'] = sorted(entry['days'] + [day])
+        # 同一天多次生成时保留最后一次，补录更早的日期时不覆盖
+        if day >= entry.get('day', ''):
+            entry.update(artifacts, day=day)
+
+    def sync(self) -> int:
+        """读取新增或变化过的话题清单，返回更新的日期数"""
+        if not os.path.isdir(self.source_dir):
+            return 0
+        updated = 0
+        for day in sorted(os.listdir(self.source_dir)):
+            path = os.path.join(self.source_dir, day, 'topics.jsonl')
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if self.indexed.get(day) == size:
+                continue
+            for topic in manifest.TopicManifest(path).topics().values():
+                if 'render' in topic['stages'] and topic.get('keyword'):
+                    self.record(topic['keyword'], day, topic=topic['topic'], title=topic.get('title'),
+                                video=topic.get('video'), dataset=topic.get('dataset'))
+            self.indexed[day] = size
+            updated += 1
+        if updated:
+            self.save()
+        return updated
+
+    def last_day(self, keyword: str, before: str = None) -> str:
+        """关键词最近一次生成视频的日期（只看 before 之前的日期），没有时返回None"""
+        days = self.keywords.get(keyword, {}).get('days', [])
+        days = [d for d in days if before is None or d < before]
+        return days[-1] if days else None
+
+
+def history_path() -> str:
+    return config.get('keyword_history_path') or os.path.join(config['source_dir'], 'keyword_history.json')
+
+
+def open_history() -> KeywordHistory:
+    history = KeywordHistory(history_path(), config['source_dir'])
+    history.sync()
+    return history
+
+
+def plan_keywords(keywords, context: RunContext = None, verbose: bool = True):
+    """
+    按关键词历史决定每个热搜关键词的处理方式
+
+    返回: ({关键词: 抓取的天数}, {跳过的关键词: 上次生成视频的日期})
+    当天已经生成过的关键词由调用方（例如常驻模式）判断，这里只看之前的日期
+    """
+    context = context or get_context()
+    policy = config.get('keyword_repeat', 'off')
+    day_range = config['day_range']
+    if policy == 'off':
+        return {k: day_range for k in keywords}, {}
+
+    history = open_history()
+    window = config.get('keyword_repeat_days', 3)
+    today = datetime.datetime.strptime(context.day, DAY_FORMAT)
+    plan, skipped = {}, {}
+    for keyword in keywords:
+        last = history.last_day(keyword, before=context.day)
+        recent = last is not None and (today - datetime.datetime.strptime(last, DAY_FORMAT)).days <= window
+        if not recent:
+            plan[keyword] = day_range
+        elif policy == 'skip':
+            skipped[keyword] = last
+        else:
+            plan[keyword] = 1
+    if skipped and verbose:
+        logger.info(f"跳过 {len(skipped)} 个近期已生成过视频的关键词: {skipped}")
+    refreshed = [k for k, days in plan.items() if days == 1 and day_range != 1]
+    if refreshed and verbose:
+        logger.info(f"{len(refreshed)} 个近期已生成过视频的关键词只抓取最新一天的数据: {refreshed}")
+    return plan, skipped
+
+
+def print_history(history: KeywordHistory):
+    print(f"{'关键词':<20}{'最近日期':<14}{'次数':>6}  标题")
+    entries = sorted(history.keywords.items(), key=lambda item: item[1].get('day', ''), reverse=True)
+    for keyword, entry in entries:
+        print(f"{keyword:<20}{entry.get('day', '-'):<14}{len(entry['days']):>6}  {entry.get('title') or ''}")
+    print(f"共 {len(history.keywords)} 个关键词，已索引 {len(history.indexed)} 天")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='热搜关键词历史')
+    parser.add_argument('command', nargs='?', default='show', choices=['show', 'rebuild'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'rebuild' and os.path.exists(history_path()):
+        os.remove(history_path())
+    start = time.perf_counter()
+    history = open_history()
+    logger.info(f"同步完成，用时 {time.perf_counter() - start:.2f} 秒")
+    print_history(history)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,381 @@
+"""
+持久化任务队列（SQLite WAL），多个进程/多台机器可以共同处理同一天的配音、素材和渲染
+
+每个话题的每个阶段是一个任务。worker 领取任务时获得一段租约，运行期间定时续约；
+worker 崩溃后租约过期，任务会被其他 worker 重新领取，超过最大尝试次数则标记为失败。
+多台机器共用时，把 job_queue_path 和 source_dir 放在共享存储上
+
+用法:
+python job_queue.py enqueue [--day 2025-01-01] [--stages tts,source,render]
+python job_queue.py worker [--stages render] [--worker-id 机器名]
+python job_queue.py status [--day 2025-01-01]
+"""
+import os
+import sys
+import time
+import socket
+import sqlite3
+import asyncio
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+
+from context import RunContext, config, get_context, set_context
+import manifest
+
+logger = logging.getLogger(__name__)
+
+# 阶段的执行顺序和依赖：素材按配音时长规划，所以依赖配音
+STAGES = ['tts', 'source', 'render']
+STAGE_DEPENDS = {
+    'tts': [],
+    'source': ['tts'],
+    'render': ['tts', 'source'],
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    day TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    topic INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    heartbeat_at REAL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (day, stage, topic)
+)
+'''
+
+
+class JobQueue:
+    """
+    SQLite 任务队列，任务状态: pending -> running -> done；失败重试回到 pending，
+    尝试次数用完后为 failed
+
+    每次操作使用独立的连接，可以在心跳线程中同时使用
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 保证领取任务时不会有两个 worker 拿到同一个"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def enqueue(self, day: str, stage: str, topic: int) -> bool:
+        """添加任务，已存在时忽略，返回是否新增"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO jobs (day, stage, topic, max_attempts, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (day, stage, topic, self.max_attempts, now, now)
+            )
+            return cursor.rowcount > 0
+
+    def claim(self, worker: str, stages=None, day: str = None) -> dict:
+        """
+        领取一个可执行的任务：待执行或租约已过期，且依赖的阶段都已完成
+        没有可领取的任务时返回None
+        """
+        stages = stages or STAGES
+        now = time.time()
+        with self._transaction() as conn:
+            # 租约过期且尝试次数已用完的任务直接标记为失败
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = COALESCE(error, '租约过期'), updated_at = ? "
+                "WHERE state = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            # 依赖的阶段最终失败时，后续阶段也无法执行
+            for stage, depends in STAGE_DEPENDS.items():
+                if not depends:
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET state = 'failed', error = '依赖的阶段失败', updated_at = ? "
+                    "WHERE stage = ? AND state = 'pending' AND EXISTS (SELECT 1 FROM jobs d "
+                    "WHERE d.day = jobs.day AND d.topic = jobs.topic "
+                    f"AND d.stage IN ({','.join('?' * len(depends))}) AND d.state = 'failed')",
+                    [now, stage] + depends
+                )
+            for stage in stages:
+                depends = STAGE_DEPENDS.get(stage, [])
+                sql = (
+                    "SELECT * FROM jobs j WHERE j.stage = ? "
+                    "AND (j.state = 'pending' OR (j.state = 'running' AND j.lease_until < ?)) "
+                )
+                params = [stage, now]
+                if day:
+                    sql += 'AND j.day = ? '
+                    params.append(day)
+                if depends:
+                    sql += (
+                        "AND NOT EXISTS (SELECT 1 FROM jobs d WHERE d.day = j.day AND d.topic = j.topic "
+                        f"AND d.stage IN ({','.join('?' * len(depends))}) AND d.state != 'done') "
+                    )
+                    params.extend(depends)
+                sql += 'ORDER BY j.day, j.topic LIMIT 1'
+                row = conn.execute(sql, params).fetchone()
+                if row is None:
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1, "
+                    "lease_until = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                    (worker, now + self.lease_seconds, now, now, row['id'])
+                )
+                job = dict(row)
+                job['attempts'] += 1
+                job['worker'] = worker
+                return job
+        return None
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """续约，返回 False 表示租约已被其他 worker 接管"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ?, heartbeat_at = ?, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = 'running'",
+                (now + self.lease_seconds, now, now, job_id, worker)
+            )
+            return cursor.rowcount > 0
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'done', error = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time(), job_id, worker)
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """任务失败：还有尝试次数时重新排队，否则标记为失败"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                "error = ?, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = 'running'",
+                (error[-500:], time.time(), job_id, worker)
+            )
+            return cursor.rowcount > 0
+
+    def counts(self, day: str = None) -> dict:
+        """各阶段各状态的任务数 {(阶段, 状态): 数量}"""
+        sql = 'SELECT stage, state, COUNT(*) AS n FROM jobs '
+        params = []
+        if day:
+            sql += 'WHERE day = ? '
+            params.append(day)
+        sql += 'GROUP BY stage, state'
+        with self._connect() as conn:
+            return {(r['stage'], r['state']): r['n'] for r in conn.execute(sql, params)}
+
+    def has_unfinished(self, stages=None, day: str = None) -> bool:
+        """是否还有待执行或执行中的任务"""
+        counts = self.counts(day)
+        return any(n for (stage, state), n in counts.items()
+                   if stage in (stages or STAGES) and state in ('pending', 'running'))
+
+
+def open_queue() -> JobQueue:
+    """按配置打开任务队列"""
+    path = config.get('job_queue_path') or os.path.join(config['source_dir'], 'jobs.db')
+    return JobQueue(path, config.get('job_lease_seconds', 300), config.get('job_max_attempts', 3))
+
+
+def enqueue_day(queue: JobQueue, stages=None) -> int:
+    """为当天话题清单中已生成文案的每个话题添加任务（清单中已完成的阶段不再添加），返回新增数量"""
+    context = get_context()
+    topics = {i: t for i, t in manifest.open_manifest(context).topics().items()
+              if 'llm' in t['stages'] and 'dropped' not in t['stages']}
+    added = 0
+    for topic, t in topics.items():
+        for stage in stages or STAGES:
+            if stage not in t['stages']:
+                added += queue.enqueue(context.day, stage, topic)
+    return added
+
+
+async def run_tts(topic: int) -> bool:
+    import tts
+    context = get_context()
+    topics = manifest.open_manifest(context)
+    requirement = topics.topics()[topic]
+    if 'tts' in requirement['stages']:
+        return True
+    os.makedirs(context.voices_dir, exist_ok=True)
+    voice = await tts.get_tts_voice(requirement['text'], f'{context.voices_dir}/{topic}.mp3')
+    if voice is None:
+        return False
+    topics.append(topic, 'tts', voice=voice)
+    return True
+
+
+async def run_source(topic: int) -> bool:
+    import source
+    context = get_context()
+    topics = manifest.open_manifest(context)
+    requirement = topics.topics()[topic]
+    if 'source' in requirement['stages']:
+        return True
+    folder_dir = f'{context.videos_dir}/{topic}'
+    source.create_folder(folder_dir)
+    await source.init_session()
+    try:
+        tag_map = await source.get_translator().translate_many(requirement.get('tags', []))
+        results = await source.process_topic(topic, requirement, folder_dir, tag_map, source.make_pexels_limiter())
+    finally:
+        await source.close_session()
+    clips = sum(1 for r in results if isinstance(r, str))
+    if not clips:
+        return False
+    topics.append(topic, 'source', clips=clips)
+    return True
+
+
+def run_render(topic: int) -> bool:
+    import creat_videos
+    context = get_context()
+    report_path = os.path.join(context.reports_dir, f"worker-{os.getpid()}.jsonl")
+    key = creat_videos.try_render_input_key(topic, f'{topic}.mp3', str(topic))
+    # 输入没有变化时跳过渲染（与 creat_videos.main 相同），清单中缺少渲染记录时补上
+    if key is not None and creat_videos.is_render_current(creat_videos.load_render_manifest(), topic, key):
+        topics = manifest.open_manifest(context)
+        if 'render' not in topics.topics().get(topic, {}).get('stages', []):
+            topics.append(topic, 'render', video=os.path.join(context.videos_out_dir, f'{topic}.mp4'))
+        return True
+    result = creat_videos.process_single_video(topic, f'{topic}.mp3', str(topic), report_path=report_path)
+    if result is None:
+        return False
+    creat_videos.record_render(topic, key)
+    manifest.open_manifest(context).append(topic, 'render', video=result)
+    return True
+
+
+HANDLERS = {
+    'tts': lambda topic: asyncio.run(run_tts(topic)),
+    'source': lambda topic: asyncio.run(run_source(topic)),
+    'render': run_render,
+}
+
+
+def run_job(queue: JobQueue, job: dict) -> bool:
+    """在当前进程中执行任务，执行期间由后台线程定时续约"""
+    stop = threading.Event()
+
+    def keep_alive():
+        while not stop.wait(queue.lease_seconds / 3):
+            if not queue.heartbeat(job['id'], job['worker']):
+                logger.warning(f"任务 {job['stage']}/{job['topic']} 的租约已被其他 worker 接管")
+                return
+
+    heartbeat = threading.Thread(target=keep_alive, daemon=True)
+    heartbeat.start()
+    try:
+        if job['day'] != get_context().day:
+            set_context(RunContext(get_context().config, job['day']))
+        ok = HANDLERS[job['stage']](job['topic'])
+        error = None if ok else '阶段执行失败'
+    except Exception as e:
+        ok, error = False, f'{type(e).__name__}: {e}'
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    if ok:
+        queue.complete(job['id'], job['worker'])
+    else:
+        queue.fail(job['id'], job['worker'], error)
+    return ok
+
+
+def work(queue: JobQueue, worker: str, stages=None, day: str = None, wait: bool = False,
+         poll_interval: float = 5) -> int:
+    """
+    循环领取并执行任务，返回成功的数量
+    没有可领取的任务时：还有别的 worker 在执行（后续任务可能解锁）或 wait 为 True 时等待，否则退出
+    """
+    success_count = 0
+    while True:
+        job = queue.claim(worker, stages, day)
+        if job is None:
+            if wait or queue.has_unfinished(stages, day):
+                time.sleep(poll_interval)
+                continue
+            break
+        logger.info(f"[{worker}] 领取任务 {job['day']} {job['stage']}/{job['topic']}（第 {job['attempts']} 次）")
+        start = time.perf_counter()
+        ok = run_job(queue, job)
+        success_count += ok
+        logger.info(f"[{worker}] 任务 {job['stage']}/{job['topic']} {'完成' if ok else '失败'}，"
+                    f"用时 {time.perf_counter() - start:.1f} 秒")
+    return success_count
+
+
+def print_status(queue: JobQueue, day: str = None):
+    counts = queue.counts(day)
+    states = ['pending', 'running', 'done', 'failed']
+    print(f"{'阶段':<8}" + ''.join(f'{s:>9}' for s in states))
+    for stage in STAGES:
+        print(f'{stage:<8}' + ''.join(f'{counts.get((stage, s), 0):>9}' for s in states))
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='持久化任务队列')
+    parser.add_argument('command', choices=['enqueue', 'worker', 'status'])
+    parser.add_argument('--day', help='处理哪一天的数据（YYYY-MM-DD），默认今天')
+    parser.add_argument('--stages', help=f"逗号分隔的阶段，默认全部（{','.join(STAGES)}）")
+    parser.add_argument('--worker-id', default=f'{socket.gethostname()}-{os.getpid()}')
+    parser.add_argument('--wait', action='store_true', help='没有任务时继续等待新任务')
+    args = parser.parse_args(argv)
+
+    if args.day:
+        set_context(RunContext(day=args.day))
+    stages = args.stages.split(',') if args.stages else None
+    queue = open_queue()
+
+    if args.command == 'enqueue':
+        added = enqueue_day(queue, stages)
+        print(f"新增 {added} 个任务")
+        print_status(queue, get_context().day)
+    elif args.command == 'worker':
+        success_count = work(queue, args.worker_id, stages, args.day, args.wait)
+        print(f"worker {args.worker_id} 退出，成功 {success_count} 个任务")
+    else:
+        print_status(queue, args.day)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,24 +1,15 @@
-from openai import AsyncOpenAI
-import os
-import yaml
-import time
 import logging
-import json
 import asyncio
 from typing import List
 
+from context import config
+import metrics
+import manifest
+
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-config = {}
-with open('config.yaml', 'r', encoding='utf-8') as f:
-    config = yaml.safe_load(f)
-
-today = time.strftime("%Y-%m-%d", time.localtime(time.time()))
-requirements_dir = f'{config["source_dir"]}/{today}/tags.json'  # 请求路径
 llm_prompt =  '''你是一位专业的文案师，用户往B站投稿视频需要写一段600字的文案，请根据用户输入的投稿倾向(typename)和关键词(tags)，
                首先你需要判断这个话题是否敏感，如果关键词太过敏感（涉政，过于色情）你就回答：“话题敏感，拒绝回答”
                如果关键词不敏感，就生成符合要求的文案(不要出现与文案无关的语句,也不要有标题之类的东西，纯文案文本，不要出现表情），语言可以风趣幽默一点。
@@ -26,32 +17,35 @@ llm_prompt =  '''你是一位专业的文案师，用户往B站投稿视频需
                标点符号只有中文句号和中文逗！内容出现转折的时候用中文句号隔开。'''
 
 llm_prompt2 = '请根据文案生成5-10字的标题，不要出现与标题无关的语句，不要出现表情。'
-requirements = []
-with open(requirements_dir, 'r', encoding='utf-8') as f:
-    requirements = json.load(f)
 
 
-async def get_llm_data(client: AsyncOpenAI, prompt: str, requirement: str) -> str:
+@metrics.traced('llm')
+async def get_llm_data(client: 'AsyncOpenAI', prompt: str, requirement: str) -> str:
     """异步向LLM发送请求，返回文本"""
     try:
         requirement = f'{requirement}'
-        completion = await client.chat.completions.create(
-            model='hunyuan-lite',
-            messages=[
-                {
-                    "role": 'system',
-                    "content": prompt
+        with metrics.request('llm'):
+            completion = await client.chat.completions.create(
+                model='hunyuan-lite',
+                messages=[
+                    {
+                        "role": 'system',
+                        "content": prompt
+                    },
+                    {
+                        "role": 'user',
+                        "content": requirement
+                    }
+                ],
+                extra_body={
+                    "enable_enhancement": True,  # 自定义参数
                 },
-                {
-                    "role": 'user',
-                    "content": requirement
-                }
-            ],
-            extra_body={
-                "enable_enhancement": True,  # 自定义参数
-            },
-            temperature=1,
-        )
+                temperature=1,
+            )
+        usage = getattr(completion, 'usage', None)
+        if usage is not None:
+            metrics.inc('llm_tokens_total', usage.prompt_tokens or 0, kind='prompt')
+            metrics.inc('llm_tokens_total', usage.completion_tokens or 0, kind='completion')
         return completion.choices[0].message.content
     except Exception as e:
         logger.error(f"请求LLM时出错: {e}")
@@ -60,6 +54,8 @@ async def get_llm_data(client: AsyncOpenAI, prompt: str, requirement: str) -> st
 
 async def process_requirements(prompt: str, requirements_list: List[str]) -> List[str]:
     """异步处理所有要求"""
+    from openai import AsyncOpenAI
+    
     # 创建异步客户端
     client = AsyncOpenAI(
         api_key=config['hunyuan_api_key'],
@@ -93,31 +89,26 @@ async def main():
     """异步主函数"""
     print("开始生成文案")
     print('='*50)
-    texts = []
+    topics = manifest.open_manifest()
+    pending = topics.pending('llm')  # 已分析、还没有文案的话题
+    requirements = [{k: t[k] for k in ('typename', 'typeid', 'tags', 'description')} for t in pending.values()]
     results = await process_requirements(llm_prompt, requirements)# 生成文案
     
-    for index, text in enumerate(results):# 筛出敏感话题
+    # 筛出敏感话题，被过滤的话题只记录一条 dropped，不影响其他话题的编号
+    accepted = {}
+    for topic, text in zip(pending, results):
         if text and text != '话题敏感，拒绝回答':
-            texts.append(text)
+            accepted[topic] = text
         else:
-            #删除requirements列表的第index个元素
-            requirements.pop(index)
-
+            topics.append(topic, 'dropped', reason='未生成文案（敏感或请求失败）')
 
     print("开始生成标题")
     print('='*50)
-    results = await process_requirements(llm_prompt2, texts)# 生成标题
-    for dic, title in zip(requirements, results):
-        dic['title'] = title
-    with open(requirements_dir, 'w', encoding='utf-8') as f:#把tags存回去
-        json.dump(requirements, f, ensure_ascii=False, indent=4)
-
-    
-    # 保存文案
-    with open(f'{config["source_dir"]}/{today}/texts.json', 'w', encoding='utf-8') as f:
-        json.dump(texts, f, ensure_ascii=False, indent=4)
+    titles = await process_requirements(llm_prompt2, list(accepted.values()))# 生成标题
+    for (topic, text), title in zip(accepted.items(), titles):
+        topics.append(topic, 'llm', text=text, title=title)
     
-    logger.info(f"请求文案，成功处理 {len(texts)} 个请求")
+    logger.info(f"请求文案，成功处理 {len(accepted)} 个请求")
     
 
 
@@ -0,0 +1,37 @@
+"""
+进程间文件锁：多个进程读改写同一个文件（话题清单编号、渲染清单）时串行执行
+
+POSIX 使用 fcntl.flock，Windows 使用 msvcrt.locking；锁在文件描述符关闭（包括进程崩溃）时自动释放
+"""
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def file_lock(path: str):
+    """在锁文件 path 上加排他锁，阻塞直到拿到锁"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    # LK_LOCK 重试约 10 秒后报错，继续等待
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
@@ -0,0 +1,199 @@
+"""
+话题清单：当天每个话题在各阶段的产出，按稳定的话题编号记录在只追加的 JSON lines 文件（topics.jsonl）中
+
+话题在第一次写入清单时分配编号，之后不再改变；配音、素材和输出视频都按这个编号命名
+（voices/{编号}.mp3、videos/{编号}/、videos_out/{编号}.mp4）。被过滤的话题写一条 dropped 记录，
+编号留空，不影响其他话题。每个阶段完成后追加一行，不需要重写整个文件，
+下游阶段可以跟随（tail）清单，每出现一条上游记录就开始处理
+
+记录格式: {"topic": 编号, "stage": 阶段, "at": 时间, ...阶段产出}
+analyze  keyword, dataset, typename, typeid, tags, description
+llm      text, title
+tts      voice
+source   clips
+render   video
+dropped  reason（话题不再继续处理）
+
+用法:
+python manifest.py [--day 2025-01-01]   # 显示当天各话题进度
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from context import RunContext, get_context, set_context
+from locks import file_lock
+
+# 各阶段的上一阶段（跟随清单时，出现上游记录就处理这个阶段）
+UPSTREAM = {'llm': 'analyze', 'tts': 'llm', 'source': 'tts', 'render': 'source'}
+
+# 上传需要的元数据字段
+METADATA_KEYS = ('keyword', 'title', 'typename', 'typeid', 'tags', 'description')
+
+
+class TopicManifest:
+    """
+    一天的话题清单
+
+    多个进程可以同时追加：每条记录用一次 O_APPEND 写入，不会交错；
+    分配编号在锁文件（topics.jsonl.lock）内读取其他进程新追加的记录后进行，不会分配出相同的编号
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = f'{path}.lock'
+        # 已读取到的位置和其中最大的编号，分配编号时只需读取之后新增的记录
+        self._offset = 0
+        self._max_id = -1
+
+    def append(self, topic: int, stage: str, **data) -> dict:
+        record = {'topic': topic, 'stage': stage, 'at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+                  **data}
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        return record
+
+    def read(self, offset: int = 0):
+        """从 offset 开始读取完整的记录，返回 (记录列表, 新的 offset)；还没写完的最后一行留到下次读取"""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b'\n') + 1
+        records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return records, offset + end
+
+    def records(self) -> list:
+        return self.read()[0]
+
+    def topics(self) -> dict:
+        return merge(self.records())
+
+    def pending(self, stage: str, topics: dict = None) -> dict:
+        """上一阶段已完成、这个阶段还没完成且没有被过滤的话题"""
+        upstream = UPSTREAM[stage]
+        return {i: t for i, t in (topics if topics is not None else self.topics()).items()
+                if upstream in t['stages'] and stage not in t['stages'] and 'dropped' not in t['stages']}
+
+    def metadata(self) -> dict:
+        """已生成标题的话题的上传元数据 {编号: {title, typeid, tags, ...}}"""
+        return {i: {k: t[k] for k in METADATA_KEYS if k in t}
+                for i, t in self.topics().items() if 'title' in t}
+
+    def new_topic(self, stage: str, **data) -> int:
+        """分配下一个编号并写入话题的第一条记录（持有锁期间完成读取和追加）"""
+        with file_lock(self.lock_path):
+            records, self._offset = self.read(self._offset)
+            self._max_id = max([self._max_id] + [r['topic'] for r in records])
+            topic = self._max_id + 1
+            self.append(topic, stage, **data)
+        return topic
+
+    async def follow(self, stages=None, offset: int = 0, poll_interval: float = 0.5, idle_timeout: float = None):
+        """
+        跟随清单，逐条产出 offset 之后新增的记录（只产出 stages 中的阶段）
+        超过 idle_timeout 秒没有新记录时结束，为None时一直跟随
+        """
+        idle_since = time.monotonic()
+        while True:
+            records, offset = self.read(offset)
+            if records:
+                idle_since = time.monotonic()
+            for record in records:
+                if stages is None or record['stage'] in stages:
+                    yield record
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                return
+            await asyncio.sleep(poll_interval)
+
+    async def ready(self, stage: str, poll_interval: float = 0.5, idle_timeout: float = None):
+        """逐个产出可以执行 stage 的话题编号：先是清单中已经在等待的，之后每出现一条上游记录产出一个"""
+        records, offset = self.read()
+        for topic in self.pending(stage, merge(records)):
+            yield topic
+        async for record in self.follow([UPSTREAM[stage]], offset, poll_interval, idle_timeout):
+            yield record['topic']
+
+
+def merge(records) -> dict:
+    """按编号合并各阶段的记录 {编号: {..各阶段产出, 'stages': [阶段, ...]}}"""
+    topics = {}
+    for record in records:
+        topic = topics.setdefault(record['topic'], {'topic': record['topic'], 'stages': []})
+        topic.update({k: v for k, v in record.items() if k not in ('topic', 'stage', 'at')})
+        topic['stages'].append(record['stage'])
+    return dict(sorted(topics.items()))
+
+
+def migrate_legacy(manifest: TopicManifest, context: RunContext) -> int:
+    """
+    把旧版本的 tags.json / texts.json（按列表位置对齐）转为清单记录，返回转换的话题数
+    两个列表长度不一致时无法确定文案属于哪个话题，只转换分析结果
+    """
+    tags = context.read_json(context.tags_path, [])
+    texts = context.read_json(context.texts_path, [])
+    aligned = len(tags) == len(texts)
+    for i, requirement in enumerate(tags):
+        if 'error' in requirement:
+            manifest.append(i, 'dropped', reason=requirement['error'])
+            continue
+        manifest.append(i, 'analyze', **{k: v for k, v in requirement.items() if k != 'title'})
+        if not aligned or 'title' not in requirement:
+            continue
+        manifest.append(i, 'llm', text=texts[i], title=requirement['title'])
+        voice = f'{context.voices_dir}/{i}.mp3'
+        if not os.path.exists(voice):
+            continue
+        manifest.append(i, 'tts', voice=voice)
+        folder = f'{context.videos_dir}/{i}'
+        clips = len([f for f in os.listdir(folder) if f.endswith('.mp4')]) if os.path.isdir(folder) else 0
+        if clips:
+            manifest.append(i, 'source', clips=clips)
+        video = f'{context.videos_out_dir}/{i}.mp4'
+        if os.path.exists(video):
+            manifest.append(i, 'render', video=video)
+    return len(tags)
+
+
+def open_manifest(context: RunContext = None) -> TopicManifest:
+    """当天的话题清单，清单还不存在而有旧版本的 tags.json 时先转换"""
+    context = context or get_context()
+    manifest = TopicManifest(context.manifest_path)
+    if not os.path.exists(manifest.path) and os.path.exists(context.tags_path):
+        with file_lock(manifest.lock_path):
+            # 拿到锁后再检查一次，其他进程可能已经转换完成
+            if not os.path.exists(manifest.path):
+                migrate_legacy(manifest, context)
+    return manifest
+
+
+def print_progress(manifest: TopicManifest):
+    stages = ['analyze', 'llm', 'tts', 'source', 'render']
+    print(f"{'编号':<6}{'关键词':<16}" + ''.join(f'{s:>9}' for s in stages) + '  标题')
+    for i, t in manifest.topics().items():
+        marks = ''.join(f"{'✓' if s in t['stages'] else '-':>9}" for s in stages)
+        note = f"已过滤: {t.get('reason')}" if 'dropped' in t['stages'] else t.get('title', '')
+        print(f"{i:<6}{str(t.get('keyword', '')):<16}{marks}  {note}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='显示当天的话题清单')
+    parser.add_argument('--day', help='哪一天（YYYY-MM-DD），默认今天')
+    args = parser.parse_args(argv)
+    if args.day:
+        set_context(RunContext(day=args.day))
+    print_progress(open_manifest())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,458 @@
+"""
+统一的埋点：计数器、直方图和按话题/阶段的追踪 span
+
+- 计数器和直方图保存在当前进程中，可以用 prometheus_text() 导出为 Prometheus 文本格式，
+  配置 metrics_port 后流水线运行期间在 http://metrics_host:端口/metrics 提供（默认只监听本机）
+- span 结束时以一行 JSON 写入当天的 reports/metrics.jsonl；渲染子进程的计数在每个视频完成时
+  以增量写入同一个文件，python metrics.py 汇总所有进程的结果
+
+主要指标:
+requests_total{service,status}  外部请求次数（status 为 ok、error 或 HTTP 状态码，如 412）
+request_seconds{service}        外部请求耗时
+retries_total{service}          重试次数
+download_bytes_total            Pexels 下载字节数
+llm_tokens_total{kind}          LLM 消耗的 token（prompt/completion）
+tts_audio_seconds_total         生成的配音时长
+render_frames_total / render_fps  渲染的帧数和编码帧率
+upload_bytes_total / upload_chunks_total  上传的字节数和分块数
+stage_seconds{stage,status}     各阶段 span 的耗时
+
+用法:
+python metrics.py --day 2025-01-01               # 按阶段汇总
+python metrics.py --day 2025-01-01 --prometheus  # 输出 Prometheus 文本格式
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import atexit
+import bisect
+import asyncio
+import logging
+import argparse
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from context import RunContext, config, get_context, set_context
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的分桶（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+BUCKETS = {
+    'render_fps': (5, 10, 15, 24, 30, 45, 60, 90, 120, 240),
+}
+
+HELP = {
+    'requests_total': '外部请求次数',
+    'request_seconds': '外部请求耗时（秒）',
+    'retries_total': '重试次数',
+    'download_bytes_total': '下载字节数',
+    'llm_tokens_total': 'LLM 消耗的 token 数',
+    'tts_audio_seconds_total': '生成的配音时长（秒）',
+    'render_frames_total': '渲染的帧数',
+    'render_fps': '渲染编码帧率',
+    'upload_bytes_total': '上传字节数',
+    'upload_chunks_total': '上传分块数',
+    'stage_seconds': '各阶段耗时（秒）',
+}
+
+# 当前话题（追踪编号）和当前 span，随 asyncio 任务传递
+_trace = contextvars.ContextVar('metrics_trace', default=None)
+_span = contextvars.ContextVar('metrics_span', default=None)
+
+
+class Registry:
+    """进程内的计数器和直方图，标签按 (名称, 排序后的标签) 区分"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+        buckets = BUCKETS.get(name, DEFAULT_BUCKETS)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets),
+                                               'sum': 0.0, 'count': 0}
+            index = bisect.bisect_left(hist['buckets'], value)
+            if index < len(hist['counts']):
+                hist['counts'][index] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def snapshot(self, reset=False) -> dict:
+        """导出为可以写入 JSON 的字典；reset 为 True 时清零（用于按增量写入）"""
+        with self.lock:
+            data = {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'histograms': [{'name': name, 'labels': dict(labels), **json.loads(json.dumps(hist))}
+                               for (name, labels), hist in self.histograms.items()],
+            }
+            if reset:
+                self.counters = {}
+                self.histograms = {}
+        return data
+
+    def merge(self, data: dict):
+        """合并另一个进程写入的快照"""
+        with self.lock:
+            for item in data.get('counters', []):
+                key = self.key(item['name'], item['labels'])
+                self.counters[key] = self.counters.get(key, 0) + item['value']
+            for item in data.get('histograms', []):
+                key = self.key(item['name'], item['labels'])
+                hist = self.histograms.get(key)
+                if hist is None:
+                    self.histograms[key] = {'buckets': item['buckets'], 'counts': list(item['counts']),
+                                            'sum': item['sum'], 'count': item['count']}
+                    continue
+                hist['counts'] = [a + b for a, b in zip(hist['counts'], item['counts'])]
+                hist['sum'] += item['sum']
+                hist['count'] += item['count']
+
+
+registry = Registry()
+
+_sink_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """渲染进程池 fork 出的子进程不继承父进程的计数，否则汇总时会重复"""
+    global registry, _server
+    registry = Registry()
+    _server = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def sink_path() -> str:
+    """JSON lines 文件，未启用时返回None"""
+    if not config.get('metrics_jsonl', True):
+        return None
+    return os.path.join(get_context().reports_dir, 'metrics.jsonl')
+
+
+def emit(record: dict):
+    """向 JSON lines 文件追加一条记录（多个进程可以同时追加）"""
+    path = sink_path()
+    if path is None:
+        return
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _sink_lock:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"写入埋点记录失败: {e}")
+
+
+def flush():
+    """把当前进程的计数增量写入 JSON lines 文件并清零（渲染子进程每完成一个视频调用一次）"""
+    data = registry.snapshot(reset=True)
+    if data['counters'] or data['histograms']:
+        emit({'type': 'metrics', 'pid': os.getpid(), 'time': time.time(), **data})
+
+
+# 单独运行各脚本时，退出前写入剩余的计数
+atexit.register(flush)
+
+
+def set_trace(trace_id):
+    """当前 asyncio 任务之后的 span 都归属于这个话题"""
+    _trace.set(str(trace_id))
+
+
+@contextmanager
+def trace(trace_id):
+    """之后的 span 都归属于这个话题（追踪编号）"""
+    token = _trace.set(str(trace_id))
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+
+
+class Span:
+    """一个阶段的一次执行：耗时、状态和附加信息，结束时写入 stage_seconds 和 JSON lines"""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.status = 'ok'
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.parent = _span.get()
+        self.token = _span.set(self.id)
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _span.reset(self.token)
+        error = None
+        if exc_type is not None:
+            self.status = 'cancelled' if issubclass(exc_type, asyncio.CancelledError) else 'error'
+            error = str(exc)
+        observe('stage_seconds', seconds, stage=self.name, status=self.status)
+        emit({
+            'type': 'span', 'trace': _trace.get(), 'span': self.id, 'parent': self.parent,
+            'name': self.name, 'pid': os.getpid(), 'start': self.started_at, 'seconds': round(seconds, 4),
+            'status': self.status, 'error': error, 'attrs': self.attrs,
+        })
+        return False
+
+
+def span(name, **attrs) -> Span:
+    return Span(name, **attrs)
+
+
+def traced(name):
+    """
+    给函数加上 span，函数返回None（或空字符串）时记为 failed；
+    同步函数和异步函数都可以使用
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name) as s:
+                    result = await func(*args, **kwargs)
+                    if result is None or (isinstance(result, str) and not result):
+                        s.status = 'failed'
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as s:
+                result = func(*args, **kwargs)
+                if result is None or (isinstance(result, str) and not result):
+                    s.status = 'failed'
+                return result
+        return wrapper
+    return decorator
+
+
+_STATUS_RE = re.compile(r'状态码[：:]\s*(\d{3})')
+
+
+def error_status(error: Exception) -> str:
+    """从异常中取出 HTTP 状态码（bilibili_api 的 “网络错误，状态码：412”），取不到时为 error"""
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return str(status)
+    match = _STATUS_RE.search(str(error))
+    return match.group(1) if match else 'error'
+
+
+@contextmanager
+def request(service):
+    """
+    统计一次外部请求的次数和耗时，抛出异常时按状态码分类（取消的请求为 cancelled）；
+    调用方可以修改返回字典中的 status（例如接口返回了非 200 而没有抛出异常）
+    """
+    outcome = {'status': 'ok'}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except BaseException as e:
+        if outcome['status'] == 'ok':
+            outcome['status'] = 'cancelled' if isinstance(e, asyncio.CancelledError) else error_status(e)
+        raise
+    finally:
+        inc('requests_total', service=service, status=outcome['status'])
+        observe('request_seconds', time.perf_counter() - start, service=service)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    body = ','.join(f'{k}="{_escape(v)}"' for k, v in items)
+    return '{' + body + '}'
+
+
+def prometheus_text(source: Registry = None) -> str:
+    """导出为 Prometheus 文本格式"""
+    data = (source or registry).snapshot()
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in HELP:
+                lines.append(f'# HELP {name} {HELP[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for item in sorted(data['counters'], key=lambda x: x['name']):
+        header(item['name'], 'counter')
+        lines.append(f"{item['name']}{_format_labels(item['labels'])} {item['value']}")
+    for item in sorted(data['histograms'], key=lambda x: x['name']):
+        name = item['name']
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(item['buckets'], item['counts']):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(item['labels'], {'le': bound})} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(item['labels'], {'le': '+Inf'})} {item['count']}")
+        lines.append(f"{name}_sum{_format_labels(item['labels'])} {round(item['sum'], 6)}")
+        lines.append(f"{name}_count{_format_labels(item['labels'])} {item['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+_server = None
+
+
+def start_http_server(port: int, host: str = '127.0.0.1'):
+    """在后台线程中提供 /metrics，port 为 0 时不启动；需要被其他机器抓取时 host 设为 0.0.0.0"""
+    global _server
+    if not port or _server is not None:
+        return _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    logger.info(f"指标已在 http://{host}:{port}/metrics 提供")
+    return _server
+
+
+def stop_http_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+
+def load(path: str):
+    """读取 JSON lines 文件，返回 (合并后的 Registry, span 列表)"""
+    merged = Registry()
+    spans = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('type') == 'metrics':
+                merged.merge(record)
+            elif record.get('type') == 'span':
+                spans.append(record)
+    return merged, spans
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+def print_summary(merged: Registry, spans):
+    by_stage = {}
+    for s in spans:
+        by_stage.setdefault(s['name'], []).append(s)
+    print(f"{'阶段':<16}{'次数':>6}{'失败':>6}{'p50':>8}{'p95':>8}{'合计秒':>10}")
+    for name, items in sorted(by_stage.items(), key=lambda kv: -sum(s['seconds'] for s in kv[1])):
+        seconds = [s['seconds'] for s in items]
+        failed = sum(1 for s in items if s['status'] != 'ok')
+        print(f"{name:<16}{len(items):>6}{failed:>6}{percentile(seconds, 0.5):>8.2f}"
+              f"{percentile(seconds, 0.95):>8.2f}{sum(seconds):>10.1f}")
+
+    data = merged.snapshot()
+    requests = {}
+    for item in data['counters']:
+        if item['name'] == 'requests_total':
+            service = item['labels']['service']
+            requests.setdefault(service, {})[item['labels']['status']] = item['value']
+    if requests:
+        print(f"\n{'服务':<16}各状态的请求数")
+        for service, statuses in sorted(requests.items()):
+            print(f"{service:<16}" + ', '.join(f'{k}: {v}' for k, v in sorted(statuses.items())))
+    others = [item for item in data['counters'] if item['name'] != 'requests_total']
+    if others:
+        print()
+        for item in sorted(others, key=lambda x: x['name']):
+            print(f"{item['name']}{_format_labels(item['labels'])} = {round(item['value'], 2)}")
+    for item in data['histograms']:
+        if item['name'] == 'render_fps' and item['count']:
+            print(f"平均渲染帧率 {item['sum'] / item['count']:.1f} fps（{item['count']} 个视频）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='汇总各阶段的埋点')
+    parser.add_argument('--day', help='哪一天（YYYY-MM-DD），默认今天')
+    parser.add_argument('--path', help='埋点文件，默认 source_dir/日期/reports/metrics.jsonl')
+    parser.add_argument('--prometheus', action='store_true', help='输出 Prometheus 文本格式')
+    args = parser.parse_args(argv)
+
+    if args.day:
+        set_context(RunContext(day=args.day))
+    path = args.path or os.path.join(get_context().reports_dir, 'metrics.jsonl')
+    if not os.path.exists(path):
+        print(f"没有埋点记录: {path}")
+        return
+    merged, spans = load(path)
+    if args.prometheus:
+        print(prometheus_text(merged), end='')
+    else:
+        print_summary(merged, spans)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,337 @@
+"""
+流水线编排：每个话题独立地依次经过 采集 -> 分析 -> 文案 -> 配音 -> 素材 -> 渲染，
+不必等所有话题都完成上一阶段，第一个话题可以在其他话题还在生成文案时就开始渲染
+
+每个阶段有自己的并发上限，网络请求在事件循环中执行，阻塞的 I/O 放在线程池，
+渲染放在进程池
+
+用法:
+python -m pipeline                     # 整条流水线
+python -m pipeline tts --day 2025-01-01  # 只运行某个阶段（处理指定日期的数据）
+python -m pipeline --cassette replay --day 2025-01-01  # 回放当天录制的网络请求（见 cassette.py）
+python -m pipeline render --follow     # 跟随话题清单，每个话题的素材下载完就开始渲染
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import get_datasets
+import get_tags
+import llm
+import tts
+import source
+import creat_videos
+import cassette
+import metrics
+import storage
+import manifest
+import history
+from context import RunContext, config, get_context, set_context, load_config
+
+logger = logging.getLogger(__name__)
+
+
+def render_in_context(context, *args):
+    """在渲染进程中按任务的上下文渲染（常驻进程池跨天复用时，每个任务带上自己的日期）"""
+    set_context(context)
+    return creat_videos.process_single_video(*args)
+
+
+class Pipeline:
+    """
+    按话题流式执行各阶段，每个阶段的产出追加到当天的话题清单（见 manifest.py），
+    同一天的多次运行接着清单中已有的编号
+
+    参数:
+    client / io_pool / cpu_pool: 常驻进程（daemon.py）传入的共用资源，运行结束时不关闭；
+        为None时由流水线自己创建并在结束时关闭
+    """
+
+    def __init__(self, client=None, io_pool=None, cpu_pool=None):
+        self.context = get_context()
+        self.fetcher = get_datasets.Fetch_data()
+        # 各阶段并发上限
+        self.limits = {
+            'fetch': asyncio.Semaphore(config['concurrent_keywords']),
+            'llm': asyncio.Semaphore(config['hunyuan_max_concurrent']),
+            'tts': asyncio.Semaphore(config.get('tts_max_concurrent', 4)),
+            'pexels': asyncio.Semaphore(config['pexels_max_concurrent']),
+            'render': asyncio.Semaphore(config.get('max_create_workers', 1)),
+        }
+        render_workers = config.get('max_create_workers', 1)
+        self.render_threads = max(1, (os.cpu_count() or 1) // render_workers)
+        self.owns_cpu_pool = cpu_pool is None
+        self.owns_client = client is None
+        self.io_pool = io_pool or ThreadPoolExecutor(max_workers=config.get('pipeline_io_workers', 8),
+                                                     thread_name_prefix='pipeline-io')
+        self.cpu_pool = cpu_pool or ProcessPoolExecutor(max_workers=render_workers, initializer=set_context,
+                                                        initargs=(self.context,))
+        self.client = client
+        # 所有话题共用的 Pexels 请求限流
+        self.pexels_limited = source.make_pexels_limiter(self.limits['pexels'])
+
+        # 分析完成的话题在清单中分配编号，编号决定 voices/videos/videos_out 中的文件名
+        self.manifest = manifest.open_manifest(self.context)
+        self.report_path = os.path.join(
+            self.context.reports_dir, f"pipeline-{time.strftime('%H%M%S', time.localtime())}.jsonl")
+
+        self.day_ranges = {}  # 关键词 -> 抓取的天数（见 history.plan_keywords）
+        self.start_time = None
+        self.first_video_time = None
+        self.stage_counts = {}
+
+    def count(self, stage):
+        self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+
+    async def run_io(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_pool, func, *args)
+
+    async def stage_fetch(self, keyword):
+        async with self.limits['fetch']:
+            data = await self.fetcher.get_all_data_for_keyword(
+                keyword, self.day_ranges.get(keyword, config['day_range']))
+        if data.empty:
+            return None
+        return os.path.join(self.context.dataset_dir, f'{keyword}.csv')
+
+    async def stage_analyze(self, dataset_path):
+        # pandas/sklearn 计算在 CPU 进程池中运行，不阻塞其他话题的网络请求
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.cpu_pool, get_tags.analyze_dataset, dataset_path)
+
+    async def stage_llm(self, requirement):
+        async with self.limits['llm']:
+            text = await llm.get_llm_data(self.client, llm.llm_prompt, f'{requirement}')
+        if not text or text == '话题敏感，拒绝回答':
+            return None, None
+        async with self.limits['llm']:
+            title = await llm.get_llm_data(self.client, llm.llm_prompt2, text)
+        return text, title
+
+    async def stage_tts(self, topic_index, text):
+        os.makedirs(self.context.voices_dir, exist_ok=True)
+        async with self.limits['tts']:
+            return await tts.get_tts_voice(text, f'{self.context.voices_dir}/{topic_index}.mp3')
+
+    async def stage_source(self, topic_index, requirement):
+        folder_dir = f'{self.context.videos_dir}/{topic_index}'
+        source.create_folder(folder_dir)
+        tags = requirement.get('tags', [])
+        try:
+            tag_map = await source.get_translator().translate_many(tags)
+        except Exception as e:
+            logger.error(f"翻译话题 {topic_index} 的标签出错: {e}")
+            tag_map = {}
+        results = await source.process_topic(topic_index, requirement, folder_dir, tag_map, self.pexels_limited)
+        return sum(1 for r in results if isinstance(r, str))
+
+    async def stage_render(self, topic_index):
+        audio_file = f'{topic_index}.mp3'
+        video_folder = str(topic_index)
+        # 输入哈希在渲染前计算，与渲染时实际使用的输入一致
+        key = await self.run_io(creat_videos.try_render_input_key, topic_index, audio_file, video_folder)
+        async with self.limits['render']:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self.cpu_pool, render_in_context, self.context,
+                topic_index, audio_file, video_folder, self.render_threads, self.report_path)
+        if result is None:
+            return None
+        # 写入渲染清单，之后单独运行 creat_videos.py 时会跳过这个话题
+        await self.run_io(creat_videos.record_render, topic_index, key)
+        return result
+
+    async def run_topic(self, keyword):
+        """单个关键词走完整条流水线，返回输出视频路径，中途被过滤或失败时返回None"""
+        # 分配编号前用关键词追踪，之后改用编号（与渲染子进程的追踪编号一致）
+        metrics.set_trace(keyword)
+        dataset_path = await self.stage_fetch(keyword)
+        if dataset_path is None:
+            return None
+        self.count('fetch')
+
+        requirement = await self.stage_analyze(dataset_path)
+        if 'error' in requirement:
+            self.manifest.new_topic('dropped', keyword=keyword, reason=requirement['error'])
+            return None
+        topic_index = self.manifest.new_topic('analyze', keyword=keyword, dataset=dataset_path, **requirement)
+        metrics.set_trace(topic_index)
+        metrics.emit({'type': 'trace', 'trace': str(topic_index), 'keyword': keyword})
+        self.count('analyze')
+
+        text, title = await self.stage_llm(requirement)
+        if text is None:
+            self.manifest.append(topic_index, 'dropped', reason='未生成文案（敏感或请求失败）')
+            logger.info(f"关键词 '{keyword}' 未生成文案（敏感或请求失败），跳过")
+            return None
+        self.manifest.append(topic_index, 'llm', text=text, title=title)
+        self.count('llm')
+        logger.info(f"关键词 '{keyword}' -> 话题 {topic_index}: {title}")
+
+        voice = await self.stage_tts(topic_index, text)
+        if voice is None:
+            return None
+        self.manifest.append(topic_index, 'tts', voice=voice)
+        self.count('tts')
+
+        clips = await self.stage_source(topic_index, requirement)
+        if not clips:
+            logger.error(f"话题 {topic_index} 没有下载到任何素材")
+            return None
+        self.manifest.append(topic_index, 'source', clips=clips)
+        self.count('source')
+
+        result = await self.stage_render(topic_index)
+        if result is None:
+            return None
+        self.manifest.append(topic_index, 'render', video=result)
+        self.count('render')
+        if self.first_video_time is None:
+            self.first_video_time = time.perf_counter() - self.start_time
+            logger.info(f"第一个视频完成，用时 {self.first_video_time / 60:.2f} 分钟")
+        return result
+
+    async def run(self, keywords=None):
+        """处理热搜关键词（或传入的关键词），返回生成的视频路径"""
+        self.start_time = time.perf_counter()
+        if keywords is None:
+            keywords = await get_datasets.get_hot_keywords()
+            if config['keywords_num'] != 10:
+                keywords = keywords[:config['keywords_num']]
+        if not keywords:
+            logger.error("未获取到任何关键词，程序退出")
+            return []
+        # 近期已生成过视频的关键词按 keyword_repeat 跳过或只抓取最新一天
+        self.day_ranges, _ = history.plan_keywords(keywords, self.context)
+        keywords = list(self.day_ranges)
+        if not keywords:
+            logger.info("关键词近期都已生成过视频，没有需要处理的关键词")
+            return []
+
+        os.makedirs(self.context.dataset_dir, exist_ok=True)
+        os.makedirs(self.context.day_dir, exist_ok=True)
+        os.makedirs(self.context.videos_out_dir, exist_ok=True)
+
+        # 配音时长探测等阻塞调用使用流水线的线程池
+        asyncio.get_running_loop().set_default_executor(self.io_pool)
+        if self.client is None:
+            from openai import AsyncOpenAI
+            self.client = AsyncOpenAI(api_key=config['hunyuan_api_key'], base_url=config['hunyuan_base_url'])
+        # 会话和翻译服务已由常驻进程创建时沿用，结束时也不关闭
+        owns_session = source.session is None
+        owns_translator = source.translator is None
+        await source.init_session()
+        metrics.start_http_server(config.get('metrics_port', 0), config.get('metrics_host', '127.0.0.1'))
+        # 后台按磁盘预算清理旧数据（当天的数据受保护）
+        watcher = storage.start_background()
+        try:
+            results = await asyncio.gather(*[self.run_topic(k) for k in keywords], return_exceptions=True)
+        finally:
+            if owns_session:
+                await source.close_session()
+            if self.owns_client:
+                await self.client.close()
+            if owns_translator and source.translator is not None:
+                source.translator.close()
+                source.translator = None
+            if self.owns_cpu_pool:
+                self.cpu_pool.shutdown()
+            if watcher is not None:
+                watcher.stop()
+            metrics.flush()
+
+        outputs = []
+        for keyword, result in zip(keywords, results):
+            if isinstance(result, Exception):
+                logger.error(f"关键词 '{keyword}' 处理出错: {result}")
+            elif result is not None:
+                outputs.append(result)
+
+        makespan = time.perf_counter() - self.start_time
+        logger.info(f"流水线完成，共 {len(keywords)} 个关键词，各阶段完成数: {self.stage_counts}")
+        if self.first_video_time is not None:
+            logger.info(f"第一个视频用时 {self.first_video_time / 60:.2f} 分钟，总用时 {makespan / 60:.2f} 分钟")
+        else:
+            logger.info(f"没有生成视频，总用时 {makespan / 60:.2f} 分钟")
+        return outputs
+
+
+def run_pipeline():
+    print('开始运行流水线')
+    print('=' * 50)
+    outputs = asyncio.run(Pipeline().run())
+    print('=' * 50)
+    print(f"生成视频 {len(outputs)} 个，保存在 {get_context().videos_out_dir}")
+
+
+def run_upload():
+    import upload
+    asyncio.run(upload.main())
+
+
+async def follow_stage(stage, idle_timeout=None):
+    """
+    跟随当天的话题清单运行一个阶段（可以与上游阶段在不同进程中同时运行），
+    上游每完成一个话题就处理一个，超过 idle_timeout 秒清单没有新记录时退出
+    """
+    import job_queue
+    loop = asyncio.get_running_loop()
+    handlers = {
+        'tts': job_queue.run_tts,
+        'source': job_queue.run_source,
+        'render': lambda topic: loop.run_in_executor(None, job_queue.run_render, topic),
+    }
+    success_count = 0
+    async for topic in manifest.open_manifest().ready(stage, idle_timeout=idle_timeout):
+        logger.info(f"话题 {topic} 开始 {stage}")
+        try:
+            ok = await handlers[stage](topic)
+        except Exception as e:
+            logger.error(f"话题 {topic} 的 {stage} 出错: {e}")
+            ok = False
+        success_count += bool(ok)
+    logger.info(f"清单 {idle_timeout} 秒没有新记录，{stage} 退出，成功 {success_count} 个话题")
+
+
+# 单独运行某个阶段，与直接运行对应脚本相同
+STAGES = {
+    'run': run_pipeline,
+    'fetch': lambda: asyncio.run(get_datasets.main()),
+    'tags': lambda: asyncio.run(get_tags.main()),
+    'llm': lambda: asyncio.run(llm.main()),
+    'tts': lambda: asyncio.run(tts.main()),
+    'source': lambda: asyncio.run(source.main()),
+    'render': lambda: creat_videos.main(),
+    'upload': run_upload,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pipeline', description='运行整条流水线或其中一个阶段')
+    parser.add_argument('stage', nargs='?', default='run', choices=list(STAGES), help='要运行的阶段，默认整条流水线')
+    parser.add_argument('--day', help='处理哪一天的数据（YYYY-MM-DD），默认今天')
+    parser.add_argument('--config', help='配置文件路径，默认项目目录下的 config.yaml')
+    parser.add_argument('--cassette', choices=cassette.MODES, help='录制或回放网络请求，默认使用配置 cassette_mode')
+    parser.add_argument('--cassette-speed', type=float, help='回放速度，0 为不等待，默认使用配置 cassette_speed')
+    parser.add_argument('--follow', action='store_true', help='跟随话题清单运行（只支持 tts、source、render）')
+    parser.add_argument('--idle-timeout', type=float, default=600, help='跟随时清单多少秒没有新记录后退出')
+    args = parser.parse_args(argv)
+
+    if args.day or args.config:
+        set_context(RunContext(load_config(args.config) if args.config else None, args.day))
+    cassette.install_from_config(args.cassette, args.cassette_speed)
+    if args.follow:
+        if args.stage not in ('tts', 'source', 'render'):
+            parser.error('--follow 只支持 tts、source、render')
+        asyncio.run(follow_stage(args.stage, args.idle_timeout))
+        return
+    STAGES[args.stage]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
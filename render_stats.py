@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import psutil
+
+# 当前进程正在统计的渲染任务（每个进程同一时间只渲染一个话题）
+_current = None
+
+
+class RenderStats:
+    """
+    单个话题的渲染统计：各阶段耗时、编码帧率、峰值内存（含 ffmpeg 子进程）、
+    子进程数和打开的文件数，结束时以一行 JSON 追加到报告文件
+    """
+
+    def __init__(self, topic, report_path=None, sample_interval=0.2):
+        self.record = {'topic': topic, 'pid': os.getpid(), 'phases': {}}
+        self.report_path = report_path
+        self.sample_interval = sample_interval
+        self.process = psutil.Process(os.getpid())
+        self.peak_rss = 0
+        self.peak_children_rss = 0
+        self.max_children = 0
+        self.max_open_files = 0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+
+    def _sample(self):
+        try:
+            rss = self.process.memory_info().rss
+            children = self.process.children(recursive=True)
+            children_rss = 0
+            for child in children:
+                try:
+                    children_rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            if hasattr(self.process, 'num_fds'):
+                open_files = self.process.num_fds()
+            else:
+                open_files = self.process.num_handles()
+        except psutil.Error:
+            return
+        self.peak_rss = max(self.peak_rss, rss + children_rss)
+        self.peak_children_rss = max(self.peak_children_rss, children_rss)
+        self.max_children = max(self.max_children, len(children))
+        self.max_open_files = max(self.max_open_files, open_files)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            self._sample()
+
+    def __enter__(self):
+        global _current
+        _current = self
+        self.start = time.perf_counter()
+        self.record['started_at'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        self._sample()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _current
+        self._stop.set()
+        self._sampler.join()
+        self._sample()
+        _current = None
+        if exc_type is not None and 'status' not in self.record:
+            self.record['status'] = 'error'
+            self.record['error'] = str(exc)
+        self.finish()
+        return False
+
+    @contextmanager
+    def phase(self, name):
+        """统计一个阶段的耗时，同名阶段累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = self.record['phases']
+            phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+    def set(self, **values):
+        self.record.update(values)
+
+    def finish(self):
+        record = self.record
+        record['wall_seconds'] = time.perf_counter() - self.start
+        record['peak_rss_mb'] = round(self.peak_rss / 1024 / 1024, 1)
+        record['peak_children_rss_mb'] = round(self.peak_children_rss / 1024 / 1024, 1)
+        record['max_children'] = self.max_children
+        record['max_open_files'] = self.max_open_files
+        encode_seconds = record['phases'].get('encode')
+        if record.get('frames') and encode_seconds:
+            record['encode_fps'] = round(record['frames'] / encode_seconds, 2)
+        record['phases'] = {k: round(v, 3) for k, v in record['phases'].items()}
+        if self.report_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.report_path)), exist_ok=True)
+            with open(self.report_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return record
+
+
+@contextmanager
+def phase(name):
+    """在当前渲染任务中统计一个阶段，没有任务时不做任何事"""
+    if _current is None:
+        yield
+    else:
+        with _current.phase(name):
+            yield
+
+
+def set_values(**values):
+    """向当前渲染任务的记录中写入字段"""
+    if _current is not None:
+        _current.set(**values)
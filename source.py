@@ -1,35 +1,20 @@
-import requests
 import os
-import yaml
 import logging
-import json
 import asyncio
-import aiohttp
-import aiofiles
-from translate import Translator
+from translation import TranslationService
+from ffmpeg_tools import normalize_clip, normalize_params
+from context import config, get_context
+import metrics
+import manifest
 import time
 from typing import List, Dict, Any
+from urllib.parse import urlparse
 import random
-import math
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-config = {}
-with open('config.yaml', 'r', encoding='utf-8') as f:
-    config = yaml.safe_load(f)
-
-today = time.strftime("%Y-%m-%d", time.localtime(time.time()))
-video_output_dir = f'{config["source_dir"]}/{today}/videos'
-tags_dir = f'{config["source_dir"]}/{today}/tags.json'
-
-tags_list = []
-with open(tags_dir, 'r', encoding='utf-8') as f:
-    tags_list = json.load(f)
-
 # 全局会话对象
 session = None
 
@@ -37,6 +22,7 @@ async def init_session():
     """初始化aiohttp会话"""
     global session
     if session is None:
+        import aiohttp
         connector = aiohttp.TCPConnector(limit=10)  # 限制并发连接数
         session = aiohttp.ClientSession(connector=connector)
 
@@ -47,22 +33,149 @@ async def close_session():
         await session.close()
         session = None
 
-async def get_video_source(tag: str, video_save_path: str) -> str:
+
+def rank_video_files(data: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
-    从Pexels API获取视频并保存到指定路径（异步版本）
+    一次遍历Pexels搜索结果，给所有视频文件打分并排序
+    
+    分层规则（层级越小越优先）：
+    0. 横屏、分辨率≥480p、时长≥最短时长
+    1. 横屏、时长≥最短时长
+    2. 任意方向、时长≥最短时长
+    3. 其余视频（时长越接近最短时长越好）
+    同一层内依次比较：是否达到目标分辨率、是否达到目标帧率、宽高比接近16:9，
+    达到目标分辨率的选最小的文件，达不到的选最接近目标的文件。
     
     参数:
-    tag (str): 搜索关键词
-    video_save_path (str): 视频保存路径（包括文件名和扩展名）
+    data (Dict[str, Any]): Pexels搜索接口返回的JSON
     
     返回:
-    str: 成功时返回保存的视频路径，失败时返回None
+    List[Dict[str, Any]]: 按优先级排序的候选项（包含 video、file、duration 等字段）
     """
-    # 确保保存目录存在
-    save_dir = os.path.dirname(video_save_path)
-    if save_dir and not os.path.exists(save_dir):
-        os.makedirs(save_dir)
+    target_width = config.get('render_width', 1920)
+    target_height = config.get('render_height', 1080)
+    target_fps = config.get('render_fps', 30)
+    min_duration = config.get('min_clip_duration', 10)
+    target_ratio = 16 / 9
+    
+    candidate_videos = []
+    for video in data.get('videos', []):
+        duration = video.get('duration', 0)
+        for file in video.get('video_files', []):
+            if not file.get('link'):
+                continue
+            width = file.get('width') or 0
+            height = file.get('height') or 0
+            file_size = file.get('size') or 0
+            fps = file.get('fps') or 0
+            landscape = width > height
+            
+            if duration >= min_duration:
+                if landscape and min(width, height) >= 480:
+                    tier = 0
+                elif landscape:
+                    tier = 1
+                else:
+                    tier = 2
+                duration_penalty = 0
+            else:
+                tier = 3
+                duration_penalty = abs(duration - min_duration)
+            
+            # 计算宽高比得分（越接近16/9得分越高）
+            aspect_ratio = width / height if height else 0
+            aspect_score = 1 / (1 + abs(aspect_ratio - target_ratio)) if height else 0
+            
+            # 达到目标分辨率时越小越好，达不到时越接近目标越好
+            meets_resolution = width >= target_width and height >= target_height
+            pixels = width * height
+            size_key = (pixels, file_size) if meets_resolution else (-pixels, file_size)
+            meets_fps = fps >= target_fps - 0.5 if fps else True
+            
+            # 是否达到目标分辨率和帧率优先于宽高比：渲染时会裁剪到目标比例，分辨率不足只能放大
+            rank_key = (
+                tier,
+                duration_penalty,
+                not meets_resolution,
+                not meets_fps,
+                round(1 - aspect_score, 2),
+                size_key,
+            )
+            candidate_videos.append({
+                'video': video,
+                'file': file,
+                'duration': duration,
+                'width': width,
+                'height': height,
+                'file_size': file_size,
+                'aspect_score': aspect_score,
+                'rank_key': rank_key
+            })
+    
+    candidate_videos.sort(key=lambda x: x['rank_key'])
+    return candidate_videos
+
+def select_video_file(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    从Pexels搜索结果中选出最合适的视频文件
     
+    参数:
+    data (Dict[str, Any]): Pexels搜索接口返回的JSON
+    
+    返回:
+    Dict[str, Any]: 选中的候选项，没有可用文件时返回None
+    """
+    ranked = rank_video_files(data)
+    if not ranked:
+        logger.error("未找到任何视频文件")
+        return None
+    
+    selected = ranked[0]
+    tier = selected['rank_key'][0]
+    if tier > 0:
+        logger.info(f"未找到完全符合条件的视频，放宽到第 {tier} 层条件")
+    
+    # 保留排名靠后的候选文件，下载缓慢或失败时作为备用：
+    # 同一视频的其他文件通常在同一主机上，一起变慢或失败，优先选其他视频，不够时再选其他主机上的文件
+    selected['fallbacks'] = select_fallbacks(selected, ranked[1:], config.get('pexels_hedge_max', 2))
+    return selected
+
+def file_host(candidate: Dict[str, Any]) -> str:
+    return urlparse(candidate['file']['link']).netloc
+
+def select_fallbacks(selected: Dict[str, Any], ranked: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    按排名挑选备用候选：每个视频只取排名最高的文件，且不与已选的视频重复；
+    其他视频不够时，补充与选中文件不在同一主机上的同视频文件
+    """
+    fallbacks = []
+    video_ids = {selected['video'].get('id')}
+    for candidate in ranked:
+        if len(fallbacks) >= limit:
+            return fallbacks
+        video_id = candidate['video'].get('id')
+        if video_id is not None and video_id not in video_ids:
+            video_ids.add(video_id)
+            fallbacks.append(candidate)
+    host = file_host(selected)
+    for candidate in ranked:
+        if len(fallbacks) >= limit:
+            break
+        if candidate not in fallbacks and file_host(candidate) != host:
+            fallbacks.append(candidate)
+    return fallbacks
+
+async def pexels_search(tag: str) -> Dict[str, Any]:
+    """
+    请求Pexels搜索接口
+    
+    参数:
+    tag (str): 搜索关键词
+    
+    返回:
+    Dict[str, Any]: 接口返回的JSON，请求失败时返回None
+    """
+    import aiohttp
     pexels_api_key = config['pexels_api_key']
     pexels_base_url = config['pexels_base_url']
     
@@ -82,235 +195,267 @@ async def get_video_source(tag: str, video_save_path: str) -> str:
 
     try:
         # 发送 GET 请求搜索视频
-        async with session.get(pexels_base_url, headers=headers, params=params) as response:
-            if response.status != 200:
-                logger.error(f"请求失败，状态码：{response.status}")
-                return None
-                
-            data = await response.json()
-            logger.info(f"请求成功！找到 {data.get('total_results', 0)} 个结果。")
-            
-            # 检查是否有视频结果
-            if not data.get('videos') or len(data['videos']) == 0:
-                logger.warning("未找到相关视频")
-                return None
-            
-            # 收集所有符合条件的视频及其文件
-            candidate_videos = []
-            
-            for video in data['videos']:
-                # 获取视频时长
-                duration = video.get('duration', 0)
-                
-                # 跳过时长小于10秒的视频
-                if duration < 10:
-                    continue
-                
-                # 检查视频文件
-                video_files = video.get('video_files', [])
-                for file in video_files:
-                    width = file.get('width', 0)
-                    height = file.get('height', 0)
-                    file_size = file.get('size', 0)  # 如果有文件大小信息
-                    
-                    # 只考虑宽度大于高度的视频
-                    if width <= height:
-                        continue
-                    
-                    # 只考虑分辨率不低于480p的视频文件
-                    if min(width, height) < 480:
-                        continue
-                    
-                    # 计算宽高比得分（越接近16/9得分越高）
-                    aspect_ratio = width / height
-                    target_ratio = 16 / 9
-                    aspect_score = 1 / (1 + abs(aspect_ratio - target_ratio))
-                    
-                    # 计算综合得分（优先考虑接近16/9宽高比，其次考虑文件大小）
-                    # 这里给宽高比得分更高的权重
-                    composite_score = aspect_score * 1000 + (1 / (file_size + 1)) if file_size > 0 else aspect_score * 1000
-                    
-                    candidate_videos.append({
-                        'video': video,
-                        'file': file,
-                        'duration': duration,
-                        'width': width,
-                        'height': height,
-                        'file_size': file_size,
-                        'aspect_score': aspect_score,
-                        'composite_score': composite_score
-                    })
-            
-            # 如果没有找到符合条件的视频
-            if not candidate_videos:
-                logger.info("未找到宽度>高度且分辨率≥480p的视频，尝试放宽条件...")
-                
-                # 放宽条件：只要求宽度>高度，不限制分辨率
-                for video in data['videos']:
-                    duration = video.get('duration', 0)
-                    
-                    # 跳过时长小于10秒的视频
-                    if duration < 10:
-                        continue
-                    
-                    video_files = video.get('video_files', [])
-                    for file in video_files:
-                        width = file.get('width', 0)
-                        height = file.get('height', 0)
-                        file_size = file.get('size', 0)
-                        
-                        # 只考虑宽度大于高度的视频
-                        if width <= height:
-                            continue
-                        
-                        # 计算宽高比得分
-                        aspect_ratio = width / height
-                        target_ratio = 16 / 9
-                        aspect_score = 1 / (1 + abs(aspect_ratio - target_ratio))
-                        
-                        # 计算综合得分
-                        composite_score = aspect_score * 1000 + (1 / (file_size + 1)) if file_size > 0 else aspect_score * 1000
-                        
-                        candidate_videos.append({
-                            'video': video,
-                            'file': file,
-                            'duration': duration,
-                            'width': width,
-                            'height': height,
-                            'file_size': file_size,
-                            'aspect_score': aspect_score,
-                            'composite_score': composite_score
-                        })
-            
-            # 如果还是没有找到宽度>高度的视频
-            if not candidate_videos:
-                logger.info("未找到宽度>高度的视频，尝试使用任何方向的视频...")
-                
-                # 放宽条件：不考虑方向，只要求时长≥10秒
-                for video in data['videos']:
-                    duration = video.get('duration', 0)
-                    
-                    # 跳过时长小于10秒的视频
-                    if duration < 10:
-                        continue
-                    
-                    video_files = video.get('video_files', [])
-                    for file in video_files:
-                        width = file.get('width', 0)
-                        height = file.get('height', 0)
-                        file_size = file.get('size', 0)
-                        
-                        # 计算宽高比得分（如果是竖屏视频，得分会很低）
-                        aspect_ratio = width / height
-                        target_ratio = 16 / 9
-                        aspect_score = 1 / (1 + abs(aspect_ratio - target_ratio))
-                        
-                        # 计算综合得分
-                        composite_score = aspect_score * 1000 + (1 / (file_size + 1)) if file_size > 0 else aspect_score * 1000
-                        
-                        candidate_videos.append({
-                            'video': video,
-                            'file': file,
-                            'duration': duration,
-                            'width': width,
-                            'height': height,
-                            'file_size': file_size,
-                            'aspect_score': aspect_score,
-                            'composite_score': composite_score
-                        })
-            
-            # 如果还是没有找到任何视频
-            if not candidate_videos:
-                logger.info("未找到时长≥10秒的视频，选择最接近10秒的视频")
-                
-                # 选择所有视频中时长最接近10秒的
-                closest_duration_video = min(
-                    data['videos'], 
-                    key=lambda x: abs(x.get('duration', 0) - 10)
-                )
-                
-                duration = closest_duration_video.get('duration', 0)
-                video_files = closest_duration_video.get('video_files', [])
-                
-                # 选择文件大小最小的视频文件
-                try:
-                    selected_file = min(
-                        video_files, 
-                        key=lambda x: x.get('size', float('inf'))
-                    )
-                except:
-                    selected_file = video_files[0] if video_files else None
-                
-                if not selected_file:
-                    logger.error("未找到任何视频文件")
+        with metrics.request('pexels_search') as outcome:
+            async with session.get(pexels_base_url, headers=headers, params=params) as response:
+                if response.status != 200:
+                    outcome['status'] = str(response.status)
+                    logger.error(f"请求失败，状态码：{response.status}")
                     return None
-                
-                # 创建候选视频项
-                candidate_videos = [{
-                    'video': closest_duration_video,
-                    'file': selected_file,
-                    'duration': duration,
-                    'width': selected_file.get('width', 0),
-                    'height': selected_file.get('height', 0),
-                    'file_size': selected_file.get('size', 0),
-                    'aspect_score': 0,  # 无法计算宽高比得分
-                    'composite_score': 0  # 无法计算综合得分
-                }]
-            
-            # 从符合条件的视频中选择综合得分最高的
-            try:
-                selected = max(candidate_videos, key=lambda x: x['composite_score'])
-            except:
-                selected = candidate_videos[0]
-            
-            video_url = selected['file']['link']
-            logger.info(f"选择视频: {selected['video'].get('url', 'N/A')}")
-            logger.info(f"视频时长: {selected['duration']}秒")
-            logger.info(f"视频分辨率: {selected['width']}x{selected['height']}")
-            logger.info(f"宽高比: {selected['width']/selected['height']:.2f}:1")
+                    
+                data = await response.json()
+        logger.info(f"请求成功！找到 {data.get('total_results', 0)} 个结果。")
+        return data
             
-            # 下载视频
-            logger.info(f"下载视频: {video_url}")
+    except aiohttp.ClientError as e:
+        logger.error(f"网络请求出错: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"发生错误: {e}")
+        return None
+
+async def search_video_candidate(tag: str) -> Dict[str, Any]:
+    """
+    在Pexels上搜索视频并选出最合适的视频文件（只搜索，不下载）
+    
+    参数:
+    tag (str): 搜索关键词
+    
+    返回:
+    Dict[str, Any]: 选中的候选项，失败时返回None
+    """
+    data = await pexels_search(tag)
+    if data is None:
+        return None
+    
+    # 检查是否有视频结果
+    if not data.get('videos') or len(data['videos']) == 0:
+        logger.warning("未找到相关视频")
+        return None
+    
+    return select_video_file(data)
+
+async def fetch_video_file(candidate: Dict[str, Any], save_path: str, progress: Dict[str, Any]) -> str:
+    """
+    下载单个候选视频文件，并把已下载字节数记录到 progress 中
+    
+    返回:
+    str: 成功时返回保存路径，失败时返回None
+    """
+    import aiohttp
+    import aiofiles
+    video_url = candidate['file']['link']
+    progress['start'] = time.monotonic()
+    logger.info(f"下载视频: {video_url} ({candidate['width']}x{candidate['height']}, {candidate['duration']}秒)")
+    try:
+        with metrics.request('pexels_file') as outcome:
             async with session.get(video_url) as video_response:
                 if video_response.status != 200:
+                    outcome['status'] = str(video_response.status)
                     logger.error(f"视频下载失败，状态码：{video_response.status}")
                     return None
                 
                 # 使用aiofiles异步保存文件
-                async with aiofiles.open(video_save_path, 'wb') as f:
+                async with aiofiles.open(save_path, 'wb') as f:
                     async for chunk in video_response.content.iter_chunked(8192):
                         await f.write(chunk)
-            
-            logger.info(f"视频已保存到: {video_save_path}")
-            return video_save_path
-            
+                        progress['bytes'] += len(chunk)
+        return save_path
     except aiohttp.ClientError as e:
         logger.error(f"网络请求出错: {e}")
         return None
+    finally:
+        # 被对冲取消的下载也计入，用来观察浪费的带宽
+        metrics.inc('download_bytes_total', progress['bytes'])
+
+@metrics.traced('download')
+async def download_video(selected: Dict[str, Any], video_save_path: str, limited=None) -> str:
+    """
+    下载选中的视频文件，下载过慢、超时或失败时对备用候选发起对冲请求，
+    先完成的请求胜出，其余请求被取消
+    
+    参数:
+    selected (Dict[str, Any]): search_video_candidate 返回的候选项
+    video_save_path (str): 视频保存路径（包括文件名和扩展名）
+    limited: 并发限制，每个请求（包括对冲请求）单独占用一个名额，为None时不限制
+    
+    返回:
+    str: 成功时返回保存的视频路径，失败时返回None
+    """
+    # 确保保存目录存在
+    save_dir = os.path.dirname(video_save_path)
+    if save_dir and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    
+    # 确保会话已初始化
+    await init_session()
+    
+    logger.info(f"选择视频: {selected['video'].get('url', 'N/A')}")
+    
+    hedge_deadline = config.get('pexels_hedge_deadline', 60)  # 单个请求超过该时间未完成则对冲（秒）
+    hedge_grace = config.get('pexels_hedge_grace', 5)  # 开始下载后多久开始检查速度（秒）
+    min_throughput = config.get('pexels_hedge_min_kbps', 200) * 1024  # 低于该速度则对冲（字节/秒）
+    
+    pending = [selected] + list(selected.get('fallbacks', []))
+    attempts = {}  # task -> (临时文件路径, 进度)
+    
+    def start_next():
+        candidate = pending.pop(0)
+        part_path = f'{video_save_path}.{len(attempts)}.part'
+        # start 在拿到并发名额、真正开始下载时设置
+        progress = {'bytes': 0, 'start': None}
+        fetch = fetch_video_file(candidate, part_path, progress)
+        task = asyncio.ensure_future(limited(fetch) if limited else fetch)
+        attempts[task] = (part_path, progress)
+        return task
+    
+    running = {start_next()}
+    winner = None
+    try:
+        while running and winner is None:
+            done, running = await asyncio.wait(running, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result() is not None:
+                    winner = task
+                    break
+            if winner is not None:
+                break
+            
+            if done and not running and pending:
+                logger.warning(f"视频下载失败，改用备用候选（剩余 {len(pending)} 个）")
+                running.add(start_next())
+                continue
+            
+            # 只检查最新的请求，避免同时对冲过多；还在等待并发名额的请求不计时
+            if running and pending:
+                newest = [t for t in attempts if t in running][-1]
+                progress = attempts[newest][1]
+                if progress['start'] is None:
+                    continue
+                elapsed = time.monotonic() - progress['start']
+                throughput = progress['bytes'] / elapsed if elapsed > 0 else 0
+                if elapsed > hedge_deadline or (elapsed > hedge_grace and throughput < min_throughput):
+                    logger.warning(f"视频下载过慢（{throughput / 1024:.0f} KB/s，已用 {elapsed:.0f} 秒），发起对冲请求")
+                    running.add(start_next())
+    finally:
+        # 取消未完成的请求并清理临时文件
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        for task, (part_path, _) in attempts.items():
+            if task is not winner and os.path.exists(part_path):
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
+    
+    if winner is None:
+        logger.error(f"视频下载失败: {video_save_path}")
+        return None
+    
+    os.replace(attempts[winner][0], video_save_path)
+    logger.info(f"视频已保存到: {video_save_path}")
+    return video_save_path
+
+@metrics.traced('source_clip')
+async def get_video_source(tag: str, video_save_path: str) -> str:
+    """
+    从Pexels API获取视频并保存到指定路径（异步版本）
+    
+    参数:
+    tag (str): 搜索关键词
+    video_save_path (str): 视频保存路径（包括文件名和扩展名）
+    
+    返回:
+    str: 成功时返回保存的视频路径，失败时返回None
+    """
+    selected = await search_video_candidate(tag)
+    if selected is None:
+        return None
+    return await download_video(selected, video_save_path)
+
+def get_audio_duration(voice_path: str) -> float:
+    """
+    读取配音文件时长（秒），文件不存在或读取失败时返回None
+    """
+    if not os.path.exists(voice_path):
+        return None
+    try:
+        # 只用 ffmpeg 读取文件信息，不解码音频
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+        return ffmpeg_parse_infos(voice_path).get('duration')
     except Exception as e:
-        logger.error(f"发生错误: {e}")
+        logger.error(f"读取音频时长失败 {voice_path}: {e}")
         return None
 
+def plan_clips(candidates: List[Dict[str, Any]], audio_duration: float) -> List[Dict[str, Any]]:
+    """
+    按标签排名顺序挑选素材，直到总时长覆盖配音时长
+    
+    参数:
+    candidates (List[Dict[str, Any]]): 按排名排序的候选素材（需包含 duration 字段）
+    audio_duration (float): 配音时长（秒），为None时不做裁剪
+    
+    返回:
+    List[Dict[str, Any]]: 需要下载的候选素材
+    """
+    if not audio_duration:
+        return list(candidates)
+    
+    planned = []
+    total_duration = 0
+    for candidate in candidates:
+        if total_duration >= audio_duration:
+            break
+        planned.append(candidate)
+        total_duration += candidate['duration']
+    
+    # 素材总时长不足时全部下载，由 creat_videos 循环使用
+    if total_duration < audio_duration:
+        logger.info(f"素材总时长 ({total_duration} 秒) 小于音频时长 ({audio_duration:.1f} 秒)，将全部下载")
+    return planned
+
+# 全局翻译服务
+translator = None
+
+def get_translator() -> TranslationService:
+    """获取翻译服务（带持久化缓存和本地词典）"""
+    global translator
+    if translator is None:
+        translator = TranslationService(config)
+    return translator
+
 def zn2en(text: str) -> str:
     """同步翻译函数"""
-    try:
-        translator = Translator(from_lang="zh", to_lang="en")
-        translation = translator.translate(text)
-        return translation
-    except Exception as e:
-        logger.error(f"翻译出错: {e}")
-        return text  # 出错时返回原文本
+    return get_translator().translate_many_sync([text])[text]
 
 async def async_zn2en(text: str) -> str:
-    """异步翻译函数（在线程池中运行）"""
-    loop = asyncio.get_event_loop()
+    """异步翻译函数（在翻译服务的线程池中运行）"""
     try:
-        # 在线程池中运行同步翻译函数
-        return await loop.run_in_executor(None, zn2en, text)
+        return (await get_translator().translate_many([text]))[text]
     except Exception as e:
         logger.error(f"异步翻译出错: {e}")
         return text
 
+def make_pexels_limiter(semaphore: asyncio.Semaphore = None):
+    """
+    Pexels 请求限流：最多 pexels_max_concurrent 个请求同时进行，每个请求前随机延迟
+    
+    参数:
+    semaphore: 共用的信号量，为None时按配置新建
+    
+    返回:
+    limited(task): 在限流下等待协程 task 并返回其结果
+    """
+    semaphore = semaphore or asyncio.Semaphore(config['pexels_max_concurrent'])
+    
+    async def limited(task):
+        async with semaphore:
+            # 添加随机延迟，避免请求过于频繁
+            await asyncio.sleep(random.uniform(config['pexels_sleep'], config['pexels_sleep'] * 2))
+            return await task
+    return limited
+
 def create_folder(folder_dir: str):
     """创建文件夹"""
     try:
@@ -318,43 +463,108 @@ def create_folder(folder_dir: str):
     except Exception as e:
         logger.error(f"创建文件夹失败: {e}")
 
-async def process_tag(tags: Dict[str, Any], folder_dir: str, index: int, tag: str):
-    """处理单个标签的异步函数"""
+async def process_tag(index: int, tag: str, tag_en: str, limited) -> Dict[str, Any]:
+    """搜索单个标签，返回选中的候选素材（不下载）"""
     try:
-        tag_en = await async_zn2en(tag)  # 异步翻译
-        video_save_path = f'{folder_dir}/{index}-{tag}-{tag_en}.mp4'
-        result = await get_video_source(tag_en, video_save_path)
-        return result
+        selected = await limited(search_video_candidate(tag_en))
+        if selected is None:
+            return None
+        selected.update({'index': index, 'tag': tag, 'tag_en': tag_en})
+        return selected
     except Exception as e:
         logger.error(f"处理标签 {tag} 时出错: {e}")
         return None
 
+@metrics.traced('source')
+async def process_topic(topic_index: int, tags: Dict[str, Any], folder_dir: str,
+                        tag_map: Dict[str, str], limited) -> List[str]:
+    """为单个话题搜索素材，按配音时长规划后只下载需要的视频"""
+    # 先搜索所有标签，保持标签的排名顺序
+    found = await asyncio.gather(*[
+        process_tag(index, tag, tag_map.get(tag, tag), limited)
+        for index, tag in enumerate(tags['tags'])
+    ])
+    candidates = [c for c in found if c is not None]
+    
+    audio_duration = None
+    if config.get('plan_clips_by_audio', True):
+        voice_path = f'{get_context().voices_dir}/{topic_index}.mp3'
+        loop = asyncio.get_event_loop()
+        audio_duration = await loop.run_in_executor(None, get_audio_duration, voice_path)
+    
+    planned = plan_clips(candidates, audio_duration)
+    logger.info(f"话题 {topic_index}: 搜索到 {len(candidates)} 个素材，计划下载 {len(planned)} 个")
+    
+    results = await asyncio.gather(*[
+        download_video(c, f'{folder_dir}/{c["index"]}-{c["tag"]}-{c["tag_en"]}.mp4', limited)
+        for c in planned
+    ], return_exceptions=True)
+    
+    # 入库时把素材转码为规范格式，渲染时只需流复制拼接
+    if config.get('normalize_clips', False):
+        await asyncio.gather(*[
+            normalize_downloaded(r) for r in results if isinstance(r, str)
+        ])
+    return results
+
+# 限制同时运行的转码进程数
+normalize_semaphore = None
+
+async def normalize_downloaded(video_path: str) -> str:
+    """在线程池中把下载好的素材规范化（按内容哈希缓存，同一素材只转码一次）"""
+    global normalize_semaphore
+    if normalize_semaphore is None:
+        normalize_semaphore = asyncio.Semaphore(config.get('normalize_max_concurrent', 2))
+    cache_dir = os.path.join(config['source_dir'], 'normalized')
+    async with normalize_semaphore:
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(
+                None, normalize_clip, video_path, cache_dir, normalize_params(config)
+            )
+        except Exception as e:
+            logger.error(f"规范化素材失败 {video_path}: {e}")
+            return None
+
 async def get_videos():
-    """异步获取所有视频"""
+    """异步获取所有视频（话题清单中已配音、还没有素材的话题）"""
+    context = get_context()
+    topics = manifest.open_manifest()
+    pending = topics.pending('source')
+    tags_list = list(pending.values())
+    video_output_dir = context.videos_dir
     create_folder(video_output_dir)
-    folder_dir_list = [f'{video_output_dir}/{i}' for i in range(len(tags_list))]
+    folder_dir_list = [f'{video_output_dir}/{i}' for i in pending]
     for dir in folder_dir_list:
         create_folder(dir)
     
-    # 创建所有任务
-    tasks = []
-    for tags, folder_dir in zip(tags_list, folder_dir_list):
-        for index, tag in enumerate(tags['tags']):
-            # 为每个标签创建一个任务
-            task = process_tag(tags, folder_dir, index, tag)
-            tasks.append(task)
-    
     # 限制并发数，避免过多请求
-    semaphore = asyncio.Semaphore(config['pexels_max_concurrent'])  # 并发请求个数
+    limited = make_pexels_limiter()
     
-    async def limited_task(task):
-        async with semaphore:
-            # 添加随机延迟，避免请求过于频繁
-            await asyncio.sleep(random.uniform(config['pexels_sleep'], config['pexels_sleep']*2))
-            return await task
+    # 所有标签一次性批量翻译（优先命中缓存和本地词典）
+    all_tags = [tag for tags in tags_list for tag in tags.get('tags', [])]
+    try:
+        tag_map = await get_translator().translate_many(all_tags)
+    except Exception as e:
+        logger.error(f"批量翻译出错: {e}")
+        tag_map = {}
+    
+    # 每个话题一个任务，话题内部先搜索再按需下载
+    tasks = [
+        process_topic(i, tags, folder_dir, tag_map, limited)
+        for i, tags, folder_dir in zip(pending, tags_list, folder_dir_list)
+    ]
+    topic_results = await asyncio.gather(*tasks, return_exceptions=True)
     
-    # 执行所有任务
-    results = await asyncio.gather(*[limited_task(task) for task in tasks], return_exceptions=True)
+    results = []
+    for i, r in zip(pending, topic_results):
+        if isinstance(r, Exception):
+            logger.error(f"处理话题 {i} 时出错: {r}")
+            continue
+        results.extend(r)
+        clips = sum(1 for x in r if isinstance(x, str))
+        if clips:
+            topics.append(i, 'source', clips=clips)
     
     # 统计结果
     success_count = sum(1 for r in results if r is not None and not isinstance(r, Exception))
@@ -370,6 +580,8 @@ async def main():
         return results
     finally:
         await close_session()
+        if translator is not None:
+            translator.close()
 
 if __name__ == '__main__':
     # 运行异步主函数
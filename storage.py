@@ -0,0 +1,371 @@
+"""
+磁盘预算管理：dataset_dir 和 source_dir 每天都会增加一整天的 CSV、配音、素材和成片，
+超过预算时按最近使用时间（LRU）淘汰，超过最长保留天数的文件直接淘汰
+
+以下文件不会被淘汰:
+- 当天、最近 storage_keep_days 天以及任务队列中还有未完成任务的日期
+- 还没有上传成功的成片和封面（按上传账本判断）
+- 仍被保留日期的素材引用的规范化缓存（source_dir/normalized）
+- 清单、账本、索引等元数据，以及正在写入的临时文件
+
+用法:
+python storage.py report              # 查看占用、受保护和可回收的空间
+python storage.py clean [--dry-run]   # 淘汰到预算以内
+python storage.py watch --interval 600  # 在后台定时清理
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import threading
+
+from context import RunContext, config, get_context, set_context
+
+logger = logging.getLogger(__name__)
+
+TREES = ('dataset_dir', 'source_dir')
+
+DAY_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+OUTPUT_RE = re.compile(r'^(\d+)(\.mp4|\.cover\.jpg)$')
+
+# 元数据（清单、账本、素材索引、任务队列）很小且被其他阶段依赖，不参与淘汰
+METADATA_SUFFIXES = ('.json', '.jsonl', '.db', '.db-wal', '.db-shm')
+IN_PROGRESS_SUFFIXES = ('.part', '.tmp', '.part.mp4', '.tmp.mp4')
+
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(value) -> int:
+    """把 '50G'、'512M'、1073741824 这样的预算转为字节数，空值返回None"""
+    if value in (None, '', 0):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)i?B?\s*', str(value).upper())
+    if not match:
+        raise ValueError(f"无法解析的容量: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(size) < 1024 or unit == 'G':
+            return f'{size:.1f}{unit}' if unit != 'B' else f'{size}B'
+        size /= 1024
+
+
+def classify(parts) -> str:
+    """按相对路径判断文件类型"""
+    if parts[0] == 'normalized':
+        return 'normalized'
+    if len(parts) < 2 or not DAY_RE.match(parts[0]):
+        return 'other'
+    if parts[1].endswith('.csv'):
+        return 'dataset'
+    return {'voices': 'voice', 'videos': 'clip', 'videos_out': 'output', 'reports': 'report',
+            'cassette': 'cassette'}.get(parts[1], 'other')
+
+
+def scan(root: str) -> list:
+    """
+    列出目录下的所有文件，返回 [{root, path, size, last_used, day, kind, parts}]
+    磁带目录作为一个整体（只淘汰部分响应会导致无法回放）
+    """
+    artifacts = []
+    if not os.path.isdir(root):
+        return artifacts
+
+    def walk(path, parts):
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_symlink():
+                continue
+            entry_parts = parts + [entry.name]
+            try:
+                if entry.is_dir():
+                    if len(entry_parts) == 2 and entry.name == 'cassette':
+                        artifacts.append(directory_artifact(root, entry.path, entry_parts))
+                    else:
+                        walk(entry.path, entry_parts)
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            artifacts.append({
+                'root': root,
+                'path': entry.path,
+                'size': stat.st_size,
+                'last_used': max(stat.st_atime, stat.st_mtime),
+                'day': entry_parts[0] if DAY_RE.match(entry_parts[0]) else None,
+                'kind': classify(entry_parts),
+                'parts': entry_parts,
+            })
+
+    walk(root, [])
+    return artifacts
+
+
+def directory_artifact(root, path, parts) -> dict:
+    size = 0
+    last_used = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                stat = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            last_used = max(last_used, stat.st_atime, stat.st_mtime)
+    return {'root': root, 'path': path, 'size': size, 'last_used': last_used, 'day': parts[0],
+            'kind': 'cassette', 'parts': parts}
+
+
+def active_days(days) -> set:
+    """任务队列中还有待执行或执行中任务的日期"""
+    path = config.get('job_queue_path') or os.path.join(config['source_dir'], 'jobs.db')
+    if not os.path.exists(path):
+        return set()
+    from job_queue import JobQueue
+    queue = JobQueue(path)
+    return {day for day in days if queue.has_unfinished(day=day)}
+
+
+def read_ledger(root, day) -> dict:
+    try:
+        with open(os.path.join(root, day, 'videos_out', 'upload_ledger.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def clip_hashes(root, day) -> set:
+    """某天所有素材的内容哈希（来自素材索引 .clips.json），规范化缓存按它命名"""
+    hashes = set()
+    videos_dir = os.path.join(root, day, 'videos')
+    if not os.path.isdir(videos_dir):
+        return hashes
+    for folder in os.listdir(videos_dir):
+        try:
+            with open(os.path.join(videos_dir, folder, '.clips.json'), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            continue
+        hashes.update(entry['sha256'][:32] for entry in index.values() if entry.get('sha256'))
+    return hashes
+
+
+def protect(artifacts, roots) -> None:
+    """给不能淘汰的文件标上原因（protected 字段）"""
+    context = get_context()
+    keep_days = config.get('storage_keep_days', 1)
+    today = datetime.date.today()
+    recent = {(today - datetime.timedelta(days=i)).isoformat() for i in range(max(1, keep_days))}
+    days = {a['day'] for a in artifacts if a['day']}
+    keep = recent | {context.day} | active_days(days)
+
+    ledgers = {}
+    referenced = set()
+    for root in roots:
+        for day in days & keep:
+            referenced |= clip_hashes(root, day)
+
+    for a in artifacts:
+        name = a['parts'][-1]
+        a['protected'] = None
+        if a['day'] in keep:
+            a['protected'] = 'active_day'
+        elif name.endswith(METADATA_SUFFIXES) or name.startswith('.'):
+            a['protected'] = 'metadata'
+        elif name.endswith(IN_PROGRESS_SUFFIXES):
+            a['protected'] = 'in_progress'
+        elif a['kind'] == 'output':
+            match = OUTPUT_RE.match(name)
+            if match:
+                key = (a['root'], a['day'])
+                if key not in ledgers:
+                    ledgers[key] = read_ledger(*key)
+                ledger = ledgers[key]
+                if ledger.get(match.group(1), {}).get('state') != 'submitted':
+                    a['protected'] = 'pending_upload'
+        elif a['kind'] == 'normalized' and name[:32] in referenced:
+            a['protected'] = 'cache_ref'
+
+
+def plan(tree: str) -> dict:
+    """
+    计算某个目录的清理计划
+
+    返回:
+    dict: total 总占用，budget 预算，by_kind 各类型占用，protected 各保护原因的占用，
+          reclaimable 可回收的空间，evict 计划淘汰的文件（最久未使用的在前）
+    """
+    root = config[tree]
+    budget = parse_size((config.get('storage_budgets') or {}).get(tree))
+    max_age_days = config.get('storage_max_age_days', 0)
+    artifacts = scan(root)
+    protect(artifacts, [config[t] for t in TREES])
+
+    total = sum(a['size'] for a in artifacts)
+    by_kind = {}
+    protected = {}
+    for a in artifacts:
+        by_kind[a['kind']] = by_kind.get(a['kind'], 0) + a['size']
+        if a['protected']:
+            protected[a['protected']] = protected.get(a['protected'], 0) + a['size']
+    candidates = sorted((a for a in artifacts if not a['protected']), key=lambda a: a['last_used'])
+
+    evict = []
+    if max_age_days:
+        cutoff = (datetime.date.today() - datetime.timedelta(days=max_age_days)).isoformat()
+        evict = [a for a in candidates if a['day'] and a['day'] < cutoff]
+    remaining = total - sum(a['size'] for a in evict)
+    if budget is not None:
+        chosen = {id(a) for a in evict}
+        for a in candidates:
+            if remaining <= budget:
+                break
+            if id(a) not in chosen:
+                evict.append(a)
+                remaining -= a['size']
+    return {
+        'tree': tree, 'root': root, 'total': total, 'budget': budget, 'by_kind': by_kind,
+        'protected': protected, 'reclaimable': sum(a['size'] for a in candidates),
+        'evict': evict, 'after': remaining,
+    }
+
+
+def remove_empty_dirs(path, root):
+    """删除文件后向上清理空目录，不删除根目录"""
+    path = os.path.dirname(path)
+    root = os.path.abspath(root)
+    while os.path.abspath(path) != root and path.startswith(root):
+        try:
+            os.rmdir(path)
+        except OSError:
+            break
+        path = os.path.dirname(path)
+
+
+def evict(result: dict, dry_run: bool = False, pause: float = 0.0) -> int:
+    """执行清理计划，返回释放的字节数；pause 为每删除一个文件后的等待时间（后台清理时降低磁盘压力）"""
+    freed = 0
+    for a in result['evict']:
+        if dry_run:
+            freed += a['size']
+            continue
+        try:
+            if os.path.isdir(a['path']):
+                shutil.rmtree(a['path'])
+            else:
+                os.remove(a['path'])
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.warning(f"删除失败 {a['path']}: {e}")
+            continue
+        freed += a['size']
+        remove_empty_dirs(a['path'], result['root'])
+        if pause:
+            time.sleep(pause)
+    return freed
+
+
+def clean(dry_run: bool = False, pause: float = 0.0) -> dict:
+    """按预算清理所有目录，返回 {目录配置项: 释放的字节数}"""
+    freed = {}
+    for tree in TREES:
+        result = plan(tree)
+        if result['budget'] is not None and result['after'] > result['budget']:
+            logger.warning(f"{tree}: 受保护的文件超过预算，清理后仍占用 {format_size(result['after'])}"
+                           f"（预算 {format_size(result['budget'])}）")
+        if not result['evict']:
+            continue
+        freed[tree] = evict(result, dry_run, pause)
+        logger.info(f"{tree}: {'可' if dry_run else '已'}释放 {format_size(freed[tree])}"
+                    f"（{len(result['evict'])} 个文件），占用 {format_size(result['total'])} -> "
+                    f"{format_size(result['total'] - freed[tree])}")
+    return freed
+
+
+class StorageWatcher:
+    """在后台线程中定时清理，不阻塞流水线的各个阶段（只删除不受保护的旧文件）"""
+
+    def __init__(self, interval: float, pause: float = 0.05):
+        self.interval = interval
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='storage-watcher', daemon=True)
+
+    def _loop(self):
+        while True:
+            try:
+                clean(pause=self.pause)
+            except Exception as e:
+                logger.error(f"磁盘清理出错: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def start_background(interval: float = None) -> StorageWatcher:
+    """按配置启动后台清理，未启用（间隔为 0）时返回None"""
+    interval = interval if interval is not None else config.get('storage_check_interval', 0)
+    if not interval:
+        return None
+    return StorageWatcher(interval).start()
+
+
+def print_report(result: dict):
+    budget = format_size(result['budget']) if result['budget'] is not None else '不限'
+    print(f"\n{result['tree']} ({result['root']}): 占用 {format_size(result['total'])}，预算 {budget}")
+    for kind, size in sorted(result['by_kind'].items(), key=lambda kv: -kv[1]):
+        print(f"  {kind:<12}{format_size(size):>10}")
+    for reason, size in sorted(result['protected'].items(), key=lambda kv: -kv[1]):
+        print(f"  受保护 {reason:<16}{format_size(size):>10}")
+    print(f"  可回收 {format_size(result['reclaimable'])}，按预算需淘汰 {len(result['evict'])} 个文件 "
+          f"{format_size(sum(a['size'] for a in result['evict']))}，清理后 {format_size(result['after'])}")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='按磁盘预算清理数据集和素材目录')
+    parser.add_argument('command', choices=['report', 'clean', 'watch'])
+    parser.add_argument('--day', help='当前处理的日期（这一天不会被清理），默认今天')
+    parser.add_argument('--dry-run', action='store_true', help='只显示会删除多少，不实际删除')
+    parser.add_argument('--interval', type=float, default=600, help='watch 模式的检查间隔（秒）')
+    args = parser.parse_args(argv)
+
+    if args.day:
+        set_context(RunContext(day=args.day))
+    if args.command == 'report':
+        for tree in TREES:
+            print_report(plan(tree))
+    elif args.command == 'clean':
+        freed = clean(args.dry_run)
+        print(f"共{'可' if args.dry_run else '已'}释放 {format_size(sum(freed.values()))}")
+    else:
+        watcher = StorageWatcher(args.interval).start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            watcher.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# 在线接口额度用完或请求被拒绝时会把提示信息当作译文返回（例如 MYMEMORY WARNING: YOU USED ALL AVAILABLE FREE TRANSLATIONS）
+INVALID_RESULT = re.compile(r'MYMEMORY WARNING|QUERY LENGTH LIMIT|INVALID LANGUAGE PAIR|PLEASE SELECT TWO DISTINCT LANGUAGES',
+                            re.IGNORECASE)
+
+
+def valid_result(text: str) -> bool:
+    """译文非空且不是接口的提示信息"""
+    return bool(text and text.strip()) and not INVALID_RESULT.search(text)
+
+
+class DictBackend:
+    """本地词典翻译后端（离线），词典文件为 {中文: 英文} 格式的JSON"""
+
+    def __init__(self, dict_path: str):
+        self.table = {}
+        if dict_path and os.path.exists(dict_path):
+            try:
+                with open(dict_path, 'r', encoding='utf-8') as f:
+                    self.table = json.load(f)
+                logger.info(f"已加载本地翻译词典 {dict_path}，共 {len(self.table)} 条")
+            except Exception as e:
+                logger.error(f"读取本地翻译词典失败: {e}")
+
+    def translate_batch(self, texts: List[str]) -> Dict[str, str]:
+        """返回词典中能查到的翻译"""
+        return {text: self.table[text] for text in texts if text in self.table}
+
+
+class OnlineBackend:
+    """translate 库在线翻译后端，多个词用换行拼接后一次请求"""
+
+    def __init__(self, max_chars: int = 450):
+        from translate import Translator
+        self.translator = Translator(from_lang="zh", to_lang="en")
+        self.max_chars = max_chars  # 在线接口单次请求的字数上限
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        batches, batch, length = [], [], 0
+        for text in texts:
+            if batch and length + len(text) + 1 > self.max_chars:
+                batches.append(batch)
+                batch, length = [], 0
+            batch.append(text)
+            length += len(text) + 1
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def translate_batch(self, texts: List[str]) -> Dict[str, str]:
+        results = {}
+        for batch in self._batches(texts):
+            try:
+                lines = self.translator.translate('\n'.join(batch)).split('\n')
+                if len(lines) == len(batch):
+                    results.update({src: dst.strip() for src, dst in zip(batch, lines) if valid_result(dst)})
+                    continue
+                # 返回行数对不上时退回逐个翻译，空结果和接口提示信息不算翻译成功（不写入缓存）
+                for text in batch:
+                    dst = self.translator.translate(text)
+                    if valid_result(dst):
+                        results[text] = dst.strip()
+                    else:
+                        logger.warning(f"翻译结果无效，跳过: {text} -> {dst!r}")
+            except Exception as e:
+                logger.error(f"翻译出错: {e}")
+        return results
+
+
+BACKENDS = {
+    'dict': lambda config: DictBackend(config.get('translate_dict_path', 'translate_dict.json')),
+    'online': lambda config: OnlineBackend(),
+}
+
+
+class TranslationService:
+    """
+    中译英服务：持久化缓存 + 可插拔后端（按顺序尝试） + 独立的有界线程池
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.cache_path = config.get('translate_cache_path') or f'{config["source_dir"]}/translate_cache.json'
+        self.backend_names = config.get('translate_backends', ['dict', 'online'])
+        self.backends = None
+        self.config = config
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.get('translate_max_workers', 2),
+            thread_name_prefix='translate'
+        )
+        self.cache = self._load_cache()
+        self.lock = threading.Lock()
+
+    def _load_cache(self) -> Dict[str, str]:
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"读取翻译缓存失败: {e}")
+            return {}
+
+    def _save_cache(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            tmp_path = f'{self.cache_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.error(f"保存翻译缓存失败: {e}")
+
+    def _get_backends(self):
+        # 后端延迟创建，缓存全部命中时不会导入在线翻译库
+        if self.backends is None:
+            self.backends = []
+            for name in self.backend_names:
+                try:
+                    self.backends.append(BACKENDS[name](self.config))
+                except Exception as e:
+                    logger.error(f"初始化翻译后端 {name} 失败: {e}")
+        return self.backends
+
+    def translate_many_sync(self, texts: List[str]) -> Dict[str, str]:
+        """同步批量翻译，返回 {原文: 译文}，翻译失败的返回原文；只在读写缓存时持有锁，在线请求不互相阻塞"""
+        with self.lock:
+            pending = [t for t in dict.fromkeys(texts) if t not in self.cache]
+            backends = self._get_backends() if pending else []
+        if pending:
+            translated = {}
+            for backend in backends:
+                found = backend.translate_batch(pending)
+                translated.update(found)
+                pending = [t for t in pending if t not in found]
+                if not pending:
+                    break
+            if translated:
+                with self.lock:
+                    self.cache.update(translated)
+                    self._save_cache()
+            if pending:
+                logger.warning(f"{len(pending)} 个词翻译失败，使用原文")
+        with self.lock:
+            return {text: self.cache.get(text, text) for text in texts}
+
+    async def translate_many(self, texts: List[str]) -> Dict[str, str]:
+        """异步批量翻译（在独立线程池中运行）"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self.translate_many_sync, list(texts))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -1,47 +1,27 @@
-import edge_tts
 import asyncio
-import yaml  
-import time  
-import json  
 import os
-  
-base_dir = os.path.dirname(os.path.abspath(__file__))  
-os.chdir(base_dir)  
-  
-config = {}  
-try:  
-    with open('config.yaml', 'r', encoding='utf-8') as f:  
-        config = yaml.safe_load(f)  
-except:  
-    pass  
-  
-# config  
-today = time.strftime("%Y-%m-%d", time.localtime(time.time()))  
-texts_dir = f'{config["source_dir"]}/{today}/texts.json'  
-outputs_dir = f'{base_dir}/{config["source_dir"]}/{today}/voices'  
-  
-# 获取文案列表和输出音频路径列表  
-texts = []  
-try:  
-    with open(f'{config["source_dir"]}/{today}/texts.json', 'r', encoding='utf-8') as f:  
-        texts = json.load(f)  
-except:  
-    pass  
-  
-voice_output_dir = [f'{outputs_dir}/{i}.mp3' for i in range(len(texts))]  
-  
-try:  
-    os.makedirs(outputs_dir, exist_ok=True)  
-except:  
-    pass  
-  
+
+from context import get_context
+from ffmpeg_tools import probe_video
+import metrics
+import manifest
+
+
+@metrics.traced('tts')
 async def get_tts_voice(text, voice_output):
+    import edge_tts
     try:  
         voice = "zh-CN-XiaoxiaoNeural"  # 选择中文语音
         
         communicate = edge_tts.Communicate(text, voice)
-        await communicate.save(voice_output)  # 异步保存
+        with metrics.request('tts'):
+            await communicate.save(voice_output)  # 异步保存
         print(f"音频已保存至: {voice_output}")
+        try:
+            info = await asyncio.get_running_loop().run_in_executor(None, probe_video, voice_output)
+            metrics.inc('tts_audio_seconds_total', info['duration'])
+        except Exception:
+            pass
         return voice_output
     except Exception as e:
         print(f"处理文本 '{text[:50]}...' 时发生错误: {e}")
@@ -49,19 +29,30 @@ async def get_tts_voice(text, voice_output):
 
 
 async def main():
+    # 有文案、还没有配音的话题，音频按话题编号命名
+    context = get_context()
+    topics = manifest.open_manifest()
+    pending = topics.pending('tts')
+    outputs_dir = context.voices_dir
+    os.makedirs(outputs_dir, exist_ok=True)
+    
     # 创建所有任务的列表
     tasks = []
-    for i, (text, output_path) in enumerate(zip(texts, voice_output_dir)):
+    for i, topic in pending.items():
         # 为每个文本创建一个异步任务
-        task = asyncio.create_task(get_tts_voice(text, output_path))
+        task = asyncio.create_task(get_tts_voice(topic['text'], f'{outputs_dir}/{i}.mp3'))
         tasks.append(task)
     
     # 等待所有任务完成
     results = await asyncio.gather(*tasks, return_exceptions=True)
     
     # 检查结果
-    success_count = sum(1 for r in results if r is not None and not isinstance(r, Exception))
-    error_count = len(texts) - success_count
+    success_count = 0
+    for i, r in zip(pending, results):
+        if r is not None and not isinstance(r, Exception):
+            topics.append(i, 'tts', voice=r)
+            success_count += 1
+    error_count = len(pending) - success_count
     
     print(f"处理完成! 成功: {success_count}, 失败: {error_count}")
   
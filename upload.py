@@ -1,29 +1,13 @@
-from bilibili_api import video_uploader  
-from bilibili_api.utils.network import Credential  
-from bilibili_api.utils.picture import Picture  
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
 import asyncio
-import yaml
+import re
 import time
 import json
 import glob
 import os
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-config = {}
-with open('config.yaml', 'r', encoding='utf-8') as f:  
-    config = yaml.safe_load(f)  
-
-today = time.strftime('%Y-%m-%d', time.localtime())
-videos_folder = f'{config["source_dir"]}/{today}/videos_out'
-videos = sorted(glob.glob(os.path.join(videos_folder, "*.mp4")))
-
-datas_folder = f'{config["source_dir"]}/{today}/tags.json'
-datas = []
-with open(datas_folder, 'r', encoding='utf-8') as f:
-    datas = json.load(f)
-print(datas)
 
+from context import config, get_context
+import metrics
+import manifest
 
 
 async def cookie2dict(cookie:str) -> dict:
@@ -37,59 +21,89 @@ async def cookie2dict(cookie:str) -> dict:
     return cookie_dict
 
 
-def generate_cover_from_video(video_path: str, time_position: float = 5.0) -> Picture:  
+async def make_credential(cookie: str) -> 'Credential':
+    """由 cookie 字符串创建凭据（整批上传共用一个）"""
+    from bilibili_api.utils.network import Credential
+    cookie = await cookie2dict(cookie)
+    return Credential(
+        sessdata=cookie['sessdata'],
+        bili_jct=cookie['bili_jct'],
+        buvid3=cookie['buvid3'],
+        dedeuserid=cookie['dedeuserid']
+    )
+
+
+class UploadLedger:
+    """
+    上传状态账本，按话题序号记录每个视频的上传状态，持久化到 JSON 文件
+    状态: pending -> uploading -> submitting -> submitted（带 BVID）；失败为 failed
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                print(f"读取上传账本失败，将重新记录: {e}")
+
+    def get(self, topic_id) -> dict:
+        return self.entries.setdefault(str(topic_id), {'state': 'pending'})
+
+    def update(self, topic_id, **values):
+        entry = self.get(topic_id)
+        entry.update(values)
+        entry['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        self.save()
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def generate_cover_from_video(video_path: str) -> 'Picture':  
     """  
-    从视频中截取一帧作为封面，直接返回 Picture 对象  
+    获取视频封面，直接返回 Picture 对象  
+    封面在渲染时或首次上传时用 ffmpeg 关键帧截取并打分选出，缓存在视频旁边  
       
     Args:  
         video_path: 视频文件路径  
-        time_position: 截取时间点（秒），默认第5秒  
       
     Returns:  
         Picture: 封面图片对象  
     """  
+    from bilibili_api.utils.picture import Picture
+    from cover import get_cover
     try:  
-        # 加载视频  
-        video = VideoFileClip(video_path)  
-          
-        # 确保时间点不超过视频长度  
-        if time_position > video.duration:  
-            time_position = video.duration / 2  
-          
-        # 截取指定时间的帧  
-        frame = video.get_frame(time_position)  
-          
-        # 转换为 PIL Image  
-        from PIL import Image  
-        import io  
-        img = Image.fromarray(frame)  
-          
-        # 转换为字节数据  
-        img_bytes = io.BytesIO()  
-        img.save(img_bytes, format='JPEG', quality=95)  
-        img_bytes.seek(0)  
-          
-        video.close()  
-          
-        # 直接创建 Picture 对象  
-        return Picture.from_content(img_bytes.getvalue(), 'jpg')  
+        cover_path = get_cover(video_path)  
+        with open(cover_path, 'rb') as f:  
+            return Picture.from_content(f.read(), 'jpg')  
           
     except Exception as e:  
         print(f"生成封面失败: {e}")  
         return None  
   
-async def upload2bili(video_path, data):  
-    cookie = await cookie2dict(config['bili_cookie'])  
-      
-    credential = Credential(  
-        sessdata=cookie['sessdata'],  
-        bili_jct=cookie['bili_jct'],  
-        buvid3=cookie['buvid3'],  
-        dedeuserid=cookie['dedeuserid']  
-    )  
+@metrics.traced('upload')
+async def upload2bili(video_path, data, credential=None, on_event=None):  
+    """
+    上传单个视频，返回 BVID
+    
+    Args:
+        credential: 共用的凭据，为None时由配置中的 cookie 创建
+        on_event: 上传事件回调 on_event(事件名, 数据)，用于记录分块进度
+    """
+    from bilibili_api import video_uploader
+    
+    if credential is None:
+        credential = await make_credential(config['bili_cookie'])
       
-    # 直接生成 Picture 对象  
-    cover = generate_cover_from_video(video_path)  
+    # 直接生成 Picture 对象（截取关键帧和打分是阻塞的 ffmpeg 调用，在线程池中运行，不阻塞其他上传）
+    loop = asyncio.get_running_loop()
+    cover = await loop.run_in_executor(None, generate_cover_from_video, video_path)
       
     if not cover:  
         raise Exception("封面生成失败")  
@@ -118,17 +132,126 @@ async def upload2bili(video_path, data):
         credential=credential  
     )  
     
+    uploader.add_event_listener(video_uploader.VideoUploaderEvents.AFTER_CHUNK.value,
+                                lambda d: metrics.inc('upload_chunks_total'))
+    if on_event is not None:
+        for event in (video_uploader.VideoUploaderEvents.AFTER_CHUNK,
+                      video_uploader.VideoUploaderEvents.AFTER_PAGE,
+                      video_uploader.VideoUploaderEvents.PRE_SUBMIT):
+            uploader.add_event_listener(event.value, lambda d, name=event.value: on_event(name, d))
+    
     # 开始上传  
-    result = await uploader.start()  
+    with metrics.request('upload'):
+        result = await uploader.start()  
+    metrics.inc('upload_bytes_total', os.path.getsize(video_path))
     print(f"上传成功！BVID: {result['bvid']}")
+    return result['bvid']
+
+
+def pair_videos_with_datas(video_paths, datas):
+    """
+    按话题编号（视频文件名 {编号}.mp4）配对视频和元数据
+
+    datas: {话题编号: 元数据}，即 TopicManifest.metadata()
+    """
+    pairs = []
+    for video_path in video_paths:
+        match = re.fullmatch(r'(\d+)\.mp4', os.path.basename(video_path))
+        if not match:
+            continue
+        topic_id = int(match.group(1))
+        if topic_id not in datas:
+            print(f"视频 {video_path} 没有对应的元数据，跳过")
+            continue
+        pairs.append((topic_id, video_path, datas[topic_id]))
+    return pairs
+
+
+class BatchUploader:
+    """
+    并发批量上传：共用一个凭据，限制同时上传的数量，
+    每个话题的状态写入账本，重新运行时跳过已提交的视频、重新上传中断的视频
+    
+    停在 submitting 的视频（提交请求已发出但没有收到结果，例如进程在提交时崩溃）可能已经投稿成功，
+    重新上传会在B站产生重复的稿件，默认跳过并提示人工确认；确认未投稿后用 retry_submitting 重新上传
+    
+    upload_func 可替换为本地替身，签名同 upload2bili
+    """
+
+    def __init__(self, credential, ledger: UploadLedger, concurrency: int = 2, upload_func=None,
+                 retry_submitting: bool = False):
+        self.credential = credential
+        self.ledger = ledger
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.upload_func = upload_func or upload2bili
+        self.retry_submitting = retry_submitting
+
+    async def upload_one(self, topic_id, video_path, data):
+        entry = self.ledger.get(topic_id)
+        if entry.get('state') == 'submitted':
+            print(f"第 {topic_id} 个视频已上传（{entry.get('bvid')}），跳过")
+            return entry.get('bvid')
+        if entry.get('state') == 'submitting':
+            if not self.retry_submitting:
+                print(f"警告: 第 {topic_id} 个视频上次停在提交阶段，可能已经投稿成功，跳过以免重复投稿；"
+                      f"请在B站创作中心确认标题为「{entry.get('title')}」的稿件不存在后，用 --retry-submitting 重新上传")
+                return None
+            print(f"第 {topic_id} 个视频上次停在提交阶段，已确认未投稿，重新上传")
+        elif entry.get('state') == 'uploading':
+            # 分块上传的 upload_id 无法跨进程恢复，中断的视频从头上传
+            print(f"第 {topic_id} 个视频上次上传中断（已完成 {entry.get('chunks_done', 0)} 块），重新上传")
+
+        def on_event(name, event_data):
+            if name == 'AFTER_CHUNK':
+                self.ledger.update(topic_id, chunks_done=self.ledger.get(topic_id).get('chunks_done', 0) + 1,
+                                   chunks_total=event_data.get('total_chunk_count'))
+            elif name == 'PRE_SUBMIT':
+                self.ledger.update(topic_id, state='submitting')
 
-async def main():
-    for video_path, data in zip(videos, datas):
-        try:
-            upload2bili(video_path, data)
-        except Exception as e:
-            print(f'上传B站失败：{e}')
+        async with self.semaphore:
+            self.ledger.update(topic_id, state='uploading', chunks_done=0, video=os.path.basename(video_path),
+                               title=data.get('title'), error=None)
+            try:
+                bvid = await self.upload_func(video_path, data, credential=self.credential, on_event=on_event)
+            except Exception as e:
+                # 提交请求发出后出错时无法确定是否已投稿，保留 submitting 状态
+                if self.ledger.get(topic_id).get('state') == 'submitting':
+                    self.ledger.update(topic_id, error=str(e))
+                    print(f'提交稿件时出错，无法确定是否已投稿：{e}')
+                else:
+                    self.ledger.update(topic_id, state='failed', error=str(e))
+                    print(f'上传B站失败：{e}')
+                return None
+            self.ledger.update(topic_id, state='submitted', bvid=bvid)
+            return bvid
+
+    async def run(self, pairs):
+        """上传所有 (话题序号, 视频路径, 元数据)，返回成功的数量"""
+        results = await asyncio.gather(*[self.upload_one(*pair) for pair in pairs])
+        return sum(1 for r in results if r)
+
+
+async def main(retry_submitting: bool = False):
+    context = get_context()
+    videos = sorted(glob.glob(os.path.join(context.videos_out_dir, "*.mp4")))
+    datas = manifest.open_manifest().metadata()
+    pairs = pair_videos_with_datas(videos, datas)
+    if not pairs:
+        print("没有需要上传的视频")
+        return
+    
+    credential = await make_credential(config['bili_cookie'])
+    ledger = UploadLedger(os.path.join(context.videos_out_dir, 'upload_ledger.json'))
+    uploader = BatchUploader(credential, ledger, config.get('upload_max_concurrent', 2),
+                             retry_submitting=retry_submitting)
+    success_count = await uploader.run(pairs)
+    print(f"上传完成! 成功: {success_count}, 失败或跳过: {len(pairs) - success_count}")
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='批量上传当天的视频')
+    parser.add_argument('--retry-submitting', action='store_true',
+                        help='重新上传停在提交阶段的视频（先确认B站上没有这些稿件）')
+    args = parser.parse_args()
+    asyncio.run(main(args.retry_submitting))